@@ -1,33 +1,102 @@
-from flask import Flask, request, jsonify
-from openai import OpenAI
+from flask import Flask, request, jsonify, Response, stream_with_context
+import hashlib
 import json
 import os
-from browserAPI import BrowserAPI  # Assuming browserAPI.py contains the updated BrowserAPI class
+from urllib.parse import urlsplit
+from browserAPI import BrowserAPI, parse_blocking_profiles, CONTENT_FORMATS, SETTLE_MODES  # Assuming browserAPI.py contains the updated BrowserAPI class
+from browserPool import BrowserPool
+from profileStore import ProfileStore
+from sessionReaper import SessionReaper
+from admission import AdmissionLimiter, AdmissionRejected
+from traceWriter import TraceWriter
+from metrics import MetricsRegistry
+from requestTrace import RequestTrace, activate, span, profile_call
+from llmBackends import OpenAIClientRegistry, create_async, create_backend
+from decisionCache import DecisionCache, CachingBackend
+from macroStore import MacroStore, SLOT_PATTERN, build_macro, instantiate, page_key
+from jobQueue import JobManager
+from asyncEngine import AsyncEngine
+from contextManager import ContextManager
 from dotenv import load_dotenv
 import threading
-from typing import Dict, Any, Optional, List
+import queue
+import time
+import atexit
+from typing import Dict, Any, Optional, List, Callable
 
 load_dotenv()
 
 app = Flask(__name__)
 
+# Page actions whose settle wait and content extraction can be shared when issued back-to-back
+BATCHABLE_ACTIONS = {"click_element", "input_text_element", "click_at_coordinates", "input_text_at_coordinates",
+                     "scroll_page"}
+
+# Prometheus metrics, served by /api/browser/metrics
+metrics_registry = MetricsRegistry()
+LLM_LATENCY = metrics_registry.histogram(
+    "browser_llm_request_seconds", "Latency of LLM calls", ("model", "status"))
+LLM_TOKENS = metrics_registry.counter(
+    "browser_llm_tokens_total", "Tokens reported by the Responses API usage", ("model", "direction"))
+TOOL_LATENCY = metrics_registry.histogram(
+    "browser_tool_seconds", "Latency of tool calls, including settle wait and extraction", ("tool", "status"))
+SETTLE_LATENCY = metrics_registry.histogram(
+    "browser_settle_seconds", "Time spent waiting for the page to settle after an action", ("mode",))
+EXTRACT_LATENCY = metrics_registry.histogram(
+    "browser_extract_seconds", "In-page element extraction time", ())
+PAGE_CONTENT_TOKENS = metrics_registry.histogram(
+    "browser_page_content_tokens", "Estimated tokens of the page content per snapshot", (),
+    buckets=(100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000))
+PAGE_CONTENT_ELEMENTS = metrics_registry.histogram(
+    "browser_page_content_elements", "Elements reported per snapshot", (),
+    buckets=(5, 10, 25, 50, 100, 200, 500, 1000))
+COMMAND_TURNS = metrics_registry.histogram(
+    "browser_command_turns", "LLM turns per command", ("status",),
+    buckets=(1, 2, 3, 5, 8, 10, 15, 20, 30))
+MACRO_RUNS = metrics_registry.counter(
+    "browser_macro_runs_total", "Macro replays by outcome", ("outcome",))
+MACRO_STEPS = metrics_registry.counter(
+    "browser_macro_steps_total", "Macro steps replayed without an LLM call", ())
+
 class BrowserLLM:
-    def __init__(self, api_key=None, driver_path=None):
-        """Initialize the BrowserLLM with OpenAI API key and optional ChromeDriver path."""
+    def __init__(self, api_key=None, driver_path=None, settle_mode="adaptive", diff_content=False,
+                 browser_pool=None, token_budget=None, content_format="verbose", max_content_tokens=None,
+                 headless=False, block_resources=None, profile_store=None, profile_id=None,
+                 browser_limiter=None, trace_writer=None, session_id=None, llm_backend=None):
+        """
+        Initialize the BrowserLLM with OpenAI API key, optional ChromeDriver path and page content options.
+        llm_backend: object with create(**request) returning a Responses API response (see llmBackends);
+        defaults to the live OpenAI API.
+        """
         self.api_key = api_key or os.environ.get("OPENAI_API_KEY")
-        if not self.api_key:
-            raise ValueError("OpenAI API key must be provided or set as OPENAI_API_KEY environment variable")
-
-        self.client = OpenAI(api_key=self.api_key)
-        self.browser = BrowserAPI(driver_path=driver_path)
+        self.llm = llm_backend or create_backend("openai", api_key=self.api_key)
+        self.browser = BrowserAPI(driver_path=driver_path, settle_mode=settle_mode, diff_content=diff_content,
+                                  pool=browser_pool, content_format=content_format,
+                                  max_content_tokens=max_content_tokens,
+                                  highlight=os.environ.get("HIGHLIGHT_TARGETS", "0") == "1",
+                                  headless=headless, block_resources=block_resources,
+                                  profile_store=profile_store, profile_id=profile_id)
         self.model = "gpt-4o"
         self.temperature = 0
-        self.messages = []
+        # Per-session JSONL trace of the messages of sampled commands
+        self.trace_writer = trace_writer
+        self.session_id = session_id
+        self._tracing = False
+        # Messages sent to the LLM, kept within a per-call token budget
+        self.context = ContextManager(
+            token_budget=token_budget or int(os.environ.get("CONTEXT_TOKEN_BUDGET", 60000)),
+            on_append=self._trace_message
+        )
         self.browser_started = False
+        # Admission limiter for live browsers; this session holds a slot while its browser runs
+        self.browser_limiter = browser_limiter
+        self.last_active = time.time()
+        # Successful steps of the last command that succeeded, for saving it as a macro
+        self.last_trajectory = None
         self.MAX_TURNS = 10  # Default number of interactions before stopping
 
         # --- System Prompt ---
-        self.messages.append({
+        self.context.append({
             "role": "system",
             "content": (
                 "You are a browser automation assistant. Your job is to control a browser "
@@ -35,18 +104,21 @@ class BrowserLLM:
                 "You have the following tools available:\n\n"
                 "- `start_browser`: Launch a new browser window.\n"
                 "- `go_to_website`: Navigate to a specific URL.\n"
+                "- `click_element`: Click an element by its highlight index from the page content.\n"
+                "- `input_text_element`: Input text into an element by its highlight index from the page content.\n"
                 "- `click_at_coordinates`: Click at specific coordinates (x, y) on the page.\n"
                 "- `input_text_at_coordinates`: Input text at specific coordinates (x, y) into an input field.\n"
                 "- `scroll_page`: Scroll the page by a specified amount of pixels.\n"
                 "- `refresh_content`: Get the current page content without performing any other action.\n"
+                "- `perform_actions`: Run several clicks, text inputs and scrolls on the current page in one step.\n"
                 "- `close_browser`: Close the browser.\n\n"
                 "Guidelines:\n"
                 "1. Always start by launching the browser if it's not already running (`start_browser`).\n"
-                "2. After navigating, clicking, typing, or scrolling, you will receive feedback including the status of the action and the **updated page content** (URL, title, visible interactive elements with their coordinates and highlight index like '[index] <tag...> text (at x:..., y:...)').\n"
+                "2. After navigating, clicking, typing, or scrolling, you will receive feedback including the status of the action and the **updated page content** (URL, title, visible interactive elements with their coordinates and highlight index like '[index] <tag...> text (at x:..., y:...)', or compact rows described by the `columns` field).\n"
                 "3. When the user asks to click or type on something (e.g., 'click the login button', 'type 'hello' into the search bar'), examine the **most recent page content** provided in the previous step's result to find the target element and its coordinates (x, y).\n"
-                "4. Use the coordinates from the page content to call `click_at_coordinates` or `input_text_at_coordinates`.\n"
+                "4. Prefer `click_element` / `input_text_element` with the element's highlight index; they keep working when the layout shifts. Use the coordinates from the page content with `click_at_coordinates` or `input_text_at_coordinates` only when there is no suitable index.\n"
                 "5. If the target element is not visible, consider using `scroll_page` (usually scrolling down, e.g., y=500 or y=1000) and then check the new page content in the result.\n"
-                "6. Only perform **one action** at a time. Decide the next single step based on the user request and the current page state.\n"
+                "6. Only perform **one action** at a time. Decide the next single step based on the user request and the current page state. The exception is a group of independent actions on the current page (e.g., typing a username and a password): send them together with `perform_actions` and you will get the page content once, after the last one.\n"
                 "7. Explain clearly which action you are taking and why, referencing the element or coordinates if applicable.\n"
                 "8. If the browser isn't started, your first action must be `start_browser`.\n"
                 "9. Your responses should indicate the action you are taking, but the actual execution result will come in the next turn as function output.\n"
@@ -56,6 +128,7 @@ class BrowserLLM:
                 "13. **Pop-Up / Modal Interaction Handling:** If an action (e.g., Add to cart, Confirm, Continue) appears to be within a modal or pop-up (identified by elements like `a-popover-start`, close buttons, or modal-like containers), assume the interaction must be confirmed **within the pop-up**. After clicking the action button inside the modal, always follow up with `refresh_content` to verify the modal has closed **and** the action was successfully applied (e.g., item added to cart). Do **not** mark the task as complete until the modal has closed and the result is confirmed in the updated page content."
                 "14. **Login Authentication:** When attempting to log in, always use **password-based login** only. Do **not** proceed with OTP, biometric, or alternative login methods. Select password and option, and THEN INPUT PASSWORD in the PASSWORD INPUT FIELD."
                 "15. **Don’t Loop on the Same Element – Move Forward:** If you’ve already interacted with an element (e.g., `password`), don’t repeat it—check the element list and proceed to the next required step (e.g., `pd-input`). Repeating an action usually means you’ve missed another needed input or interaction."
+                "16. **Page Content Diffs:** Page content with `\"mode\": \"diff\"` only lists the `added` and `changed` elements and the `removed` highlight indexes relative to the most recent page content with `\"mode\": \"full\"`. Highlight indexes are stable, so combine both to know the current page state."
             )
         })
 
@@ -86,6 +159,40 @@ class BrowserLLM:
                     "required": ["url"]
                 }
             },
+            {
+                "type": "function",
+                "name": "click_element",
+                "description": "Click the element with the given highlight index from the latest page content.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "index": {
+                            "type": "integer",
+                            "description": "Highlight index of the element, e.g. 12 for '[12] <button...>'"
+                        }
+                    },
+                    "required": ["index"]
+                }
+            },
+            {
+                "type": "function",
+                "name": "input_text_element",
+                "description": "Input text into the element with the given highlight index from the latest page content.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "index": {
+                            "type": "integer",
+                            "description": "Highlight index of the input element"
+                        },
+                        "text": {
+                            "type": "string",
+                            "description": "The text to input"
+                        }
+                    },
+                    "required": ["index", "text"]
+                }
+            },
             {
                 "type": "function",
                 "name": "click_at_coordinates",
@@ -159,6 +266,48 @@ class BrowserLLM:
                     "required": []
                 }
             },
+            {
+                "type": "function",
+                "name": "perform_actions",
+                "description": "Run several clicks, text inputs and scrolls on the current page back-to-back (e.g., fill a login form), then return the page content once. Stops at the first failing action. Only batch actions whose targets are already known from the latest page content.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "actions": {
+                            "type": "array",
+                            "description": "Actions to run in order",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "action": {
+                                        "type": "string",
+                                        "enum": ["click", "input", "scroll"],
+                                        "description": "click or input text on an element (by index, or at x, y), or scroll by (x, y) pixels"
+                                    },
+                                    "index": {
+                                        "type": "integer",
+                                        "description": "Highlight index of the element to click or type into (preferred over x, y)"
+                                    },
+                                    "x": {
+                                        "type": "number",
+                                        "description": "X coordinate from page content, or horizontal scroll amount"
+                                    },
+                                    "y": {
+                                        "type": "number",
+                                        "description": "Y coordinate from page content, or vertical scroll amount"
+                                    },
+                                    "text": {
+                                        "type": "string",
+                                        "description": "The text to input (input actions only)"
+                                    }
+                                },
+                                "required": ["action"]
+                            }
+                        }
+                    },
+                    "required": ["actions"]
+                }
+            },
             {
                 "type": "function",
                 "name": "close_browser",
@@ -171,50 +320,32 @@ class BrowserLLM:
             }
         ]
 
-    def clear_old_page_content(self):
-        """Clear old page content to reduce token usage, keeping only the two most recent ones."""
-        page_content_indices = []
-        
-        # First, identify all messages containing page content
-        for index, msg in enumerate(self.messages):
-            if (isinstance(msg, dict) and 
-                msg.get("type") == "function_call_output" and 
-                isinstance(msg.get("output"), str) and 
-                "<page_content>" in msg["output"] and 
-                "</page_content>" in msg["output"]):
-                page_content_indices.append(index)
-        
-        # If there are more than two such messages, clear all but the last two
-        if len(page_content_indices) > 2:
-            # Get indices of messages to clear (all except the last two)
-            indices_to_clear = page_content_indices[:-2]
-            
-            # Clear the content in those messages
-            for index in indices_to_clear:
-                # Replace only the content between <page_content> tags
-                original_output = self.messages[index]["output"]
-                start_tag_pos = original_output.find("<page_content>")
-                end_tag_pos = original_output.find("</page_content>")
-                
-                if start_tag_pos != -1 and end_tag_pos != -1:
-                    # Preserve the tags but replace content between them
-                    new_output = (
-                        original_output[:start_tag_pos + len("<page_content>")] + 
-                        "Cleared to reduce tokens" + 
-                        original_output[end_tag_pos:]
-                    )
-                    self.messages[index]["output"] = new_output
-            
-            print(f"INFO: Cleared content from {len(indices_to_clear)} older page_content messages.")
+    @property
+    def messages(self):
+        """The message list sent to the LLM (owned by the context manager)."""
+        return self.context.messages
 
-    def call_function(self, name, args):
-        """Execute the appropriate browser function based on the name and arguments."""
+    def call_function(self, name, args, snapshot=True, expect=None):
+        """
+        Execute the appropriate browser function based on the name and arguments.
+        snapshot=False skips the settle wait and page content of click/input/scroll
+        when another page action follows in the same batch.
+        expect: recorded target descriptor of click_element/input_text_element (a list,
+        one per action, for perform_actions); a different element fails the call.
+        """
         try:
             # Branch based on function name
             if name == "start_browser":
+                if self.browser_limiter:
+                    try:
+                        self.browser_limiter.acquire(self)
+                    except AdmissionRejected as e:
+                        return {"status": "error", "error_message": f"{e}. The server is at browser capacity, try again later."}
                 result = self.browser.start_browser()
                 if result.get("status") == "success":
                     self.browser_started = True
+                elif not self.browser_started:
+                    self.release_browser_slot()
                     
             elif not self.browser_started:
                 return {"status": "error", "error_message": "Browser not started. Please call start_browser first."}
@@ -225,22 +356,47 @@ class BrowserLLM:
                     return {"status": "error", "error_message": "Invalid or missing URL. Please provide a full URL starting with http:// or https://."}
                 result = self.browser.go_to_website(url)
                 
+            elif name == "click_element":
+                index = args.get("index")
+                if index is None:
+                    return {"status": "error", "error_message": "Missing element index for click."}
+                result = self.browser.click_element(int(index), snapshot=snapshot, expect=expect)
+                
+            elif name == "input_text_element":
+                index = args.get("index")
+                text = args.get("text", "")
+                if index is None:
+                    return {"status": "error", "error_message": "Missing element index for input."}
+                result = self.browser.input_text_element(int(index), text, snapshot=snapshot, expect=expect)
+                
             elif name == "click_at_coordinates":
                 x, y = args.get("x"), args.get("y")
                 if x is None or y is None:
                     return {"status": "error", "error_message": "Missing x or y coordinate for click."}
-                result = self.browser.click_at_coordinates(float(x), float(y))
+                result = self.browser.click_at_coordinates(float(x), float(y), snapshot=snapshot)
                 
             elif name == "input_text_at_coordinates":
                 x, y = args.get("x"), args.get("y")
                 text = args.get("text", "")
                 if x is None or y is None:
                     return {"status": "error", "error_message": "Missing x or y coordinate for input."}
-                result = self.browser.input_text_at_coordinates(float(x), float(y), text)
+                result = self.browser.input_text_at_coordinates(float(x), float(y), text, snapshot=snapshot)
                 
             elif name == "scroll_page":
                 x, y = args.get("x", 0), args.get("y", 500)
-                result = self.browser.scroll_page(x=int(x), y=int(y))
+                result = self.browser.scroll_page(x=int(x), y=int(y), snapshot=snapshot)
+                
+            elif name == "perform_actions":
+                actions = args.get("actions")
+                if not actions or not isinstance(actions, list):
+                    return {"status": "error", "error_message": "actions must be a non-empty list."}
+                for index, action in enumerate(actions):
+                    if not isinstance(action, dict) or action.get("action") not in ("click", "input", "scroll"):
+                        return {"status": "error", "error_message": f"Action {index + 1} must have action 'click', 'input' or 'scroll'."}
+                    if (action["action"] != "scroll" and action.get("index") is None and
+                            (action.get("x") is None or action.get("y") is None)):
+                        return {"status": "error", "error_message": f"Missing index or x/y coordinates for action {index + 1}."}
+                result = self.browser.perform_actions(actions, expect=expect)
                 
             elif name == "refresh_content":
                 result = self.browser.refresh_content()
@@ -251,6 +407,7 @@ class BrowserLLM:
                 result = self.browser.close_browser()
                 if result.get("status") == "success":
                     self.browser_started = False
+                    self.release_browser_slot()
                     
             else:
                 result = {"status": "error", "error_message": f"Unknown function: {name}"}
@@ -261,6 +418,15 @@ class BrowserLLM:
             print(f"Error calling function {name} with args {args}: {e}")
             return {"status": "error", "error_message": f"Internal error executing {name}: {str(e)}"}
 
+    def release_browser_slot(self):
+        """Give the live browser slot back (no-op without a limiter or slot)."""
+        if self.browser_limiter:
+            self.browser_limiter.release(self)
+
+    def touch(self):
+        """Record activity so the idle reaper leaves this session alone."""
+        self.last_active = time.time()
+
     def set_max_turns(self, max_turns: int):
         """Set maximum number of turns for interaction."""
         if max_turns < 1:
@@ -268,33 +434,152 @@ class BrowserLLM:
         self.MAX_TURNS = max_turns
         return {"status": "success", "message": f"MAX_TURNS set to {max_turns}"}
 
-    def process_user_input(self, user_input: str) -> Dict:
-        """Process user input, let the LLM decide the next action, execute it, and return detailed results."""
-        self.messages.append({"role": "user", "content": user_input})
+    def _emit(self, on_event, event_type, **data):
+        """Send a progress event to the listener, never letting it break the turn loop."""
+        if on_event is None:
+            return
+        try:
+            on_event({"event": event_type, **data})
+        except Exception as e:
+            print(f"Error delivering {event_type} event: {e}")
+
+    def process_user_input(self, user_input: str, cancel_event: Optional[threading.Event] = None,
+                           on_event: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """
+        Process user input, let the LLM decide the next action, execute it, and return detailed results.
+        If cancel_event is set, processing stops before the next turn.
+        on_event, if given, receives a dict per LLM decision and per tool call start/finish.
+        """
+        return self._run(self._command_steps(user_input, cancel_event, on_event))
+
+    async def process_user_input_async(self, user_input: str, offload: Callable,
+                                       cancel_event: Optional[threading.Event] = None,
+                                       on_event: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """
+        process_user_input on an event loop: LLM calls are awaited and blocking browser
+        calls go through offload(func, *args), e.g. AsyncEngine.offload.
+        """
+        return await self._run_async(self._command_steps(user_input, cancel_event, on_event), offload)
+
+    def run_macro(self, user_input: str, macro: Dict, params: Dict[str, str],
+                  cancel_event: Optional[threading.Event] = None,
+                  on_event: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """
+        Replay a saved macro directly through the browser, without LLM calls. After each
+        step the page must be the one the recorded run reached; from the first step that
+        fails or lands elsewhere, the LLM loop takes over with the replayed steps as context.
+        Returns the same dict as process_user_input plus a "macro" summary.
+        """
+        return self._run(self._macro_steps(user_input, macro, params, cancel_event, on_event))
+
+    async def run_macro_async(self, user_input: str, macro: Dict, params: Dict[str, str], offload: Callable,
+                              cancel_event: Optional[threading.Event] = None,
+                              on_event: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """run_macro on an event loop, see process_user_input_async."""
+        return await self._run_async(self._macro_steps(user_input, macro, params, cancel_event, on_event), offload)
+
+    def _run(self, steps):
+        """
+        Drive a command generator: perform each effect it yields, ("llm", request) or
+        ("call", func, args), and send back the result (or throw the exception).
+        """
+        value, error = None, None
+        while True:
+            try:
+                effect = steps.throw(error) if error is not None else steps.send(value)
+            except StopIteration as stop:
+                return stop.value
+            value, error = None, None
+            try:
+                if effect[0] == "llm":
+                    value = self.llm.create(**effect[1])
+                else:
+                    value = effect[1](*effect[2])
+            except Exception as e:
+                error = e
+
+    async def _run_async(self, steps, offload):
+        """
+        _run with awaited LLM calls and offloaded browser calls. Settle waits are
+        deferred out of the browser calls and awaited here, so they hold no thread.
+        """
+        value, error = None, None
+        self.browser.defer_settle = True
+        try:
+            while True:
+                try:
+                    effect = steps.throw(error) if error is not None else steps.send(value)
+                except StopIteration as stop:
+                    return stop.value
+                value, error = None, None
+                try:
+                    if effect[0] == "llm":
+                        value = await create_async(self.llm, **effect[1])
+                    else:
+                        value = await offload(effect[1], *effect[2])
+                        if self.browser.deferred_settle is not None:
+                            value = await self.browser.finish_deferred_settle(value, offload)
+                except Exception as e:
+                    self.browser.deferred_settle = None
+                    error = e
+        finally:
+            self.browser.defer_settle = False
+            self.browser.deferred_settle = None
+
+    def _command_steps(self, user_input, cancel_event=None, on_event=None):
+        """The turn loop as a generator of LLM and browser effects, run by _run or _run_async."""
+        self._tracing = self.trace_writer is not None and self.trace_writer.sample()
+        self.context.append({"role": "user", "content": user_input})
         final_response_text = None
         responses_history = []
         actions_history = []
+        trajectory = []
+        self.last_trajectory = None
 
         for turn in range(self.MAX_TURNS):
+            if cancel_event is not None and cancel_event.is_set():
+                cancel_message = "Task cancelled before completion."
+                self.context.append({"role": "assistant", "content": cancel_message})
+                self._end_command("cancelled", turn)
+                responses_history.append({
+                    "turn": turn + 1,
+                    "type": "cancelled",
+                    "content": cancel_message
+                })
+                return {
+                    "status": "cancelled",
+                    "message": cancel_message,
+                    "final_response": cancel_message,
+                    "history": responses_history,
+                    "actions": actions_history
+                }
+
             print(f"\n--- Turn {turn + 1}/{self.MAX_TURNS} ---")
             
-            # Clear old page content before each LLM call to reduce tokens
-            self.clear_old_page_content()
+            # Clear old page content and summarize old commands to stay within the token budget
+            with span("context.compact", turn=turn + 1):
+                compaction = self.context.compact()
+            if compaction["pinned_dropped"]:
+                # The full snapshot diffs refer to is gone, resync on the next snapshot
+                self.browser.invalidate_snapshot()
             
             try:
                 # Call the LLM with current messages
-                response = self.client.responses.create(
-                    model=self.model,
-                    input=self.messages,
-                    temperature=self.temperature,
-                    tools=self.tools,
-                    tool_choice="auto"
-                )
+                llm_started = time.monotonic()
+                with span("llm.call", turn=turn + 1, model=self.model):
+                    response = yield ("llm", {
+                        "model": self.model,
+                        "input": self.messages,
+                        "temperature": self.temperature,
+                        "tools": self.tools,
+                        "tool_choice": "auto"
+                    })
             except Exception as e:
+                LLM_LATENCY.observe(time.monotonic() - llm_started, model=self.model, status="error")
                 error_msg = f"Error calling OpenAI API: {e}"
                 print(error_msg)
-                self.messages.append({"role": "assistant", "content": error_msg})
-                self._dump_messages()
+                self.context.append({"role": "assistant", "content": error_msg})
+                self._end_command("error", turn + 1)
                 return {
                     "status": "error", 
                     "message": error_msg,
@@ -303,6 +588,11 @@ class BrowserLLM:
                     "actions": actions_history
                 }
 
+            # A decision cache hit made no API call, so it counts toward neither metric
+            if not getattr(response, "cached", False):
+                LLM_LATENCY.observe(time.monotonic() - llm_started, model=self.model, status="success")
+                self._record_usage(response)
+
             # Extract text content and tool calls from response
             tool_calls = []
             assistant_message_content = ""
@@ -321,7 +611,7 @@ class BrowserLLM:
                 if assistant_message_content:
                     last_msg = self.messages[-1] if self.messages else {}
                     if not (last_msg.get("role") == "assistant" and last_msg.get("content") == assistant_message_content):
-                        self.messages.append({"role": "assistant", "content": assistant_message_content})
+                        self.context.append({"role": "assistant", "content": assistant_message_content})
                         print(f"LLM thought/explanation: {assistant_message_content}")
                         responses_history.append({
                             "turn": turn + 1, 
@@ -329,13 +619,30 @@ class BrowserLLM:
                             "content": assistant_message_content
                         })
 
+            self._emit(
+                on_event, "llm_decision",
+                turn=turn + 1,
+                content=assistant_message_content,
+                tool_calls=[{"function": call.name, "arguments": call.arguments} for call in tool_calls],
+                duration_ms=round((time.monotonic() - llm_started) * 1000)
+            )
+
             # Handle tool calls if any
             if tool_calls:
                 # Add tool call intentions to messages
-                self.messages.extend(tool_calls)
+                self.context.extend(tool_calls)
 
-                for tool_call in tool_calls:
+                # Consecutive page actions run back-to-back; only the last one waits and extracts content
+                batch_pending = False
+                for call_index, tool_call in enumerate(tool_calls):
                     function_name = tool_call.name
+                    has_page_content = False
+                    is_full_snapshot = False
+                    defer_snapshot = (
+                        function_name in BATCHABLE_ACTIONS and
+                        call_index + 1 < len(tool_calls) and
+                        tool_calls[call_index + 1].name in BATCHABLE_ACTIONS
+                    )
                     try:
                         function_args = json.loads(tool_call.arguments) if tool_call.arguments else {}
                     except (json.JSONDecodeError, TypeError) as e:
@@ -351,11 +658,43 @@ class BrowserLLM:
                             "arguments": function_args
                         })
                         
-                        function_result = self.call_function(function_name, function_args)
+                        self._emit(on_event, "tool_start", turn=turn + 1,
+                                   function=function_name, arguments=function_args)
+                        tool_started = time.monotonic()
+                        # Only snapshots taken by this call show up in the extraction metrics
+                        self.browser.last_content_stats = None
+                        with span("call_function", turn=turn + 1, function=function_name,
+                                  snapshot=not defer_snapshot) as call_span:
+                            function_result = yield ("call", self.call_function,
+                                                     (function_name, function_args, not defer_snapshot))
+                            if call_span is not None:
+                                call_span["status"] = function_result.get("status", "unknown")
+                        if (batch_pending and not defer_snapshot and
+                                function_result.get("status") != "success" and "content" not in function_result):
+                            # The batch ended in an error; still show the page the earlier actions produced
+                            refreshed = yield ("call", self.browser.refresh_content, ())
+                            if refreshed.get("status") == "success":
+                                function_result["content"] = refreshed["content"]
+                        batch_pending = defer_snapshot
+                        self._record_tool_metrics(function_name, function_result, time.monotonic() - tool_started)
+                        self._record_step(trajectory, function_name, function_args, function_result)
                         print(f"Function result: {function_result}")
+                        self._emit(
+                            on_event, "tool_end",
+                            turn=turn + 1,
+                            function=function_name,
+                            status=function_result.get("status", "unknown"),
+                            message=function_result.get("message", function_result.get("error_message")),
+                            duration_ms=round((time.monotonic() - tool_started) * 1000)
+                        )
 
                         # Format the function result for the LLM
-                        if function_result.get("status") == "success":
+                        if function_result.get("status") == "success" and defer_snapshot and "content" not in function_result:
+                            result_content = f"Status: Success. Message: {function_result.get('message', 'Action completed.')} Page content follows after the last action of this batch."
+                        elif function_result.get("status") == "success":
+                            content = function_result.get("content")
+                            has_page_content = True
+                            is_full_snapshot = isinstance(content, dict) and content.get("mode") == "full"
                             try:
                                 page_content_str = json.dumps(function_result.get("content", "No content available"))
                             except TypeError:
@@ -363,6 +702,15 @@ class BrowserLLM:
                             result_content = f"Status: Success. Message: {function_result.get('message', 'Action completed.')}\n<page_content>\n{page_content_str}\n</page_content>"
                         else:
                             result_content = f"Status: Error. Error Message: {function_result.get('error_message', 'Unknown error occurred.')}"
+                            if "content" in function_result:
+                                content = function_result["content"]
+                                has_page_content = True
+                                is_full_snapshot = isinstance(content, dict) and content.get("mode") == "full"
+                                try:
+                                    page_content_str = json.dumps(content)
+                                except TypeError:
+                                    page_content_str = str(content)
+                                result_content += f"\n<page_content>\n{page_content_str}\n</page_content>"
 
                     # Add function result to messages
                     function_output = {
@@ -370,7 +718,10 @@ class BrowserLLM:
                         "call_id": tool_call.call_id,
                         "output": result_content
                     }
-                    self.messages.append(function_output)
+                    self.context.append(function_output, page_content=has_page_content)
+                    if is_full_snapshot:
+                        # New diff baseline; keep it readable while diffs refer to it
+                        self.context.pin(function_output)
                     
                     # Record the result in history
                     responses_history.append({
@@ -387,7 +738,7 @@ class BrowserLLM:
                 # Add final response to messages if not empty and not duplicate
                 last_msg = self.messages[-1] if self.messages else {}
                 if final_response_text and not (last_msg.get("role") == "assistant" and last_msg.get("content") == final_response_text):
-                    self.messages.append({"role": "assistant", "content": final_response_text})
+                    self.context.append({"role": "assistant", "content": final_response_text})
                 
                 if final_response_text:
                     print(f"LLM final response: {final_response_text}")
@@ -396,7 +747,8 @@ class BrowserLLM:
                         "type": "final_response",
                         "content": final_response_text
                     })
-                    self._dump_messages()
+                    self._end_command("success", turn + 1)
+                    self.last_trajectory = trajectory
                     return {
                         "status": "success",
                         "message": "Task completed successfully",
@@ -413,13 +765,13 @@ class BrowserLLM:
             # Don't append the max turns message if the last turn already provided a final response
             pass
         elif final_response_text:
-            self.messages.append({"role": "assistant", "content": final_response_text})
+            self.context.append({"role": "assistant", "content": final_response_text})
             final_message = final_response_text + "\n(Maximum interaction turns reached)"
-            self.messages.append({"role": "assistant", "content": "(Maximum interaction turns reached)"})
+            self.context.append({"role": "assistant", "content": "(Maximum interaction turns reached)"})
         else:
-            self.messages.append({"role": "assistant", "content": final_message})
+            self.context.append({"role": "assistant", "content": final_message})
 
-        self._dump_messages()
+        self._end_command("max_turns_reached", self.MAX_TURNS)
         responses_history.append({
             "turn": self.MAX_TURNS,
             "type": "max_turns_reached",
@@ -433,51 +785,197 @@ class BrowserLLM:
             "actions": actions_history
         }
 
+    def _macro_steps(self, user_input, macro, params, cancel_event=None, on_event=None):
+        """Macro replay as a generator of browser effects, see run_macro."""
+        self._tracing = self.trace_writer is not None and self.trace_writer.sample()
+        self._trace({"type": "macro_start", "name": macro["name"], "params": params})
+        responses_history = []
+        actions_history = []
+        trajectory = []
+        replayed = []
+        divergence = None
+
+        for step_number, step in enumerate(macro["steps"], 1):
+            if cancel_event is not None and cancel_event.is_set():
+                cancel_message = "Task cancelled before completion."
+                self.context.extend([{"role": "user", "content": user_input},
+                                     {"role": "assistant", "content": cancel_message}])
+                self._end_command("cancelled", 0)
+                MACRO_RUNS.inc(outcome="cancelled")
+                responses_history.append({"turn": 0, "type": "cancelled", "content": cancel_message})
+                return {
+                    "status": "cancelled",
+                    "message": cancel_message,
+                    "final_response": cancel_message,
+                    "history": responses_history,
+                    "actions": actions_history,
+                    "macro": {"name": macro["name"], "steps_replayed": len(replayed), "diverged_at": None}
+                }
+
+            function_name = step["function"]
+            function_args, expected_page = instantiate(step, params)
+            if function_name == "start_browser" and self.browser_started:
+                continue
+
+            print(f"Macro {macro['name']} step {step_number}: {function_name}({function_args})")
+            actions_history.append({"turn": 0, "function": function_name, "arguments": function_args,
+                                    "macro_step": step_number})
+            self._emit(on_event, "tool_start", turn=0, function=function_name, arguments=function_args,
+                       macro_step=step_number)
+            tool_started = time.monotonic()
+            self.browser.last_content_stats = None
+            with span("macro.step", step=step_number, function=function_name) as step_span:
+                # The recorded targets guard index steps against shifted highlight indexes
+                function_result = yield ("call", self.call_function,
+                                         (function_name, function_args, True, step.get("target")))
+                if step_span is not None:
+                    step_span["status"] = function_result.get("status", "unknown")
+            self._record_tool_metrics(function_name, function_result, time.monotonic() - tool_started)
+            self._emit(
+                on_event, "tool_end",
+                turn=0,
+                function=function_name,
+                status=function_result.get("status", "unknown"),
+                message=function_result.get("message", function_result.get("error_message")),
+                duration_ms=round((time.monotonic() - tool_started) * 1000),
+                macro_step=step_number
+            )
+            responses_history.append({
+                "turn": 0,
+                "type": "function_result",
+                "function": function_name,
+                "status": function_result.get("status", "unknown"),
+                "message": function_result.get("message", function_result.get("error_message", "No message"))
+            })
+
+            content = function_result.get("content")
+            actual_page = page_key(content["url"]) if isinstance(content, dict) and content.get("url") else None
+            if function_result.get("status") != "success":
+                divergence = f"it failed: {function_result.get('error_message', 'unknown error')}"
+            elif expected_page and actual_page and actual_page != expected_page:
+                divergence = f"it reached {actual_page} instead of {expected_page}"
+            if divergence:
+                divergence = {"step": step_number, "function": function_name, "reason": divergence}
+                break
+
+            MACRO_STEPS.inc()
+            self._record_step(trajectory, function_name, function_args, function_result)
+            replayed.append(f"{step_number}. {function_name}({json.dumps(function_args)})")
+
+        if divergence is None:
+            final_message = f"Completed by replaying the saved macro '{macro['name']}' ({len(replayed)} steps)."
+            self.context.extend([{"role": "user", "content": user_input},
+                                 {"role": "assistant", "content": final_message}])
+            self._end_command("success", 0)
+            MACRO_RUNS.inc(outcome="replayed")
+            self.last_trajectory = trajectory
+            responses_history.append({"turn": 0, "type": "final_response", "content": final_message})
+            return {
+                "status": "success",
+                "message": "Task completed by macro replay",
+                "final_response": final_message,
+                "history": responses_history,
+                "actions": actions_history,
+                "macro": {"name": macro["name"], "steps_replayed": len(replayed), "diverged_at": None}
+            }
+
+        # Hand over to the LLM from the diverging step; it sees what was already done
+        print(f"Macro {macro['name']} diverged at step {divergence['step']}: {divergence['reason']}")
+        self._trace({"type": "macro_diverged", **divergence})
+        MACRO_RUNS.inc(outcome="diverged")
+        responses_history.append({"turn": 0, "type": "macro_diverged", "content": divergence["reason"],
+                                  "step": divergence["step"]})
+        handover = (
+            f"{user_input}\n\n"
+            f"(These steps were already replayed from a saved macro:\n"
+            + ("\n".join(replayed) or "none") + "\n"
+            f"Step {divergence['step']} ({divergence['function']}) diverged: {divergence['reason']}. "
+            f"Call refresh_content and continue the task from the current page.)"
+        )
+        result = yield from self._command_steps(handover, cancel_event=cancel_event, on_event=on_event)
+        if self.last_trajectory is not None:
+            self.last_trajectory = trajectory + self.last_trajectory
+        result["history"] = responses_history + result["history"]
+        result["actions"] = actions_history + result["actions"]
+        result["macro"] = {"name": macro["name"], "steps_replayed": len(replayed), "diverged_at": divergence}
+        return result
+
+    def current_domain(self):
+        """Host of the page the browser shows, or None without a browser."""
+        if not self.browser_started or self.browser.driver is None:
+            return None
+        try:
+            return urlsplit(self.browser.driver.current_url).netloc or None
+        except Exception:
+            return None
+
     def reset_session(self):
         """Reset the session, clearing messages but preserving configuration."""
         # Keep the first system message only
-        if self.messages and self.messages[0].get("role") == "system":
-            system_message = self.messages[0]
-            self.messages = [system_message]
-        else:
-            self.messages = []
+        self.last_trajectory = None
+        self.context.reset()
+        self.browser.invalidate_snapshot()
         
         # Close browser if it's open
         if self.browser_started:
             close_result = self.call_function("close_browser", {})
             self.browser_started = False
+            self.release_browser_slot()
             return {"status": "success", "message": "Session reset and browser closed.", "close_result": close_result}
         return {"status": "success", "message": "Session reset."}
 
-    def _dump_messages(self):
-        """Safely dump messages history to a JSON file for debugging."""
-        try:
-            serializable_messages = []
-            for msg in self.messages:
-                if isinstance(msg, dict):
-                    serializable_messages.append(msg)
-                elif hasattr(msg, "model_dump"):
-                    serializable_messages.append(msg.model_dump())
-                elif hasattr(msg, "__dict__"):
-                    try:
-                        # Attempt to serialize vars, exclude unserializable if needed
-                        serializable_dict = {}
-                        for k, v in vars(msg).items():
-                            try:
-                                json.dumps(v)  # Test serializability
-                                serializable_dict[k] = v
-                            except (TypeError, OverflowError):
-                                serializable_dict[k] = f"<unserializable: {type(v).__name__}>"
-                        serializable_messages.append(serializable_dict)
-                    except TypeError:
-                        serializable_messages.append(str(msg))
-                else:
-                    serializable_messages.append(str(msg))
+    def _end_command(self, status, turns):
+        """Record how a command ended in the trace and the metrics."""
+        self._trace({"type": "command_end", "status": status, "turns": turns})
+        COMMAND_TURNS.observe(turns, status=status)
 
-            with open("messages_dump.json", "w", encoding="utf-8") as f:
-                json.dump(serializable_messages, f, indent=2, default=str)
-        except Exception as e:
-            print(f"Error dumping messages: {e}")
+    def _record_usage(self, response):
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return
+        for direction in ("input", "output"):
+            tokens = getattr(usage, f"{direction}_tokens", None)
+            if tokens:
+                LLM_TOKENS.inc(tokens, model=self.model, direction=direction)
+
+    def _record_tool_metrics(self, function_name, function_result, seconds):
+        # The name comes from the model; keep made-up ones from adding label values
+        tool = function_name if any(t["name"] == function_name for t in self.tools) else "unknown"
+        TOOL_LATENCY.observe(seconds, tool=tool, status=function_result.get("status", "unknown"))
+        settle = function_result.get("settle")
+        if isinstance(settle, dict) and settle.get("waited_ms") is not None:
+            SETTLE_LATENCY.observe(settle["waited_ms"] / 1000, mode=settle.get("mode", "unknown"))
+        stats = self.browser.last_content_stats
+        if stats:
+            if stats.get("extract_ms") is not None:
+                EXTRACT_LATENCY.observe(stats["extract_ms"] / 1000)
+            PAGE_CONTENT_TOKENS.observe(stats["tokens"])
+            PAGE_CONTENT_ELEMENTS.observe(stats["elements"])
+
+    def _record_step(self, trajectory, function_name, function_args, function_result):
+        """Keep a successful state-changing step, with the page it reached, for macros."""
+        if function_result.get("status") != "success" or function_name == "refresh_content":
+            return
+        content = function_result.get("content")
+        if function_name == "perform_actions":
+            target = [result.get("target") for result in function_result.get("results", [])]
+        else:
+            target = function_result.get("target")
+        trajectory.append({
+            "function": function_name,
+            "arguments": function_args,
+            "url": content.get("url") if isinstance(content, dict) else None,
+            "target": target
+        })
+
+    def _trace(self, record):
+        """Queue a trace record for this session if the current command is sampled."""
+        if self._tracing:
+            self.trace_writer.write(self.session_id, record)
+
+    def _trace_message(self, message):
+        # Dicts are copied because older page contents get cleared in place later
+        self._trace({"type": "message", "message": dict(message) if isinstance(message, dict) else message})
 
 # Global dictionary to store BrowserLLM instances by session_id
 browser_instances = {}
@@ -485,82 +983,629 @@ browser_instances = {}
 # Lock for thread-safe operations on the instances dictionary
 instances_lock = threading.Lock()
 
-@app.route('/api/browser/interact', methods=['POST'])
-def interact():
+# Warm Chrome drivers shared by all sessions (BROWSER_POOL_MIN=0 disables pre-launching)
+browser_pool = BrowserPool(
+    min_size=int(os.environ.get("BROWSER_POOL_MIN", 0)),
+    max_size=int(os.environ.get("BROWSER_POOL_MAX", 4)),
+    driver_path=os.environ.get("CHROMEDRIVER_PATH"),
+    headless=os.environ.get("BROWSER_HEADLESS", "0") == "1"
+)
+browser_pool.start()
+
+# Persistent user-data directories for sessions that send a profile_id
+profile_store = ProfileStore(
+    os.environ.get("PROFILE_DIR", "browser_profiles"),
+    max_profile_mb=int(os.environ.get("PROFILE_MAX_MB", 500)),
+    max_total_mb=int(os.environ.get("PROFILES_MAX_TOTAL_MB", 5000)),
+    ttl=int(os.environ.get("PROFILE_TTL_DAYS", 30)) * 24 * 3600
+)
+
+# Resource blocking for sessions that don't choose their own (e.g. "images,fonts,trackers")
+DEFAULT_BLOCK_RESOURCES = os.environ.get("BLOCK_RESOURCES", "")
+
+# How commands execute: "threads" runs each on a job worker thread (JOB_WORKERS at a time),
+# "async" runs them as coroutines on one event loop with browser calls on BROWSER_THREADS threads
+ENGINE = os.environ.get("ENGINE", "threads")
+if ENGINE not in ("threads", "async"):
+    raise ValueError("ENGINE must be threads or async")
+engine = None
+if ENGINE == "async":
+    engine = AsyncEngine(browser_threads=int(os.environ.get("BROWSER_THREADS", 32))).start()
+
+# Background jobs; commands of one session run in order, sessions run concurrently
+job_manager = JobManager(
+    max_workers=int(os.environ.get("JOB_WORKERS", 4)),
+    result_ttl=int(os.environ.get("JOB_RESULT_TTL", 3600)),
+    engine=engine
+)
+
+# Closes idle browsers, drops abandoned sessions and enforces live browser limits (0 disables a limit)
+session_reaper = SessionReaper(
+    browser_instances, instances_lock, job_manager,
+    browser_idle_ttl=int(os.environ.get("BROWSER_IDLE_TTL", 600)),
+    session_ttl=int(os.environ.get("SESSION_TTL", 3600)),
+    max_browsers=int(os.environ.get("MAX_LIVE_BROWSERS", 0)),
+    memory_budget_mb=int(os.environ.get("BROWSER_MEMORY_BUDGET_MB", 0)),
+    interval=float(os.environ.get("REAPER_INTERVAL", 30))
+)
+session_reaper.start()
+
+# Debug traces of sampled commands, one JSONL file per session (TRACE_SAMPLE_RATE=0 disables)
+trace_writer = TraceWriter(
+    os.environ.get("TRACE_DIR", "traces"),
+    max_queue=int(os.environ.get("TRACE_QUEUE", 10000)),
+    max_bytes=int(os.environ.get("TRACE_MAX_MB", 10)) * 1024 * 1024,
+    backups=int(os.environ.get("TRACE_BACKUPS", 3)),
+    compress=os.environ.get("TRACE_COMPRESS", "0") == "1",
+    sample_rate=float(os.environ.get("TRACE_SAMPLE_RATE", 1))
+)
+if trace_writer.sample_rate > 0:
+    trace_writer.start()
+    atexit.register(trace_writer.flush)
+
+# Gauges read at scrape time
+metrics_registry.gauge(
+    "browser_active_sessions", "Sessions with conversation state", (),
+    callback=lambda: {(): len(browser_instances)})
+metrics_registry.gauge(
+    "browser_active_browsers", "Sessions with a running browser", (),
+    callback=lambda: {(): sum(1 for browser_llm in list(browser_instances.values()) if browser_llm.browser_started)})
+metrics_registry.gauge(
+    "browser_pool_idle", "Warm browsers waiting in the pool", (),
+    callback=lambda: {(): browser_pool.stats()["idle"]})
+metrics_registry.gauge(
+    "browser_jobs", "Commands by job status", ("status",),
+    callback=lambda: {(status,): count for status, count in job_manager.stats().items() if status != "active_sessions"})
+
+# LLM backend for new sessions: "openai", "record" (OpenAI plus a JSONL recording of every
+# request/response pair) or "replay" (serve a recording offline, no API key needed)
+LLM_BACKEND = os.environ.get("LLM_BACKEND", "openai")
+LLM_REPLAY_LATENCY_MS = os.environ.get("LLM_REPLAY_LATENCY_MS", "0")
+
+# OpenAI clients shared by all sessions with the same API key, with keep-alive connection pools
+# (OPENAI_HTTP2: "auto" uses HTTP/2 when the h2 package is installed, "1" or "0" forces it)
+OPENAI_HTTP2 = os.environ.get("OPENAI_HTTP2", "auto")
+openai_clients = OpenAIClientRegistry(
+    max_connections=int(os.environ.get("OPENAI_MAX_CONNECTIONS", 100)),
+    max_keepalive=int(os.environ.get("OPENAI_MAX_KEEPALIVE", 20)),
+    keepalive_expiry=float(os.environ.get("OPENAI_KEEPALIVE_EXPIRY", 60)),
+    timeout=float(os.environ.get("OPENAI_TIMEOUT", 60)),
+    connect_timeout=float(os.environ.get("OPENAI_CONNECT_TIMEOUT", 5)),
+    http2=None if OPENAI_HTTP2 == "auto" else OPENAI_HTTP2 == "1",
+    max_retries=int(os.environ.get("OPENAI_MAX_RETRIES", 2))
+)
+atexit.register(openai_clients.close)
+
+# Shared cache of LLM decisions for repeated flows (DECISION_CACHE_SIZE=0 disables it)
+decision_cache = None
+if int(os.environ.get("DECISION_CACHE_SIZE", 0)) > 0:
+    decision_cache = DecisionCache(
+        max_entries=int(os.environ["DECISION_CACHE_SIZE"]),
+        ttl=int(os.environ.get("DECISION_CACHE_TTL", 24 * 3600)),
+        disk_dir=os.environ.get("DECISION_CACHE_DIR") or None
+    )
+    metrics_registry.counter(
+        "browser_decision_cache_lookups_total", "Decision cache lookups by result", ("result",),
+        callback=lambda: {(result,): decision_cache.stats()[key]
+                          for result, key in (("memory_hit", "memory_hits"), ("disk_hit", "disk_hits"),
+                                              ("miss", "misses"))})
+    metrics_registry.counter(
+        "browser_decision_cache_saved_seconds_total", "LLM latency saved by decision cache hits", (),
+        callback=lambda: {(): decision_cache.stats()["saved_ms"] / 1000})
+
+def _create_llm_backend(api_key, session_id):
+    backend = create_backend(
+        LLM_BACKEND,
+        api_key=api_key,
+        session_id=session_id,
+        record_path=os.environ.get("LLM_RECORD_PATH", "recordings/{session_id}.jsonl"),
+        replay_path=os.environ.get("LLM_REPLAY_PATH"),
+        replay_session=os.environ.get("LLM_REPLAY_SESSION") or None,
+        replay_latency_ms=None if LLM_REPLAY_LATENCY_MS == "recorded" else float(LLM_REPLAY_LATENCY_MS),
+        replay_jitter_ms=float(os.environ.get("LLM_REPLAY_JITTER_MS", 0)),
+        replay_loop=os.environ.get("LLM_REPLAY_LOOP", "0") == "1",
+        base_url=os.environ.get("OPENAI_BASE_URL") or None,
+        client_registry=openai_clients
+    )
+    if not decision_cache:
+        return backend
+    # Decisions carry typed text and page contents, so they are only shared within one API key
+    scope = hashlib.sha256(str(api_key).encode("utf-8")).hexdigest()
+    return CachingBackend(backend, decision_cache, scope=scope)
+
+# Saved command trajectories, replayed without the LLM. MACROS_AUTO=1 replays the macro whose
+# template matches a command even when the request doesn't name one
+macro_store = MacroStore(os.environ.get("MACRO_FILE", "macros.json"))
+MACROS_AUTO = os.environ.get("MACROS_AUTO", "0") == "1"
+
+# Where cProfile dumps of requests sent with "profile": true are written, and how many are kept
+PROFILE_OUTPUT_DIR = os.environ.get("PROFILE_OUTPUT_DIR", "request_profiles")
+PROFILE_MAX_FILES = int(os.environ.get("PROFILE_MAX_FILES", "100"))
+
+# Admission control: live browsers and in-flight commands (0 = no limit). Requests that can't get
+# a slot within ADMISSION_TIMEOUT, or find ADMISSION_QUEUE requests already waiting, are rejected
+ADMISSION_TIMEOUT = float(os.environ.get("ADMISSION_TIMEOUT", 10))
+browser_limiter = AdmissionLimiter(
+    "browser",
+    limit=int(os.environ.get("MAX_BROWSERS", 0)),
+    max_queue=int(os.environ.get("ADMISSION_QUEUE", 32)),
+    timeout=ADMISSION_TIMEOUT
+)
+command_limiter = AdmissionLimiter(
+    "command",
+    limit=int(os.environ.get("MAX_INFLIGHT_COMMANDS", 0)),
+    max_queue=int(os.environ.get("ADMISSION_QUEUE", 32)),
+    timeout=ADMISSION_TIMEOUT
+)
+metrics_registry.gauge(
+    "browser_admission_queue_depth", "Requests waiting for an admission slot", ("limiter",),
+    callback=lambda: {(limiter.name,): limiter.stats()["queue_depth"] for limiter in (browser_limiter, command_limiter)})
+metrics_registry.gauge(
+    "browser_admission_in_use", "Admission slots held", ("limiter",),
+    callback=lambda: {(limiter.name,): limiter.stats()["in_use"] for limiter in (browser_limiter, command_limiter)})
+
+def _save_macro(browser_llm, command, save_macro, status):
+    """Save the trajectory of the command that just ran as a named macro."""
+    if status != "success" or not browser_llm.last_trajectory:
+        return {"status": "error", "error_message": "Only successful commands are saved as macros"}
+    try:
+        macro = build_macro(save_macro["name"], browser_llm.last_trajectory, command,
+                            params=save_macro.get("params"), template=save_macro.get("template"))
+    except ValueError as e:
+        return {"status": "error", "error_message": str(e)}
+    macro_store.save(macro)
+    return {"status": "success", "name": macro["name"], "template": macro["template"], "steps": len(macro["steps"])}
+
+def _rejection(message, status_code=400, headers=None, **fields):
+    """The (None, error) result of _submit_command; the error is (payload, status_code, headers)."""
+    return None, ({"status": "error", "message": message, **fields}, status_code, headers or {})
+
+def _submit_command(data, headers, on_event=None):
     """
-    API endpoint for browser interaction.
-    
-    Request body:
-    {
-        "session_id": "unique_session_identifier",
-        "command": "user natural language command",
-        "max_turns": 10,  # Optional, default is 10
-        "api_key": "openai_api_key",  # Optional
-        "driver_path": "path_to_chromedriver"  # Optional
-    }
-    
-    Response:
-    {
-        "status": "success" | "error" | "max_turns_reached",
-        "message": "Human-readable status message",
-        "final_response": "Final LLM response text",
-        "history": [...],  # List of responses from the conversation
-        "actions": [...]   # List of actions taken by the browser
-    }
+    Validate an interact payload and queue the command for its session.
+    headers are the request headers (for X-Trace and X-Profile).
+    on_event receives progress events while the command runs.
+    Returns (job, None) or (None, (payload, status_code, headers)); it doesn't depend
+    on Flask so the ASGI entry point can use it too.
     """
-    data = request.json
-    
     if not data:
-        return jsonify({"status": "error", "message": "Request body is required"}), 400
+        return _rejection("Request body is required")
     
     session_id = data.get('session_id')
     if not session_id:
-        return jsonify({"status": "error", "message": "session_id is required"}), 400
+        return _rejection("session_id is required")
     
     command = data.get('command')
     if not command:
-        return jsonify({"status": "error", "message": "command is required"}), 400
+        return _rejection("command is required")
     
     api_key = data.get('api_key', os.environ.get("OPENAI_API_KEY"))
-    driver_path = data.get('driver_path')
+    driver_path = data.get('driver_path', browser_pool.driver_path)
     max_turns = data.get('max_turns', 10)
+    settle_mode = data.get('settle_mode', 'adaptive')
+    diff_content = bool(data.get('diff_content', False))
+    content_format = data.get('content_format', 'verbose')
+    max_content_tokens = data.get('max_content_tokens')
+    headless = data.get('headless')
+    block_resources = data.get('block_resources')
+    profile_id = data.get('profile_id')
+    # Opt-in diagnostics for this request only
+    trace_request = bool(data.get('trace', False)) or headers.get('X-Trace') == '1'
+    profile_request = bool(data.get('profile', False)) or headers.get('X-Profile') == '1'
+    macro_name = data.get('macro')
+    macro_params = data.get('macro_params') or {}
+    use_macros = data.get('use_macros', MACROS_AUTO)
+    save_macro = data.get('save_macro')
     
     # Validate max_turns
     try:
         max_turns = int(max_turns)
         if max_turns < 1:
-            return jsonify({"status": "error", "message": "max_turns must be at least 1"}), 400
+            return _rejection("max_turns must be at least 1")
     except (ValueError, TypeError):
-        return jsonify({"status": "error", "message": "max_turns must be a valid integer"}), 400
+        return _rejection("max_turns must be a valid integer")
+    
+    if settle_mode not in SETTLE_MODES:
+        return _rejection(f"settle_mode must be one of {', '.join(SETTLE_MODES)}")
+    
+    if content_format not in CONTENT_FORMATS:
+        return _rejection(f"content_format must be one of {', '.join(CONTENT_FORMATS)}")
+    
+    if max_content_tokens is not None:
+        try:
+            max_content_tokens = int(max_content_tokens)
+            if max_content_tokens < 1:
+                return _rejection("max_content_tokens must be at least 1")
+        except (ValueError, TypeError):
+            return _rejection("max_content_tokens must be a valid integer")
+    
+    if headless is not None and not isinstance(headless, bool):
+        return _rejection("headless must be true or false")
+    
+    if block_resources is not None:
+        try:
+            block_resources = parse_blocking_profiles(block_resources)
+        except (ValueError, TypeError) as e:
+            return _rejection(f"block_resources is invalid: {e}")
+    
+    if profile_id is not None:
+        try:
+            profile_store.path_for(profile_id)
+        except ValueError as e:
+            return _rejection(str(e))
+    
+    if not isinstance(use_macros, bool):
+        return _rejection("use_macros must be true or false")
+    
+    if not isinstance(macro_params, dict) or not all(isinstance(value, str) for value in macro_params.values()):
+        return _rejection("macro_params must map slot names to strings")
+    
+    if macro_name is not None and not isinstance(macro_name, str):
+        return _rejection("macro must be a macro name")
+    
+    macro = None
+    if macro_name is not None:
+        macro = macro_store.get(macro_name)
+        if macro is None:
+            return _rejection(f"Macro {macro_name} not found", 404)
+        missing = sorted(set(SLOT_PATTERN.findall(macro["template"])) - set(macro_params))
+        if missing:
+            return _rejection(f"macro_params is missing {', '.join(missing)}")
+    
+    if save_macro is not None:
+        if (not isinstance(save_macro, dict) or not isinstance(save_macro.get('name'), str) or
+                not isinstance(save_macro.get('params', {}), dict) or
+                not isinstance(save_macro.get('template', ''), str)):
+            return _rejection("save_macro must be {\"name\": ..., \"params\": {...}, \"template\": ...}")
     
     # Get or create a browser instance for this session
     with instances_lock:
         browser_llm = browser_instances.get(session_id)
         if not browser_llm:
             try:
-                browser_llm = BrowserLLM(api_key=api_key, driver_path=driver_path)
+                browser_llm = BrowserLLM(api_key=api_key, driver_path=driver_path, settle_mode=settle_mode,
+                                         diff_content=diff_content, browser_pool=browser_pool,
+                                         content_format=content_format, max_content_tokens=max_content_tokens,
+                                         headless=browser_pool.headless if headless is None else headless,
+                                         block_resources=(DEFAULT_BLOCK_RESOURCES if block_resources is None
+                                                          else block_resources),
+                                         profile_store=profile_store, profile_id=profile_id,
+                                         browser_limiter=browser_limiter,
+                                         trace_writer=trace_writer if trace_writer.sample_rate > 0 else None,
+                                         session_id=session_id,
+                                         llm_backend=_create_llm_backend(api_key, session_id))
                 browser_instances[session_id] = browser_llm
             except Exception as e:
-                return jsonify({
-                    "status": "error", 
-                    "message": f"Failed to initialize browser: {str(e)}"
-                }), 500
+                return _rejection(f"Failed to initialize browser: {str(e)}", 500)
     
-    # Set max turns
-    browser_llm.set_max_turns(max_turns)
-    
-    # Process the user command
+    def prepare():
+        # Runs after earlier commands of this session finished
+        browser_llm.touch()
+        browser_llm.set_max_turns(max_turns)
+        # Per-request overrides: blocking applies right away, headless on the next browser launch
+        if block_resources is not None and block_resources != browser_llm.browser.block_resources:
+            browser_llm.browser.set_blocked_resources(block_resources)
+        if headless is not None:
+            browser_llm.browser.headless = headless
+        # A session switches profiles only between browser runs
+        if profile_id is not None and browser_llm.browser.driver is None:
+            browser_llm.browser.profile_id = profile_id
+
+    match_macro = macro is None and use_macros
+
+    def finish_macros(chosen, result):
+        if chosen is not None:
+            macro_store.record_run(chosen["name"], result["macro"]["diverged_at"] is not None)
+        if save_macro is not None:
+            result["saved_macro"] = _save_macro(browser_llm, command, save_macro, result["status"])
+        return result
+
+    def execute(job):
+        chosen, params = macro, macro_params
+        if match_macro:
+            chosen, params = macro_store.match(command, browser_llm.current_domain())
+        if chosen is not None:
+            result = browser_llm.run_macro(command, chosen, params, cancel_event=job.cancel_event,
+                                           on_event=on_event)
+        else:
+            result = browser_llm.process_user_input(command, cancel_event=job.cancel_event, on_event=on_event)
+        return finish_macros(chosen, result)
+
+    async def execute_async(job):
+        chosen, params = macro, macro_params
+        if match_macro:
+            chosen, params = macro_store.match(command, await engine.offload(browser_llm.current_domain))
+        if chosen is not None:
+            result = await browser_llm.run_macro_async(command, chosen, params, engine.offload,
+                                                       cancel_event=job.cancel_event, on_event=on_event)
+        else:
+            result = await browser_llm.process_user_input_async(command, engine.offload,
+                                                                cancel_event=job.cancel_event, on_event=on_event)
+        # Saving macros writes the store file
+        return await engine.offload(finish_macros, chosen, result)
+
+    def run(job):
+        # Runs on a job worker thread
+        prepare()
+        trace = RequestTrace() if trace_request else None
+        try:
+            with activate(trace):
+                if profile_request:
+                    output_path = os.path.join(PROFILE_OUTPUT_DIR, f"{job.job_id}.pstats")
+                    result, profile = profile_call(lambda: execute(job), output_path,
+                                                   max_files=PROFILE_MAX_FILES)
+                    result["profile"] = profile
+                else:
+                    result = execute(job)
+            if trace is not None:
+                result["trace"] = trace.to_dict()
+            return result
+        finally:
+            browser_llm.touch()
+
+    async def run_async(job):
+        # Runs as a coroutine on the async engine; browser calls go to its thread pool
+        await engine.offload(prepare)
+        trace = RequestTrace() if trace_request else None
+        try:
+            with activate(trace):
+                result = await execute_async(job)
+            if profile_request:
+                # cProfile follows one thread, while async commands share the loop and browser threads
+                result["profile"] = {"error": "Profiling needs ENGINE=threads"}
+            if trace is not None:
+                result["trace"] = trace.to_dict()
+            return result
+        finally:
+            browser_llm.touch()
+
+    # Admission: a browser slot for sessions without a live browser, then a command slot,
+    # both within one deadline
+    deadline = time.monotonic() + ADMISSION_TIMEOUT
+    command_slot = object()
+    new_browser_slot = False
     try:
-        result = browser_llm.process_user_input(command)
-        return jsonify(result)
-    except Exception as e:
-        return jsonify({
+        if not browser_llm.browser_started:
+            new_browser_slot = browser_limiter.acquire(browser_llm)
+        command_limiter.acquire(command_slot, timeout=max(0.0, deadline - time.monotonic()))
+    except AdmissionRejected as e:
+        if new_browser_slot:
+            browser_llm.release_browser_slot()
+        return _rejection(f"{e}, try again later", e.status_code, {"Retry-After": str(e.retry_after)},
+                          retry_after=e.retry_after)
+
+    def finish(job):
+        command_limiter.release(command_slot)
+        # The command didn't leave a browser running, so the session doesn't need a slot
+        if not browser_llm.browser_started:
+            browser_llm.release_browser_slot()
+
+    # Submitted under the lock so the idle reaper never drops a session with a command on its way
+    with instances_lock:
+        if browser_instances.get(session_id) is not browser_llm:
+            browser_instances[session_id] = browser_llm
+        return job_manager.submit(session_id, run_async if engine else run, on_finish=finish), None
+
+@app.route('/api/browser/interact', methods=['POST'])
+def interact():
+    """
+    API endpoint for browser interaction. Waits for the command to finish;
+    use /api/browser/jobs to submit without waiting.
+    
+    Request body:
+    {
+        "session_id": "unique_session_identifier",
+        "command": "user natural language command",
+        "max_turns": 10,  # Optional, default is 10
+        "api_key": "openai_api_key",  # Optional
+        "driver_path": "path_to_chromedriver",  # Optional
+        "settle_mode": "adaptive" | "fixed",  # Optional, default is adaptive
+        "diff_content": false,  # Optional, send page content diffs after the first snapshot
+        "content_format": "verbose" | "compact",  # Optional, default is verbose
+        "max_content_tokens": 4000,  # Optional, cap on page content tokens per snapshot
+        "headless": true,  # Optional, launch Chrome without a window (next browser start)
+        "block_resources": ["images", "media", "fonts", "trackers"],  # Optional, or "all"; [] unblocks
+        "profile_id": "tenant-42",  # Optional, persistent profile (cache, cookies, storage) for the session
+        "trace": false,  # Optional (or header X-Trace: 1), add a span timeline to the response
+        "profile": false,  # Optional (or header X-Profile: 1), cProfile the command, add top functions
+        "macro": "amazon-search",  # Optional, replay this saved macro instead of asking the LLM
+        "macro_params": {"term": "usb hub"},  # Slot values for the macro
+        "use_macros": false,  # Optional (default MACROS_AUTO), replay the macro whose template matches
+        "save_macro": {"name": "amazon-search", "params": {"term": "laptops"}}  # Optional, save on success;
+                                                        # "template" defaults to the command with params as slots
+    }
+    
+    Response:
+    {
+        "status": "success" | "error" | "max_turns_reached" | "cancelled",
+        "message": "Human-readable status message",
+        "final_response": "Final LLM response text",
+        "history": [...],  # List of responses from the conversation
+        "actions": [...],  # List of actions taken by the browser
+        "trace": {"total_ms": 5230.4, "spans": [{"name": "llm.call", "start_ms": 1.2, "duration_ms": 812.5,
+                                                 "depth": 0, "parent": null, "turn": 1, ...}, ...]},
+        "profile": {"path": "request_profiles/<job_id>.pstats", "top": [...]},
+        "macro": {"name": "amazon-search", "steps_replayed": 4, "diverged_at": null},  # Macro replays only
+        "saved_macro": {"status": "success", "name": "amazon-search", "template": "...", "steps": 4}
+    }
+    
+    A replayed macro checks the page after each step; from the first step that fails or
+    reaches a different page, the LLM continues the task (diverged_at names the step).
+    
+    When the server is at capacity the request is rejected with 429 (too many requests
+    already waiting) or 503 (no slot within ADMISSION_TIMEOUT) and a Retry-After header.
+    """
+    job, error = _submit_command(request.json, request.headers)
+    if error:
+        return _error_response(error)
+    
+    # Process the user command (queued behind earlier commands of the same session)
+    job.done.wait()
+    payload, status_code = _interact_result(job)
+    return jsonify(payload), status_code
+
+def _error_response(error):
+    """Flask response for an error returned by _submit_command."""
+    payload, status_code, headers = error
+    response = jsonify(payload)
+    response.headers.update(headers)
+    return response, status_code
+
+def _interact_result(job):
+    """The interact response body and status code of a finished job."""
+    if job.status == "failed":
+        return {
             "status": "error",
-            "message": f"Error processing command: {str(e)}",
-            "final_response": f"An error occurred: {str(e)}",
+            "message": f"Error processing command: {job.error_message}",
+            "final_response": f"An error occurred: {job.error_message}",
             "history": [],
             "actions": []
-        }), 500
+        }, 500
+    if job.result is None:
+        return {
+            "status": "cancelled",
+            "message": "Command cancelled before it started",
+            "final_response": "Command cancelled before it started",
+            "history": [],
+            "actions": []
+        }, 200
+    return job.result, 200
+
+def _sse(event):
+    """Format an event dict as a server-sent event."""
+    return f"event: {event['event']}\ndata: {json.dumps(event, default=str)}\n\n"
+
+@app.route('/api/browser/interact/stream', methods=['POST'])
+def interact_stream():
+    """
+    Same as /api/browser/interact, but streams progress as server-sent events.
+    
+    Request body: same as /api/browser/interact
+    
+    Events (each `data` is JSON):
+        job           {"job_id": "..."}  # Use with /api/browser/jobs/<job_id>/cancel
+        llm_decision  {"turn": 1, "content": "...", "tool_calls": [...], "duration_ms": 850}
+        tool_start    {"turn": 1, "function": "click_at_coordinates", "arguments": {...}}
+        tool_end      {"turn": 1, "function": "...", "status": "success", "message": "...", "duration_ms": 420}
+        final         {"status": "...", "result": {...}}  # interact response
+    
+    Steps replayed from a macro send tool_start/tool_end with "turn": 0 and "macro_step".
+    
+    Closing the connection cancels the command.
+    """
+    events = queue.Queue()
+    job, error = _submit_command(request.json, request.headers, on_event=events.put)
+    if error:
+        return _error_response(error)
+    
+    def generate():
+        try:
+            yield _sse({"event": "job", "job_id": job.job_id})
+            last_sent = time.monotonic()
+            while not (job.done.is_set() and events.empty()):
+                try:
+                    event = events.get(timeout=0.5)
+                except queue.Empty:
+                    if time.monotonic() - last_sent >= 15:
+                        yield ": keep-alive\n\n"
+                        last_sent = time.monotonic()
+                    continue
+                yield _sse(event)
+                last_sent = time.monotonic()
+            yield _sse({
+                "event": "final",
+                "status": job.status,
+                "result": job.result,
+                "error_message": job.error_message
+            })
+        except GeneratorExit:
+            # Client went away, stop the command at its next turn
+            job_manager.cancel(job.job_id)
+            raise
+    
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/api/browser/jobs', methods=['POST'])
+def submit_job():
+    """
+    Submit a command without waiting for it to finish.
+    
+    Request body: same as /api/browser/interact
+    
+    Response (202):
+    {
+        "status": "accepted",
+        "job_id": "job identifier",
+        "position": 0  # Commands of the same session ahead of this one
+    }
+    """
+    job, error = _submit_command(request.json, request.headers)
+    if error:
+        return _error_response(error)
+    
+    return jsonify({
+        "status": "accepted",
+        "job_id": job.job_id,
+        "position": job_manager.position(job)
+    }), 202
+
+@app.route('/api/browser/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    Poll a submitted job.
+    
+    Response:
+    {
+        "status": "success",
+        "job": {
+            "job_id": "...",
+            "session_id": "...",
+            "status": "queued" | "running" | "completed" | "failed" | "cancelled",
+            "result": {...},  # interact response once finished
+            ...
+        }
+    }
+    """
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({"status": "error", "message": "Job not found"}), 404
+    
+    job_info = job.to_dict()
+    job_info["position"] = job_manager.position(job)
+    return jsonify({"status": "success", "job": job_info})
+
+@app.route('/api/browser/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """
+    Cancel a job. Queued jobs never run; running jobs stop before their next turn.
+    
+    Response:
+    {
+        "status": "success",
+        "job": {...}
+    }
+    """
+    job = job_manager.cancel(job_id)
+    if not job:
+        return jsonify({"status": "error", "message": "Job not found"}), 404
+    
+    return jsonify({"status": "success", "job": job.to_dict()})
+
+def _submit_session_op(session_id, func):
+    """
+    Cancel a session's commands and queue func(job) behind them, so it runs once the
+    running command has stopped instead of racing it on the same driver and context.
+    Caller holds instances_lock, so no new command can slip in between.
+    """
+    job_manager.cancel_session(session_id)
+    return job_manager.submit(session_id, func)
+
+def _close_session_browser(browser_llm):
+    """Close the session's browser; None if it was already closed."""
+    if browser_llm.browser_started:
+        return browser_llm.call_function("close_browser", {})
+    return None
 
 @app.route('/api/browser/reset', methods=['POST'])
 def reset_session():
@@ -591,15 +1636,15 @@ def reset_session():
         browser_llm = browser_instances.get(session_id)
         if not browser_llm:
             return jsonify({"status": "error", "message": "Session not found"}), 404
-        
-        try:
-            result = browser_llm.reset_session()
-            return jsonify(result)
-        except Exception as e:
-            return jsonify({
-                "status": "error",
-                "message": f"Error resetting session: {str(e)}"
-            }), 500
+        job = _submit_session_op(session_id, lambda job: browser_llm.reset_session())
+    
+    job.done.wait()
+    if job.status == "failed":
+        return jsonify({
+            "status": "error",
+            "message": f"Error resetting session: {job.error_message}"
+        }), 500
+    return jsonify(job.result)
 
 @app.route('/api/browser/close', methods=['POST'])
 def close_browser():
@@ -631,20 +1676,21 @@ def close_browser():
         if not browser_llm:
             return jsonify({"status": "error", "message": "Session not found"}), 404
         
-        try:
-            if browser_llm.browser_started:
-                result = browser_llm.call_function("close_browser", {})
-                return jsonify({
-                    "status": result.get("status", "error"),
-                    "message": result.get("message", result.get("error_message", "Unknown error"))
-                })
-            else:
-                return jsonify({"status": "success", "message": "Browser already closed"})
-        except Exception as e:
-            return jsonify({
-                "status": "error",
-                "message": f"Error closing browser: {str(e)}"
-            }), 500
+        job = _submit_session_op(session_id, lambda job: _close_session_browser(browser_llm))
+    
+    job.done.wait()
+    if job.status == "failed":
+        return jsonify({
+            "status": "error",
+            "message": f"Error closing browser: {job.error_message}"
+        }), 500
+    result = job.result
+    if result is None:
+        return jsonify({"status": "success", "message": "Browser already closed"})
+    return jsonify({
+        "status": result.get("status", "error"),
+        "message": result.get("message", result.get("error_message", "Unknown error"))
+    })
 
 @app.route('/api/browser/cleanup', methods=['POST'])
 def cleanup_sessions():
@@ -667,24 +1713,20 @@ def cleanup_sessions():
     session_ids = data.get('session_ids', [])
     
     cleaned_sessions = []
+    jobs = []
     with instances_lock:
-        # If specific sessions provided
-        if session_ids:
-            for session_id in session_ids:
-                browser_llm = browser_instances.get(session_id)
-                if browser_llm:
-                    if browser_llm.browser_started:
-                        browser_llm.call_function("close_browser", {})
-                    del browser_instances[session_id]
-                    cleaned_sessions.append(session_id)
-        # Otherwise clean up all sessions
-        else:
-            for session_id, browser_llm in list(browser_instances.items()):
-                if browser_llm.browser_started:
-                    browser_llm.call_function("close_browser", {})
-                del browser_instances[session_id]
+        # Specific sessions if provided, otherwise all of them
+        for session_id in (session_ids or list(browser_instances)):
+            browser_llm = browser_instances.pop(session_id, None)
+            if browser_llm:
+                jobs.append(_submit_session_op(
+                    session_id, lambda job, browser_llm=browser_llm: _close_session_browser(browser_llm)
+                ))
                 cleaned_sessions.append(session_id)
     
+    for job in jobs:
+        job.done.wait()
+    
     return jsonify({
         "status": "success",
         "message": f"Cleaned up {len(cleaned_sessions)} sessions",
@@ -702,25 +1744,112 @@ def get_status():
         "active_sessions": {
             "session_id1": {
                 "browser_started": true,
-                "messages_count": 10
+                "messages_count": 10,
+                "context_tokens": 5400,
+                "idle_seconds": 42
             },
             ...
-        }
+        },
+        "browser_pool": {"idle": 2, "hits": 5, "misses": 1, ...},
+        "jobs": {"queued": 1, "running": 2, "completed": 7, ...},
+        "profiles": {"profiles": 3, "in_use": 1, "reattached": 4, ...},
+        "reaper": {"browsers_closed": 2, "sessions_dropped": 1, "browsers_evicted": 0, ...},
+        "admission": {
+            "browsers": {"limit": 20, "in_use": 12, "queue_depth": 0, "avg_wait_ms": 3, ...},
+            "commands": {"limit": 8, "in_use": 8, "queue_depth": 2, "rejected_timeout": 1, ...}
+        },
+        "traces": {"queued": 0, "written": 120, "dropped": 0, "rotated": 1, "errors": 0},
+        "decision_cache": {"entries": 40, "hit_rate": 0.35, "saved_ms": 48210, ...},  # null when disabled
+        "llm_clients": {"clients": 1, "http2": true, "created": 1, "reused": 57},
+        "engine": {"browser_threads": 32, "running_commands": 140, "pending_browser_calls": 6, ...}  # ENGINE=async
     }
     """
     active_sessions = {}
+    now = time.time()
     with instances_lock:
         for session_id, browser_llm in browser_instances.items():
             active_sessions[session_id] = {
                 "browser_started": browser_llm.browser_started,
-                "messages_count": len(browser_llm.messages)
+                "messages_count": len(browser_llm.messages),
+                "context_tokens": browser_llm.context.total_tokens,
+                "idle_seconds": round(now - browser_llm.last_active)
             }
     
     return jsonify({
         "status": "success",
-        "active_sessions": active_sessions
+        "active_sessions": active_sessions,
+        "browser_pool": browser_pool.stats(),
+        "jobs": job_manager.stats(),
+        "profiles": profile_store.stats(),
+        "reaper": session_reaper.stats(),
+        "traces": trace_writer.stats(),
+        "decision_cache": decision_cache.stats() if decision_cache else None,
+        "llm_clients": openai_clients.stats(),
+        "engine": engine.stats() if engine else None,
+        "admission": {
+            "browsers": browser_limiter.stats(),
+            "commands": command_limiter.stats()
+        }
     })
 
+@app.route('/api/browser/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Prometheus metrics in the text exposition format: LLM latency and token usage,
+    tool, settle and extraction latency, page content size, turns per command,
+    and active sessions, browsers, jobs and admission queues.
+    """
+    return Response(metrics_registry.render(), content_type=metrics_registry.CONTENT_TYPE)
+
+@app.route('/api/browser/macros', methods=['GET'])
+def list_macros():
+    """
+    List saved macros.
+    
+    Response:
+    {
+        "status": "success",
+        "macros": [{"name": "amazon-search", "domain": "www.amazon.com", "template": "search amazon for {term}",
+                    "steps": 4, "runs": 12, "diverged": 1, "created_at": 1760000000.0}, ...]
+    }
+    """
+    return jsonify({"status": "success", "macros": macro_store.list()})
+
+@app.route('/api/browser/macros/<name>', methods=['DELETE'])
+def delete_macro(name):
+    """
+    Delete a saved macro.
+    
+    Response:
+    {
+        "status": "success" | "error",
+        "message": "Human-readable status message"
+    }
+    """
+    if not macro_store.delete(name):
+        return jsonify({"status": "error", "message": "Macro not found"}), 404
+    return jsonify({"status": "success", "message": f"Macro {name} deleted"})
+
+@app.route('/api/browser/profiles/<profile_id>', methods=['DELETE'])
+def delete_profile(profile_id):
+    """
+    Delete a persistent browser profile (cache, cookies and storage).
+    
+    Response:
+    {
+        "status": "success" | "error",
+        "message": "Human-readable status message"
+    }
+    """
+    try:
+        deleted = profile_store.delete(profile_id)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    
+    if not deleted:
+        return jsonify({"status": "error", "message": "Profile not found or in use by a running browser"}), 409
+    return jsonify({"status": "success", "message": f"Profile {profile_id} deleted"})
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port, debug=False)
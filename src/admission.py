@@ -0,0 +1,103 @@
+import math
+import threading
+import time
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request can't be admitted; maps to an HTTP status with Retry-After."""
+
+    def __init__(self, message, status_code, retry_after):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AdmissionLimiter:
+    """
+    Bound how many owners (sessions, commands) hold a slot at once.
+
+    Waiters queue for a free slot up to a deadline; when max_queue of them are
+    already waiting, new ones are rejected right away (429), and waiters that
+    time out are rejected too (503), so overload sheds requests instead of
+    slowing everyone down. limit=0 admits everything but still counts.
+    Acquiring is idempotent per owner.
+    """
+
+    def __init__(self, name, limit=0, max_queue=32, timeout=10.0):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+
+        self._holders = {}  # owner -> time acquired
+        self._waiting = 0
+        self._condition = threading.Condition()
+        self._hold_seconds = None  # moving average, for Retry-After
+        self._wait_ms_total = 0
+        self.stats_counters = {"admitted": 0, "rejected_queue_full": 0, "rejected_timeout": 0, "max_wait_ms": 0}
+
+    def acquire(self, owner, timeout=None):
+        """
+        Take a slot for owner, waiting up to timeout seconds (default self.timeout).
+        Returns True if a new slot was taken, False if owner already held one.
+        Raises AdmissionRejected when the queue is full or the deadline passes.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        with self._condition:
+            if owner in self._holders:
+                return False
+            if self.limit and len(self._holders) >= self.limit:
+                if self._waiting >= self.max_queue:
+                    self.stats_counters["rejected_queue_full"] += 1
+                    raise AdmissionRejected(f"Too many requests waiting for {self.name}", 429,
+                                            self._retry_after())
+                self._waiting += 1
+                try:
+                    admitted = self._condition.wait_for(lambda: len(self._holders) < self.limit, timeout)
+                finally:
+                    self._waiting -= 1
+                if not admitted:
+                    self.stats_counters["rejected_timeout"] += 1
+                    raise AdmissionRejected(f"No {self.name} slot became free within {timeout:g}s", 503,
+                                            self._retry_after())
+
+            waited_ms = round((time.monotonic() - started) * 1000)
+            self._holders[owner] = time.monotonic()
+            self._wait_ms_total += waited_ms
+            self.stats_counters["admitted"] += 1
+            self.stats_counters["max_wait_ms"] = max(self.stats_counters["max_wait_ms"], waited_ms)
+            return True
+
+    def release(self, owner):
+        """Free owner's slot, if it holds one."""
+        with self._condition:
+            acquired_at = self._holders.pop(owner, None)
+            if acquired_at is None:
+                return
+            held = time.monotonic() - acquired_at
+            self._hold_seconds = held if self._hold_seconds is None else 0.8 * self._hold_seconds + 0.2 * held
+            self._condition.notify()
+
+    def holds(self, owner):
+        with self._condition:
+            return owner in self._holders
+
+    def stats(self):
+        """Return slot usage, queue depth and wait statistics."""
+        with self._condition:
+            admitted = self.stats_counters["admitted"]
+            return {
+                "limit": self.limit,
+                "in_use": len(self._holders),
+                "queue_depth": self._waiting,
+                "max_queue": self.max_queue,
+                "avg_wait_ms": round(self._wait_ms_total / admitted) if admitted else 0,
+                **self.stats_counters
+            }
+
+    def _retry_after(self):
+        # Caller holds the condition. Expected time for enough slots to free up for the queue
+        if not self._hold_seconds or not self.limit:
+            return 1
+        return max(1, math.ceil(self._hold_seconds * (self._waiting + 1) / self.limit))
@@ -0,0 +1,148 @@
+"""
+ASGI entry point, for serving the API with an ASGI server:
+
+    ENGINE=async uvicorn asgi:application --host 0.0.0.0 --port 5000
+
+interact, interact/stream and jobs are served natively, so a request waiting on its
+command doesn't hold a thread. The other /api/browser/* routes go to the Flask app
+through asgiref's WSGI adapter. With ENGINE=async the commands themselves run as
+coroutines too, and one process can supervise hundreds of mostly-waiting sessions.
+"""
+from asgiref.wsgi import WsgiToAsgi
+from LLM import app, job_manager, _submit_command, _interact_result, _sse
+import asyncio
+import json
+
+flask_application = WsgiToAsgi(app)
+
+NATIVE_ROUTES = ("/api/browser/interact", "/api/browser/interact/stream", "/api/browser/jobs")
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+    elif scope["type"] == "http" and scope["method"] == "POST" and scope["path"] in NATIVE_ROUTES:
+        await _native(scope, receive, send)
+    else:
+        await flask_application(scope, receive, send)
+
+
+async def _native(scope, receive, send):
+    try:
+        data = json.loads(await _read_body(receive) or b"null")
+    except ValueError:
+        await _send_json(send, {"status": "error", "message": "Request body must be JSON"}, 400)
+        return
+    # X-Trace and X-Profile, looked up the way Flask spells them
+    headers = {name.decode("latin-1").title(): value.decode("latin-1") for name, value in scope["headers"]}
+
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    streaming = scope["path"] == "/api/browser/interact/stream"
+    on_event = (lambda event: loop.call_soon_threadsafe(events.put_nowait, event)) if streaming else None
+
+    # Admission may wait for a slot, so validation and queueing run off the event loop
+    job, error = await asyncio.to_thread(_submit_command, data, headers, on_event)
+    if error:
+        payload, status_code, extra_headers = error
+        await _send_json(send, payload, status_code, extra_headers)
+    elif scope["path"] == "/api/browser/jobs":
+        await _send_json(send, {"status": "accepted", "job_id": job.job_id,
+                                "position": job_manager.position(job)}, 202)
+    elif streaming:
+        await _stream(job, events, receive, send)
+    else:
+        await _wait(job)
+        payload, status_code = _interact_result(job)
+        await _send_json(send, payload, status_code)
+
+
+async def _stream(job, events, receive, send):
+    """Server-sent events like /api/browser/interact/stream; a disconnect cancels the command."""
+    loop = asyncio.get_running_loop()
+    job.add_done_callback(lambda job: loop.call_soon_threadsafe(events.put_nowait, None))
+
+    async def watch_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        job_manager.cancel(job.job_id)
+
+    watcher = asyncio.create_task(watch_disconnect())
+    try:
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache"),
+                        (b"x-accel-buffering", b"no")]
+        })
+        await _send_chunk(send, _sse({"event": "job", "job_id": job.job_id}))
+        while True:
+            try:
+                event = await asyncio.wait_for(events.get(), timeout=15)
+            except asyncio.TimeoutError:
+                await _send_chunk(send, ": keep-alive\n\n")
+                continue
+            if event is None:
+                break
+            await _send_chunk(send, _sse(event))
+        await _send_chunk(send, _sse({
+            "event": "final",
+            "status": job.status,
+            "result": job.result,
+            "error_message": job.error_message
+        }))
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+    except OSError:
+        job_manager.cancel(job.job_id)
+    finally:
+        watcher.cancel()
+
+
+async def _wait(job):
+    """Wait for a job to finish without blocking a thread on job.done."""
+    loop = asyncio.get_running_loop()
+    finished = loop.create_future()
+
+    def resolve():
+        if not finished.done():
+            finished.set_result(None)
+
+    job.add_done_callback(lambda job: loop.call_soon_threadsafe(resolve))
+    await finished
+
+
+async def _read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return body
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def _send_json(send, payload, status_code=200, headers=None):
+    body = json.dumps(payload, default=str).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status_code,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+                   + [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                      for name, value in (headers or {}).items()]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_chunk(send, text):
+    await send({"type": "http.response.body", "body": text.encode("utf-8"), "more_body": True})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
@@ -0,0 +1,70 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextvars
+import functools
+import threading
+
+
+class AsyncEngine:
+    """
+    An asyncio event loop on a background thread that runs commands as coroutines.
+    LLM calls are awaited natively, settle waits are awaited between short page checks
+    and other blocking WebDriver calls are offloaded to a bounded thread pool, so a
+    waiting session holds no thread.
+    """
+
+    def __init__(self, browser_threads=32):
+        self.browser_threads = browser_threads
+        self.loop = asyncio.new_event_loop()
+        self._executor = ThreadPoolExecutor(max_workers=browser_threads, thread_name_prefix="browser-call")
+        self._thread = None
+        self._lock = threading.Lock()
+        self.stats_counters = {"running_commands": 0, "pending_browser_calls": 0, "browser_calls": 0}
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run_loop, name="async-engine", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
+        self._thread = None
+        self._executor.shutdown(wait=False)
+
+    def submit(self, coroutine):
+        """Schedule a coroutine from any thread. Returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(self._track(coroutine), self.loop)
+
+    async def offload(self, func, *args, **kwargs):
+        """Run a blocking call on the browser thread pool, in a copy of the caller's context."""
+        context = contextvars.copy_context()
+        call = functools.partial(context.run, func, *args, **kwargs)
+        self._count("pending_browser_calls", 1)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+        finally:
+            self._count("pending_browser_calls", -1)
+            self._count("browser_calls", 1)
+
+    def stats(self):
+        with self._lock:
+            return {"browser_threads": self.browser_threads, **self.stats_counters}
+
+    async def _track(self, coroutine):
+        self._count("running_commands", 1)
+        try:
+            return await coroutine
+        finally:
+            self._count("running_commands", -1)
+
+    def _count(self, name, amount):
+        with self._lock:
+            self.stats_counters[name] += amount
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
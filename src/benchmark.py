@@ -0,0 +1,249 @@
+"""
+Offline component benchmarks for BrowserAPI.
+
+Serves generated pages from a local HTTP server and measures browser cold start,
+page content extraction (time and size) and click, input and scroll latency.
+Needs Chrome and ChromeDriver but no network access or OpenAI key.
+
+    python benchmark.py --output results.json
+    python benchmark.py --sizes 100,1000 --repeat 3 --only extraction,actions
+"""
+from browserAPI import BrowserAPI
+from benchmarkPages import FixtureServer
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+DEFAULT_SIZES = (100, 1000, 5000, 20000, 50000)
+SUITES = ("cold_start", "extraction", "actions")
+
+
+def summarize(samples):
+    """Min, median, p95, max and mean of a list of milliseconds."""
+    ordered = sorted(samples)
+    return {
+        "n": len(ordered),
+        "min": round(ordered[0], 2),
+        "median": round(statistics.median(ordered), 2),
+        "p95": round(ordered[min(len(ordered) - 1, round(0.95 * (len(ordered) - 1)))], 2),
+        "max": round(ordered[-1], 2),
+        "mean": round(statistics.fmean(ordered), 2)
+    }
+
+
+def timed(func, *args, **kwargs):
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return (time.perf_counter() - started) * 1000, result
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def new_browser(options):
+    return BrowserAPI(driver_path=options.driver_path, headless=options.headless,
+                      content_format=options.content_format, settle_timeout=options.settle_timeout)
+
+
+def bench_cold_start(options, server):
+    """start_browser + first navigation on a fresh (unpooled) Chrome, then close_browser."""
+    start_ms, navigate_ms, close_ms = [], [], []
+    for _ in range(options.repeat):
+        browser = new_browser(options)
+        elapsed, result = timed(browser.start_browser)
+        if result["status"] != "success":
+            raise RuntimeError(result["error_message"])
+        start_ms.append(elapsed)
+        navigate_ms.append(timed(browser.go_to_website, f"{server.base_url}/flat?n=100")[0])
+        close_ms.append(timed(browser.close_browser)[0])
+    return [{
+        "suite": "cold_start",
+        "case": "start_browser",
+        "start_ms": summarize(start_ms),
+        "first_navigation_ms": summarize(navigate_ms),
+        "close_ms": summarize(close_ms)
+    }]
+
+
+def _extraction_case(browser, name, url, repeat):
+    navigation = browser.go_to_website(url)
+    if navigation["status"] != "success":
+        raise RuntimeError(navigation["error_message"])
+
+    total_ms, in_page_ms = [], []
+    content = None
+    for _ in range(repeat):
+        # Full snapshots only; a diff baseline would make later runs cheaper than real first visits
+        browser.invalidate_snapshot()
+        elapsed, content = timed(browser._get_page_content)
+        total_ms.append(elapsed)
+        if browser.last_content_stats.get("extract_ms") is not None:
+            in_page_ms.append(browser.last_content_stats["extract_ms"])
+
+    stats = browser.last_content_stats
+    return {
+        "suite": "extraction",
+        "case": name,
+        "url": url,
+        "get_page_content_ms": summarize(total_ms),
+        "in_page_extract_ms": summarize(in_page_ms) if in_page_ms else None,
+        "elements": stats["elements"],
+        "element_count": content.get("element_count"),
+        "visited_nodes": stats["visited_nodes"],
+        "estimated_tokens": stats["tokens"],
+        "output_bytes": len(json.dumps(content)),
+        "truncated": content.get("truncated")
+    }
+
+
+def bench_extraction(options, server, browser):
+    base = server.base_url
+    results = []
+    for size in options.sizes:
+        results.append(_extraction_case(browser, f"flat_{size}", f"{base}/flat?n={size}", options.repeat))
+    results.append(_extraction_case(browser, "shadow_depth_20", f"{base}/shadow?depth=20&width=10", options.repeat))
+    results.append(_extraction_case(browser, "form_500", f"{base}/form?fields=500", options.repeat))
+    results.append(_extraction_case(browser, "infinite_scroll", f"{base}/infinite?batch=50", options.repeat))
+    return results
+
+
+def _first(elements, tag_names):
+    for element in elements:
+        coordinates = element["coordinates"]
+        if element["tagName"] in tag_names and coordinates["y"] + coordinates["height"] < 1000:
+            return coordinates
+    raise RuntimeError(f"No visible {'/'.join(tag_names)} on the fixture page")
+
+
+def _action_case(name, url, repeat, action):
+    samples, phases = [], {}
+    for _ in range(repeat):
+        elapsed, result = timed(action)
+        if result["status"] != "success":
+            raise RuntimeError(f"{name}: {result['error_message']}")
+        samples.append(elapsed)
+        for phase, value in (result.get("timings") or {}).items():
+            if value is not None:
+                phases.setdefault(phase, []).append(value)
+    return {
+        "suite": "actions",
+        "case": name,
+        "url": url,
+        "latency_ms": summarize(samples),
+        "phases_ms": {phase: summarize(values) for phase, values in phases.items()}
+    }
+
+
+def bench_actions(options, server, browser):
+    results = []
+    for size in (min(options.sizes), max(options.sizes)):
+        url = f"{server.base_url}/flat?n={size}"
+        browser.go_to_website(url)
+        elements = browser._extract_elements()["interactiveElements"]
+        button = _first(elements, ("button",))
+        field = _first(elements, ("input",))
+        center = (button["x"] + button["width"] / 2, button["y"] + button["height"] / 2)
+
+        results.append(_action_case(
+            f"click_at_coordinates_flat_{size}", url, options.repeat,
+            lambda: browser.click_at_coordinates(*center)
+        ))
+        # input_text_at_coordinates shifts x by 15px itself
+        results.append(_action_case(
+            f"input_text_at_coordinates_flat_{size}", url, options.repeat,
+            lambda: browser.input_text_at_coordinates(field["x"] + 1, field["y"] + field["height"] / 2, "benchmark")
+        ))
+        results.append(_action_case(
+            f"scroll_page_flat_{size}", url, options.repeat,
+            lambda: browser.scroll_page(0, 400)
+        ))
+
+    url = f"{server.base_url}/infinite?batch=50"
+    browser.go_to_website(url)
+    results.append(_action_case(
+        "scroll_page_infinite", url, options.repeat,
+        lambda: browser.scroll_page(0, 2000)
+    ))
+    return results
+
+
+def run(options):
+    server = FixtureServer().start()
+    results = []
+    try:
+        if "cold_start" in options.only:
+            print("Benchmarking cold start...")
+            results.extend(bench_cold_start(options, server))
+
+        if "extraction" in options.only or "actions" in options.only:
+            browser = new_browser(options)
+            started = browser.start_browser()
+            if started["status"] != "success":
+                raise RuntimeError(started["error_message"])
+            try:
+                if "extraction" in options.only:
+                    print("Benchmarking page content extraction...")
+                    results.extend(bench_extraction(options, server, browser))
+                if "actions" in options.only:
+                    print("Benchmarking click, input and scroll...")
+                    results.extend(bench_actions(options, server, browser))
+            finally:
+                browser.close_browser()
+    finally:
+        server.stop()
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.time(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "options": {
+                "sizes": options.sizes,
+                "repeat": options.repeat,
+                "headless": options.headless,
+                "content_format": options.content_format,
+                "settle_timeout": options.settle_timeout,
+                "suites": options.only
+            }
+        },
+        "results": results
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline BrowserAPI benchmarks on generated pages.")
+    parser.add_argument("--output", default="benchmark_results.json", help="where to write the JSON results")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES),
+                        help="interactive node counts of the flat pages (comma-separated)")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per case")
+    parser.add_argument("--only", default=",".join(SUITES), help=f"suites to run, any of {', '.join(SUITES)}")
+    parser.add_argument("--driver-path", default=None, help="ChromeDriver path")
+    parser.add_argument("--headed", dest="headless", action="store_false", help="show the browser window")
+    parser.add_argument("--content-format", default="verbose", choices=("verbose", "compact"))
+    parser.add_argument("--settle-timeout", type=float, default=5, help="max settle wait per action (s)")
+    options = parser.parse_args(argv)
+
+    options.sizes = [int(size) for size in options.sizes.split(",") if size.strip()]
+    options.only = [suite.strip() for suite in options.only.split(",") if suite.strip()]
+    unknown = [suite for suite in options.only if suite not in SUITES]
+    if unknown or not options.sizes or options.repeat < 1:
+        parser.error(f"invalid --only {unknown}, --sizes or --repeat")
+    return options
+
+
+if __name__ == "__main__":
+    options = parse_args()
+    report = run(options)
+    with open(options.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(report['results'])} results to {options.output}")
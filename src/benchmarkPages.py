@@ -0,0 +1,205 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+import json
+import random
+import threading
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+  body {{ font-family: sans-serif; margin: 8px; }}
+  .grid {{ display: flex; flex-wrap: wrap; gap: 4px; }}
+  .grid > * {{ width: 120px; height: 24px; }}
+  .clicked {{ outline: 2px solid green; }}
+</style>
+</head>
+<body>
+{body}
+<script>
+  // Clicks change the DOM so the settle wait has mutations to observe
+  document.addEventListener('click', function (event) {{
+    const target = event.target.closest('button, a, [role="button"]');
+    if (target) {{
+      event.preventDefault();
+      target.classList.toggle('clicked');
+      document.getElementById('log').textContent = 'clicked ' + (target.id || target.textContent);
+    }}
+  }});
+</script>
+{script}
+</body>
+</html>
+"""
+
+WORDS = ("add", "cart", "search", "account", "order", "details", "settings", "filter", "next", "save",
+         "share", "review", "compare", "delete", "open", "price", "color", "size", "ship", "help")
+
+
+def _label(rng, words=3):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def _page(title, body, script=""):
+    return PAGE_TEMPLATE.format(title=title, body='<div id="log"></div>\n' + body, script=script)
+
+
+def flat_page(nodes, seed=0):
+    """nodes interactive elements (buttons, links, inputs, role=button divs), most of them below the fold."""
+    rng = random.Random(seed)
+    parts = ['<div class="grid">']
+    for index in range(nodes):
+        kind = index % 4
+        label = _label(rng)
+        if kind == 0:
+            parts.append(f'<button type="button" id="b{index}" class="btn primary">{label}</button>')
+        elif kind == 1:
+            parts.append(f'<a href="#item-{index}" class="link">{label}</a>')
+        elif kind == 2:
+            parts.append(f'<input type="text" name="field{index}" placeholder="{label}">')
+        else:
+            parts.append(f'<div role="button" tabindex="0" class="card">{label}</div>')
+        # Non-interactive filler, as on real pages
+        parts.append(f'<span class="meta">{_label(rng, 2)}</span>')
+    parts.append('</div>')
+    return _page(f"Flat page with {nodes} interactive nodes", "\n".join(parts))
+
+
+def shadow_page(depth, width=10, seed=0):
+    """Nested open shadow roots, depth levels deep, each with width buttons."""
+    rng = random.Random(seed)
+    labels = [[_label(rng) for _ in range(width)] for _ in range(depth)]
+    script = """<script>
+  const labels = %s;
+  function build(host, level) {
+    const root = host.attachShadow({mode: 'open'});
+    const grid = document.createElement('div');
+    grid.style.cssText = 'display:flex;flex-wrap:wrap;gap:4px;padding-left:4px';
+    for (const label of labels[level]) {
+      const button = document.createElement('button');
+      button.type = 'button';
+      button.textContent = label;
+      grid.appendChild(button);
+    }
+    root.appendChild(grid);
+    if (level + 1 < labels.length) {
+      const child = document.createElement('div');
+      root.appendChild(child);
+      build(child, level + 1);
+    }
+  }
+  build(document.getElementById('host'), 0);
+</script>""" % json.dumps(labels)
+    return _page(f"Shadow DOM {depth} levels deep", '<div id="host"></div>', script)
+
+
+def form_page(fields, seed=0):
+    """A long form: labelled text inputs, selects, checkboxes and textareas."""
+    rng = random.Random(seed)
+    parts = ['<form onsubmit="return false">']
+    for index in range(fields):
+        kind = index % 4
+        label = _label(rng, 2)
+        parts.append(f'<div><label for="f{index}">{label}</label>')
+        if kind == 0:
+            parts.append(f'<input type="text" id="f{index}" name="f{index}">')
+        elif kind == 1:
+            options = "".join(f"<option>{_label(rng, 1)}</option>" for _ in range(5))
+            parts.append(f'<select id="f{index}" name="f{index}">{options}</select>')
+        elif kind == 2:
+            parts.append(f'<input type="checkbox" id="f{index}" name="f{index}">')
+        else:
+            parts.append(f'<textarea id="f{index}" name="f{index}" rows="1"></textarea>')
+        parts.append('</div>')
+    parts.append('<button type="submit" id="submit">Submit</button></form>')
+    return _page(f"Form with {fields} fields", "\n".join(parts))
+
+
+def infinite_page(batch=50):
+    """A list that fetches another batch of items from /items whenever it is scrolled near the end."""
+    script = """<script>
+  let page = 0;
+  let loading = false;
+  async function load() {
+    if (loading) return;
+    loading = true;
+    const response = await fetch('/items?page=' + page + '&batch=%d');
+    const items = await response.json();
+    const list = document.getElementById('list');
+    for (const item of items) {
+      const row = document.createElement('li');
+      row.innerHTML = '<a href="#' + item.id + '">' + item.title + '</a> <button type="button">Save</button>';
+      list.appendChild(row);
+    }
+    page++;
+    loading = false;
+  }
+  window.addEventListener('scroll', function () {
+    if (window.innerHeight + window.scrollY > document.body.scrollHeight - 800) load();
+  });
+  load();
+</script>""" % batch
+    return _page("Infinite scroll list", '<ul id="list"></ul>', script)
+
+
+def _items(page, batch):
+    rng = random.Random(page)
+    return [{"id": f"item-{page}-{index}", "title": _label(rng, 4)} for index in range(batch)]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        try:
+            if url.path == "/flat":
+                body, content_type = flat_page(int(query.get("n", 100))), "text/html"
+            elif url.path == "/shadow":
+                body, content_type = shadow_page(int(query.get("depth", 10)), int(query.get("width", 10))), "text/html"
+            elif url.path == "/form":
+                body, content_type = form_page(int(query.get("fields", 200))), "text/html"
+            elif url.path == "/infinite":
+                body, content_type = infinite_page(int(query.get("batch", 50))), "text/html"
+            elif url.path == "/items":
+                items = _items(int(query.get("page", 0)), int(query.get("batch", 50)))
+                body, content_type = json.dumps(items), "application/json"
+            else:
+                self.send_error(404)
+                return
+        except ValueError:
+            self.send_error(400)
+            return
+
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FixtureServer:
+    """Serve the generated benchmark pages on 127.0.0.1 (random free port) from a background thread."""
+
+    def __init__(self, port=0):
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fixture-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
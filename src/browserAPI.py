@@ -2,19 +2,264 @@ from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
 from selenium.webdriver import ActionChains
+from selenium.common.exceptions import WebDriverException
+import asyncio
 import time
 import os
 import random
 import math
+import json
+from functools import lru_cache
+from urllib.parse import urlsplit
+from requestTrace import span
+
+SCRIPT_DIR = os.path.dirname(__file__)
+
+CONTENT_FORMATS = ("verbose", "compact")
+SETTLE_MODES = ("adaptive", "fixed")
+COMPACT_COLUMNS = "index|tag[:role]|id, name or .class|text ('=[n]' means same text as element n)|x,y"
+
+# Elements kept first when page content exceeds its token cap
+ELEMENT_PRIORITY = {"input": 3, "textarea": 3, "select": 3, "button": 2, "a": 1}
+
+# Network.setBlockedURLs patterns per resource category; the extractor only needs
+# DOM geometry and text, so none of these change what the LLM sees
+BLOCKING_PROFILES = {
+    "images": [f"*.{ext}{suffix}" for ext in ("png", "jpg", "jpeg", "gif", "webp", "avif", "bmp", "ico")
+               for suffix in ("", "?*")],
+    "media": [f"*.{ext}{suffix}" for ext in ("mp4", "webm", "ogg", "ogv", "mov", "mp3", "m4a", "wav", "m3u8", "mpd")
+              for suffix in ("", "?*")],
+    "fonts": [f"*.{ext}{suffix}" for ext in ("woff", "woff2", "ttf", "otf", "eot")
+              for suffix in ("", "?*")],
+    "trackers": [f"*://*.{host}/*" for host in (
+        "google-analytics.com", "googletagmanager.com", "doubleclick.net", "googlesyndication.com",
+        "googleadservices.com", "adservice.google.com", "amazon-adsystem.com", "facebook.net",
+        "hotjar.com", "segment.io", "segment.com", "mixpanel.com", "clarity.ms", "scorecardresearch.com",
+        "criteo.com", "criteo.net", "taboola.com", "outbrain.com", "adnxs.com", "quantserve.com"
+    )]
+}
+
+
+def parse_blocking_profiles(value):
+    """
+    Normalize blocking profiles given as a list or comma-separated string
+    ("all" selects every profile). Raises ValueError on unknown names.
+    """
+    if not value:
+        return []
+    names = value.split(",") if isinstance(value, str) else list(value)
+    names = [str(name).strip().lower() for name in names if str(name).strip()]
+    if "all" in names:
+        return list(BLOCKING_PROFILES)
+    unknown = [name for name in names if name not in BLOCKING_PROFILES]
+    if unknown:
+        raise ValueError(f"Unknown blocking profiles: {', '.join(unknown)} "
+                         f"(expected any of {', '.join(BLOCKING_PROFILES)} or all)")
+    return list(dict.fromkeys(names))
+
+
+# WebDriver errors raised when a script's document goes away under it
+NAVIGATION_ERRORS = ("document unloaded", "Cannot find context", "Execution context was destroyed",
+                     "Inspected target navigated or closed")
+
+
+@lru_cache(maxsize=None)
+def _read_script(filename):
+    """Read a bundled JavaScript file from the src directory (once per process)."""
+    with open(os.path.join(SCRIPT_DIR, filename), "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def create_driver(driver_path=None, headless=False, user_data_dir=None, disk_cache_bytes=None,
+                  log_navigations=False):
+    """
+    Launch a new Chrome driver configured the way BrowserAPI expects.
+    user_data_dir: persistent profile directory (a throwaway one is used otherwise).
+    log_navigations: keep Page events in the performance log for navigated_origins
+    (pooled drivers, whose visited origins are wiped before reuse).
+    """
+    options = webdriver.ChromeOptions()
+    options.add_argument("--log-level=3")
+    if user_data_dir:
+        options.add_argument(f"--user-data-dir={user_data_dir}")
+    if disk_cache_bytes:
+        options.add_argument(f"--disk-cache-size={int(disk_cache_bytes)}")
+    if headless:
+        options.add_argument("--headless=new")
+        options.add_argument("--window-size=1080,1080")
+        options.add_argument("--disable-gpu")
+        options.add_argument("--mute-audio")
+    if log_navigations:
+        options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+        options.add_experimental_option("perfLoggingPrefs", {"enableNetwork": False, "enablePage": True})
+
+    if driver_path:
+        service = Service(driver_path)
+        driver = webdriver.Chrome(service=service, options=options)
+    else:
+        driver = webdriver.Chrome(options=options)
+
+    if not headless:
+        driver.set_window_size(1080, 1080)
+    driver.set_script_timeout(60)
+
+    # Track mutations, pending requests and scrolling on every new document,
+    # and define the element extractor there so each snapshot only sends a call
+    for script in ("settle_monitor.js", "get_visible_elements.js"):
+        driver.execute_cdp_cmd(
+            "Page.addScriptToEvaluateOnNewDocument",
+            {"source": _read_script(script)}
+        )
+    return driver
+
+
+def navigated_origins(driver):
+    """
+    Origins of every document any frame navigated to since the last call, iframes
+    and redirects included, read from the driver's performance log (which this drains).
+    The driver must have been created with log_navigations.
+    """
+    origins = set()
+    for entry in driver.get_log("performance"):
+        try:
+            message = json.loads(entry["message"])["message"]
+        except (KeyError, ValueError):
+            continue
+        if message.get("method") != "Page.frameNavigated":
+            continue
+        frame = message.get("params", {}).get("frame", {})
+        url_parts = urlsplit(frame.get("securityOrigin") or frame.get("url", ""))
+        if url_parts.scheme in ("http", "https"):
+            origins.add(f"{url_parts.scheme}://{url_parts.netloc}")
+    return origins
+
+
+def describe_target(target):
+    """The parts of a resolved element that identify it across page loads."""
+    return {key: target.get(key, "") for key in ("tagName", "id", "name", "text")}
+
+
+def target_mismatch(actual, expected):
+    """
+    Why an element doesn't match a recorded descriptor, or None. The tag and any
+    recorded id or name must be equal; text is compared only when the element had
+    neither, since labels of identified elements often carry counts or prices.
+    """
+    if actual["tagName"] != expected.get("tagName"):
+        return f"<{actual['tagName']}> instead of <{expected.get('tagName')}>"
+    for key in ("id", "name"):
+        if expected.get(key) and actual[key] != expected[key]:
+            return f"{key} '{actual[key]}' instead of '{expected[key]}'"
+    if not (expected.get("id") or expected.get("name")):
+        if actual["text"].lower() != (expected.get("text") or "").lower():
+            return f"text '{actual['text']}' instead of '{expected.get('text')}'"
+    return None
+
+
+def _elapsed_ms(started):
+    return round((time.monotonic() - started) * 1000)
+
+
+def estimate_text_tokens(text):
+    """Rough token estimate (~4 characters per token)."""
+    return len(text) // 4 + 1
+
 
 class BrowserAPI:
-    def __init__(self, driver_path=None):
-        """Initialize with an optional path to your ChromeDriver."""
+    def __init__(self, driver_path=None, settle_mode="adaptive", settle_timeout=5, quiet_window_ms=300,
+                 diff_content=False, pool=None, content_format="verbose", max_content_tokens=None,
+                 text_limit=80, max_elements=500, max_traversal_nodes=20000, max_traversal_ms=200,
+                 highlight=False, headless=False, block_resources=None, profile_store=None, profile_id=None):
+        """
+        Initialize with an optional path to your ChromeDriver.
+
+        settle_mode: "adaptive" returns as soon as the page is quiet (readyState complete,
+        no DOM mutations, no pending fetch/XHR and no scrolling for quiet_window_ms),
+        "fixed" always sleeps for the full timeout like before.
+        settle_timeout: default max seconds to wait after an action.
+        diff_content: when True, page content after the first snapshot only lists the
+        elements added, removed or changed since the last full snapshot (the baseline).
+        pool: optional BrowserPool to check out warm drivers from and return them to.
+        content_format: "verbose" ('[index] <tag attrs> text (at x:, y:)' per element) or
+        "compact" (one 'index|tag|id|text|x,y' row per element, truncated and deduplicated text).
+        max_content_tokens: hard cap on the estimated tokens of the element list; the most
+        relevant elements (form controls, then buttons, then links) are kept.
+        text_limit: max characters of element text in compact format.
+        max_elements: max elements the extractor reports per snapshot.
+        max_traversal_nodes / max_traversal_ms: budget for walking the DOM, including
+        open shadow roots and same-origin iframes; extraction stops early past it.
+        highlight: outline action targets in red (debugging only, it mutates the page).
+        headless: launch Chrome without a window (takes effect on the next start_browser).
+        block_resources: blocking profiles ("images", "media", "fonts", "trackers" or "all")
+        whose requests are dropped by the browser; see set_blocked_resources.
+        profile_store / profile_id: launch with this persistent profile (cache, cookies and
+        localStorage kept across browser restarts) instead of a pooled, throwaway one.
+        """
+        if settle_mode not in SETTLE_MODES:
+            raise ValueError("settle_mode must be 'adaptive' or 'fixed'")
+        if content_format not in CONTENT_FORMATS:
+            raise ValueError("content_format must be 'verbose' or 'compact'")
+
         self.driver_path = driver_path
         self.driver = None
+        self.settle_mode = settle_mode
+        self.settle_timeout = settle_timeout
+        self.quiet_window_ms = quiet_window_ms
+        self.diff_content = diff_content
+        self._baseline = None
+        self.pool = pool
+        self._visited_origins = set()
+        self.content_format = content_format
+        self.max_content_tokens = max_content_tokens
+        self.text_limit = text_limit
+        self.max_elements = max_elements
+        self.max_traversal_nodes = max_traversal_nodes
+        self.max_traversal_ms = max_traversal_ms
+        self.highlight = highlight
+        self.headless = headless
+        self.block_resources = parse_blocking_profiles(block_resources)
+        self.profile_store = profile_store
+        self.profile_id = profile_id
+        if profile_id and not profile_store:
+            raise ValueError("profile_id requires a profile_store")
+        self.last_content_stats = None
+
+        self._settle_js = _read_script("settle_monitor.js") + "\n" + _read_script("wait_for_settle.js")
+        # Set while an event loop drives this browser, see finish_deferred_settle
+        self.defer_settle = False
+        self.deferred_settle = None
+
+    def _uses_pool(self):
+        """Pooled drivers are only interchangeable when launched the same way."""
+        return (self.pool is not None and not self.profile_id and self.pool.driver_path == self.driver_path and
+                self.pool.headless == self.headless)
+
+    def set_blocked_resources(self, profiles):
+        """
+        Block requests of these profiles from now on (an empty list unblocks everything).
+        Applies to the running browser right away, otherwise on the next start_browser.
+        """
+        self.block_resources = parse_blocking_profiles(profiles)
+        if self.driver:
+            self._apply_blocking()
+
+    def _apply_blocking(self):
+        patterns = [pattern for name in self.block_resources for pattern in BLOCKING_PROFILES[name]]
+        self.driver.execute_cdp_cmd("Network.enable", {})
+        self.driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": patterns})
+
+    def _launch_with_profile(self):
+        path = self.profile_store.acquire(self.profile_id)
+        try:
+            # Leave room for cookies and storage within the profile quota
+            return create_driver(self.driver_path, headless=self.headless, user_data_dir=path,
+                                 disk_cache_bytes=self.profile_store.max_profile_bytes // 2)
+        except Exception:
+            self.profile_store.release(self.profile_id)
+            raise
 
     def start_browser(self):
-        """Launch the browser (non-headless)."""
+        """Launch the browser (headless if configured) and apply resource blocking."""
         if self.driver:
             return {
                 "status": "error",
@@ -22,16 +267,18 @@ class BrowserAPI:
             }
         
         try:
-            options = webdriver.ChromeOptions()
-            options.add_argument("--log-level=3")
-
-            if self.driver_path:
-                service = Service(self.driver_path)
-                self.driver = webdriver.Chrome(service=service, options=options)
-            else:
-                self.driver = webdriver.Chrome(options=options)
-
-            self.driver.set_window_size(1080, 1080)
+            with span("browser.launch") as launch:
+                if self.profile_id:
+                    self.driver = self._launch_with_profile()
+                elif self._uses_pool():
+                    self.driver = self.pool.acquire()
+                if launch is not None:
+                    launch["pooled"] = self.driver is not None and not self.profile_id
+                if not self.driver:
+                    self.driver = create_driver(self.driver_path, headless=self.headless,
+                                                log_navigations=self._uses_pool())
+            # Always set, pooled drivers may still carry another session's list
+            self._apply_blocking()
 
             return {
                 "status": "success",
@@ -45,48 +292,346 @@ class BrowserAPI:
                 "error_message": f"Failed to start browser: {e}"
             }
 
-    def _get_page_content(self):
+    def _wait_for_settle(self, timeout=None, extract=False):
+        """
+        Wait until the page settles or the timeout (seconds) expires.
+        Returns (settle, page): settle is a dict with the mode, whether the page settled
+        and the measured wait; page is the raw extractor output when extract=True and it
+        could be taken in the same script call, otherwise None.
+        """
+        timeout = self.settle_timeout if timeout is None else timeout
+        start = time.monotonic()
+
+        if self.settle_mode == "fixed":
+            with span("sleep", seconds=timeout):
+                time.sleep(timeout)
+            return self._fixed_settle(start), None
+
+        deadline = start + timeout
+        state = None
+        with span("browser.settle", extract=extract) as settle_span:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                state = self._check_settled(timeout, time.monotonic() - start, extract)
+                if state is not None:
+                    break
+                # Document was replaced mid-check (navigation), poll the new one
+                with span("sleep", seconds=0.05):
+                    time.sleep(0.05)
+            return self._adaptive_settle(state, start, settle_span)
+
+    async def wait_for_settle_async(self, offload, timeout=None, extract=False):
+        """
+        _wait_for_settle for an event loop: each check is a short script call run
+        through offload(func, *args), and the pauses between checks are awaited, so
+        a waiting page holds no thread.
+        """
+        timeout = self.settle_timeout if timeout is None else timeout
+        start = time.monotonic()
+
+        if self.settle_mode == "fixed":
+            with span("sleep", seconds=timeout):
+                await asyncio.sleep(timeout)
+            return self._fixed_settle(start), None
+
+        deadline = start + timeout
+        state = None
+        with span("browser.settle", extract=extract) as settle_span:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                checked = await offload(self._check_settled, timeout, time.monotonic() - start, extract, True)
+                state = checked or state
+                if checked is not None and not checked.get("pending"):
+                    break
+                await asyncio.sleep(0.05)
+            return self._adaptive_settle(state, start, settle_span)
+
+    def _check_settled(self, timeout, waited_before, extract, check_once=False):
+        """
+        Run the settle script for a wait of timeout seconds of which waited_before have
+        passed already (both counted from the same start). Returns its state, or
+        None if the document was replaced mid-check (other WebDriver errors are raised).
+        With check_once it returns after a single check, with pending set when the page
+        isn't settled yet.
+        """
+        try:
+            return self.driver.execute_async_script(
+                self._settle_js, int(timeout * 1000), self.quiet_window_ms,
+                self._extract_options() if extract else None, int(waited_before * 1000), check_once
+            )
+        except WebDriverException as e:
+            if any(marker in str(e) for marker in NAVIGATION_ERRORS):
+                return None
+            # Script errors, script timeouts, a closed window or dead session: waiting longer won't help
+            raise
+
+    def _fixed_settle(self, start):
+        return {
+            "mode": "fixed",
+            "settled": True,
+            "waited_ms": round((time.monotonic() - start) * 1000)
+        }
+
+    def _adaptive_settle(self, state, start, settle_span):
+        if settle_span is not None and state:
+            settle_span["settled"] = bool(state.get("settled"))
+            settle_span["extract_ms"] = (state.get("page") or {}).get("elapsedMs")
+        return {
+            "mode": "adaptive",
+            "settled": bool(state and state.get("settled")),
+            "waited_ms": state.get("waitedMs") if state else round((time.monotonic() - start) * 1000)
+        }, (state or {}).get("page")
+
+    def _settle_and_get_content(self, settle_timeout=None):
+        """
+        Wait for the page to settle and extract its content, in one script call when possible.
+        With defer_settle set, only note the wait for finish_deferred_settle and return
+        a placeholder settle and no content.
+        """
+        if self.defer_settle:
+            self.deferred_settle = {"timeout": settle_timeout}
+            return {"mode": self.settle_mode, "settled": False, "waited_ms": 0}, None
+        settle, page = self._wait_for_settle(settle_timeout, extract=True)
+        return settle, self._get_page_content(page)
+
+    async def finish_deferred_settle(self, result, offload):
+        """
+        Complete the result of an action run with defer_settle: wait for the page to
+        settle on the event loop, extract content through offload and fill in content,
+        settle and timings. Returns the result.
+        """
+        deferred, self.deferred_settle = self.deferred_settle, None
+        try:
+            settle, page = await self.wait_for_settle_async(offload, deferred["timeout"], extract=True)
+            content = await offload(self._get_page_content, page)
+        except Exception as e:
+            result.pop("content", None)
+            result.pop("settle", None)
+            result.update(status="error", error_message=f"Content extraction failed: {e}")
+            return result
+        result["content"] = content
+        result["settle"] = settle
+        if "timings" in result:
+            result["timings"]["settle_ms"] = settle["waited_ms"]
+            result["timings"]["extract_ms"] = (self.last_content_stats or {}).get("extract_ms")
+        return result
+
+    def _get_page_content(self, page_content=None):
         """
         Extract structured page content, but ONLY include those interactive elements
         that lie within the current visible area (viewport) of the browser.
+        page_content: raw extractor output already taken (e.g. with the settle wait).
         Returns a dictionary with page information in a simplified format.
         """
         if not self.driver:
             return {"error": "Browser not started yet."}
         
-        # Read JS from a separate file & Execute
-        script_path = os.path.join(os.path.dirname(__file__), "get_visible_elements.js")
-        with open(script_path, "r", encoding="utf-8") as f:
-            js_script = f.read()
-        
-        page_content = self.driver.execute_script(js_script)
-        formatted_elements = []
+        if page_content is None:
+            page_content = self._extract_elements()
+        with span("browser.format", elements=len(page_content["interactiveElements"])):
+            return self._format_page_content(page_content)
+
+    def _format_page_content(self, page_content):
+        formatted_elements = {}
+
+        url_parts = urlsplit(page_content["url"])
+        if url_parts.scheme in ("http", "https"):
+            self._visited_origins.add(f"{url_parts.scheme}://{url_parts.netloc}")
         
+        seen_texts = {}
         for elem in page_content["interactiveElements"]:
-            elem_desc = f"[{elem['highlightIndex']}] <{elem['tagName']}"
-            
-            # Add 'role' if different from tag name
-            if elem['type'] != elem['tagName']:
-                elem_desc += f" role='{elem['type']}'"
-            
-            for attr in ['id', 'name', 'class']:
-                if attr in elem['attributes']:
-                    elem_desc += f" {attr}='{elem['attributes'][attr]}'"
-            
-            elem_desc += (
-                f"> {elem['text']} "
-                f"(at x:{elem['coordinates']['x']}, y:{elem['coordinates']['y']})"
-            )
-            formatted_elements.append(elem_desc)
+            if self.content_format == "compact":
+                elem_desc = self._format_compact(elem, seen_texts)
+            else:
+                elem_desc = self._format_verbose(elem)
+            formatted_elements[elem['highlightIndex']] = elem_desc
+
+        total_tokens = sum(estimate_text_tokens(desc) for desc in formatted_elements.values())
+        dropped = 0
+        if self.max_content_tokens and total_tokens > self.max_content_tokens:
+            formatted_elements, dropped = self._cap_elements(page_content["interactiveElements"], formatted_elements)
+            total_tokens = sum(estimate_text_tokens(desc) for desc in formatted_elements.values())
+        self.last_content_stats = {
+            "format": self.content_format,
+            "tokens": total_tokens,
+            "elements": len(formatted_elements),
+            "dropped_elements": dropped,
+            "visited_nodes": page_content.get("visitedNodes"),
+            "extract_ms": page_content.get("elapsedMs")
+        }
         
-        return {
+        content = {
             "url": page_content["url"],
             "title": page_content["title"],
-            "elements": formatted_elements,
+            "elements": list(formatted_elements.values()),
             "element_count": len(page_content["interactiveElements"])
         }
+        if self.content_format == "compact":
+            content["columns"] = COMPACT_COLUMNS
+        if dropped:
+            content["omitted_elements"] = dropped
+        if page_content.get("truncated"):
+            content["truncated"] = f"Only the first {self.max_elements} visible elements are listed"
+        elif page_content.get("budgetExceeded"):
+            content["truncated"] = "Page too large to scan fully; some visible elements may be missing"
+
+        if not self.diff_content:
+            return content
+
+        return self._diff_against_baseline(page_content, formatted_elements, content)
+
+    def _pointer_at(self, x, y):
+        """Return an ActionChains with the pointer moved to viewport point (x, y)."""
+        actions = ActionChains(self.driver)
+        actions.w3c_actions.pointer_action.move_to_location(int(x), int(y))
+        return actions
+
+    def _extract_options(self):
+        return {
+            "maxElements": self.max_elements,
+            "maxText": max(self.text_limit, 200),
+            "maxAttribute": 100,
+            "maxNodes": self.max_traversal_nodes,
+            "maxMillis": self.max_traversal_ms
+        }
+
+    def _extract_elements(self):
+        """
+        Run the in-page extractor. It is normally already defined on the document
+        (installed on every new document); the full source is only sent when it isn't.
+        """
+        options = self._extract_options()
+        with span("browser.extract") as extract_span:
+            page_content = self.driver.execute_script(
+                "return window.__interactExtract ? window.__interactExtract(arguments[0]) : null;", options
+            )
+            if page_content is None:
+                page_content = self.driver.execute_script(
+                    _read_script("get_visible_elements.js") + "\nreturn window.__interactExtract(arguments[0]);",
+                    options
+                )
+            if extract_span is not None:
+                extract_span["in_page_ms"] = page_content.get("elapsedMs")
+        return page_content
+
+    def _format_verbose(self, elem):
+        """Format an element as '[index] <tag role id name class> text (at x:, y:)'."""
+        elem_desc = f"[{elem['highlightIndex']}] <{elem['tagName']}"
+        
+        # Add 'role' if different from tag name
+        if elem['type'] != elem['tagName']:
+            elem_desc += f" role='{elem['type']}'"
+        
+        for attr in ['id', 'name', 'class']:
+            if attr in elem['attributes']:
+                elem_desc += f" {attr}='{elem['attributes'][attr]}'"
+        
+        elem_desc += (
+            f"> {elem['text']} "
+            f"(at x:{elem['coordinates']['x']}, y:{elem['coordinates']['y']})"
+        )
+        return elem_desc
+
+    def _format_compact(self, elem, seen_texts):
+        """
+        Format an element as one 'index|tag[:role]|identifier|text|x,y' row.
+        Only the first of id, name or class (first class name, shortened) is kept,
+        text is whitespace-collapsed and truncated, and repeated text points at
+        the first element that had it.
+        """
+        index = elem['highlightIndex']
+        tag = elem['tagName']
+        if elem['type'] != tag:
+            tag += f":{elem['type']}"
+
+        attributes = elem['attributes']
+        identifier = attributes.get('id') or attributes.get('name') or ""
+        if not identifier and attributes.get('class'):
+            identifier = "." + attributes['class'].split()[0][:24]
+
+        text = " ".join(elem['text'].split())
+        if len(text) > self.text_limit:
+            text = text[:self.text_limit - 1] + "…"
+        if len(text) > 12:
+            if text in seen_texts:
+                text = f"=[{seen_texts[text]}]"
+            else:
+                seen_texts[text] = index
+        text = text.replace("|", "/")
+
+        coordinates = elem['coordinates']
+        return f"{index}|{tag}|{identifier}|{text}|{coordinates['x']},{coordinates['y']}"
+
+    def _cap_elements(self, elements, formatted_elements):
+        """
+        Keep the most relevant elements within max_content_tokens, in page order.
+        Returns (kept formatted elements, number dropped).
+        """
+        def priority(elem):
+            rank = ELEMENT_PRIORITY.get(elem['tagName'], 0)
+            if elem['type'] == "button":
+                rank = max(rank, ELEMENT_PRIORITY["button"])
+            return (-rank, 0 if elem['text'].strip() else 1, elem['coordinates']['y'])
+
+        kept = set()
+        budget = self.max_content_tokens
+        for elem in sorted(elements, key=priority):
+            index = elem['highlightIndex']
+            tokens = estimate_text_tokens(formatted_elements[index])
+            if tokens <= budget:
+                kept.add(index)
+                budget -= tokens
+
+        capped = {index: desc for index, desc in formatted_elements.items() if index in kept}
+        return capped, len(formatted_elements) - len(capped)
+
+    def _diff_against_baseline(self, page_content, formatted_elements, full_content):
+        """
+        Return only the changes relative to the baseline snapshot, or a full snapshot
+        (which becomes the new baseline) after navigation or when a diff isn't worth it.
+        """
+        baseline = self._baseline
+        if (baseline is not None and
+                baseline["document_id"] == page_content["documentId"] and
+                baseline["url"] == page_content["url"]):
+            old_elements = baseline["elements"]
+            added = [desc for index, desc in formatted_elements.items() if index not in old_elements]
+            changed = [
+                desc for index, desc in formatted_elements.items()
+                if index in old_elements and old_elements[index] != desc
+            ]
+            removed = [index for index in old_elements if index not in formatted_elements]
+
+            # Large diffs (e.g. after scrolling moves every element) cost more than a resync
+            if len(added) + len(changed) + len(removed) < len(formatted_elements) / 2:
+                return {
+                    "url": full_content["url"],
+                    "title": full_content["title"],
+                    "mode": "diff",
+                    "added": added,
+                    "changed": changed,
+                    "removed": removed,
+                    "element_count": full_content["element_count"],
+                    **{key: full_content[key] for key in ("columns", "omitted_elements", "truncated") if key in full_content}
+                }
+
+        self._baseline = {
+            "document_id": page_content["documentId"],
+            "url": page_content["url"],
+            "elements": formatted_elements
+        }
+        full_content["mode"] = "full"
+        return full_content
+
+    def invalidate_snapshot(self):
+        """Drop the diff baseline so the next page content is a full snapshot."""
+        self._baseline = None
     
-    def refresh_content(self):
+    def refresh_content(self, settle_timeout=2):
         """
         Re-extract the latest page content without reloading the page.
         Useful for checking for dynamic changes on the current page.
@@ -98,13 +643,13 @@ class BrowserAPI:
             }
 
         try:
-            time.sleep(2)
-            content = self._get_page_content()
+            settle, content = self._settle_and_get_content(settle_timeout)
 
             return {
                 "status": "success",
                 "message": "Page content refreshed successfully",
-                "content": content
+                "content": content,
+                "settle": settle
             }
 
         except Exception as e:
@@ -113,7 +658,7 @@ class BrowserAPI:
                 "error_message": f"Content refresh failed: {e}"
             }
 
-    def go_to_website(self, url):
+    def go_to_website(self, url, settle_timeout=None):
         """Navigate to a specified URL."""
         if not self.driver:
             return {
@@ -122,14 +667,15 @@ class BrowserAPI:
             }
 
         try:
-            self.driver.get(url)
-            time.sleep(5)
-            content = self._get_page_content()
+            with span("browser.navigate"):
+                self.driver.get(url)
+            settle, content = self._settle_and_get_content(settle_timeout)
 
             return {
                 "status": "success",
                 "message": f"Navigated to {url}",
-                "content": content
+                "content": content,
+                "settle": settle
             }
 
         except Exception as e:
@@ -138,11 +684,59 @@ class BrowserAPI:
                 "error_message": f"Navigation failed: {e}"
             }
 
-    def click_at_coordinates(self, x, y):
+    def _act_and_snapshot(self, x, y, text=None, settle_timeout=None, snapshot=True, timings=None):
+        """
+        Action engine for clicks and text input: click viewport point (x, y) and type
+        text (if given) in a single W3C actions request, then, unless batching, wait for
+        the page to settle and extract content in one more script call.
+        Returns the success result with per-phase timings (ms).
+        """
+        timings = dict(timings or {})
+        started = time.monotonic()
+        actions = self._pointer_at(x, y).click()
+        if text is not None:
+            actions.send_keys(text)
+        with span("browser.act", typing=text is not None):
+            actions.perform()
+        timings["act_ms"] = _elapsed_ms(started)
+
+        if not snapshot:
+            return {"status": "success", "timings": timings}
+
+        settle, content = self._settle_and_get_content(settle_timeout)
+        timings["settle_ms"] = settle["waited_ms"]
+        timings["extract_ms"] = (self.last_content_stats or {}).get("extract_ms")
+
+        return {
+            "status": "success",
+            "content": content,
+            "settle": settle,
+            "timings": timings
+        }
+
+    def _resolve_point(self, x, y, prefer_clickable):
+        """
+        Find the element at (x, y) (through shadow roots and same-origin iframes) and
+        return the centre to act on, or (x, y) itself when nothing usable is there.
+        Returns (x, y, timings).
+        """
+        started = time.monotonic()
+        with span("browser.resolve", x=x, y=y):
+            target = self.driver.execute_script(
+                _read_script("element_from_point.js"), x, y, prefer_clickable, self.highlight
+            )
+        timings = {"resolve_ms": _elapsed_ms(started)}
+        if not target:
+            print("No element found. Acting on the viewport point.")
+            return x, y, timings
+        return target["x"], target["y"], timings
+
+    def click_at_coordinates(self, x, y, settle_timeout=None, snapshot=True):
         """
         Click at screen coordinates (x, y). 
-        1. Tries to find a clickable DOM element at that point and click it.
-        2. Falls back to offset-based clicking if no element is found.
+        1. Tries to find a clickable DOM element at that point and click its centre.
+        2. Falls back to clicking the point itself if no element is found.
+        With snapshot=False the settle wait and content extraction are skipped (batching).
         """
         if not self.driver:
             return {
@@ -151,47 +745,9 @@ class BrowserAPI:
             }
 
         try:
-            # Try to get clickable element from coordinates
-            element = self.driver.execute_script("""
-                const elem = document.elementFromPoint(arguments[0], arguments[1]);
-                if (!elem) return null;
-
-                if (['a', 'button', 'input', 'label'].includes(elem.tagName.toLowerCase())) {
-                    return elem;
-                }
-
-                const clickable = elem.querySelector('a, button, input, label');
-                return clickable || elem;
-            """, x, y)
-
-            actions = ActionChains(self.driver)
-
-            if element:
-                try:
-                    self.driver.execute_script("""
-                        const testElem = document.elementFromPoint(arguments[0], arguments[1]);
-                        if (testElem) {
-                            testElem.style.border = '2px solid red';
-                            testElem.setAttribute('data-click-target', 'true');
-                        }
-                    """, x, y)
-
-                    actions.move_to_element_with_offset(element, 1, 1).click().perform()
-                except Exception as click_error:
-                    print(f"Click on element failed, falling back to offset: {click_error}")
-                    actions.move_by_offset(x, y).click().perform()
-            else:
-                print("No element returned. Clicking by offset fallback.")
-                actions.move_by_offset(x, y).click().perform()
-
-            print("-----------")
-            time.sleep(5)
-            content = self._get_page_content()
-
-            return {
-                "status": "success",
-                "content": content
-            }
+            target_x, target_y, timings = self._resolve_point(x, y, True)
+            return self._act_and_snapshot(target_x, target_y, settle_timeout=settle_timeout,
+                                          snapshot=snapshot, timings=timings)
 
         except Exception as e:
             return {
@@ -199,11 +755,12 @@ class BrowserAPI:
                 "error_message": f"Click failed at ({x}, {y}): {e}"
             }
 
-    def input_text_at_coordinates(self, x, y, text):
+    def input_text_at_coordinates(self, x, y, text, settle_timeout=None, snapshot=True):
         """
         Type text into the input field located at screen coordinates (x, y). Tries to:
         1. Locate the DOM element at (x, y) and type into it precisely.
-        2. If that fails, falls back to offset-based interaction.
+        2. If that fails, falls back to clicking the point itself and typing.
+        With snapshot=False the settle wait and content extraction are skipped (batching).
         """
         if not self.driver:
             return {
@@ -215,36 +772,108 @@ class BrowserAPI:
             #temp offset
             x += 15
             
-            element = self.driver.execute_script(
-                "return document.elementFromPoint(arguments[0], arguments[1]);", x, y
-            )
+            target_x, target_y, timings = self._resolve_point(x, y, False)
+            return self._act_and_snapshot(target_x, target_y, text=text, settle_timeout=settle_timeout,
+                                          snapshot=snapshot, timings=timings)
 
-            actions = ActionChains(self.driver)
-            if element:
-                actions.move_to_element_with_offset(element, 1, 1).click().send_keys(text).perform()
-            else:
-                actions.move_by_offset(x, y).click().send_keys(text).perform()
-            
-            time.sleep(5)
-            content = self._get_page_content()
+        except Exception as e:
+            return {
+                "status": "error",
+                "error_message": f"Text input failed at ({x}, {y}): {e}"
+            }
 
-            return { 
-                "status": "success",
-                "content": content
+    def _resolve_index(self, index, expect=None):
+        """
+        Look up a reported element by highlight index. Returns (target, timings, error_result);
+        error_result carries fresh page content when the element is gone, or when expect
+        (a descriptor from describe_target) is given and the element doesn't match it.
+        """
+        started = time.monotonic()
+        with span("browser.resolve", index=index):
+            target = self.driver.execute_script(_read_script("resolve_element.js"), int(index), self.highlight)
+        timings = {"resolve_ms": _elapsed_ms(started)}
+        if target and target.get("status") == "ok":
+            mismatch = target_mismatch(describe_target(target), expect) if expect else None
+            if not mismatch:
+                return target, timings, None
+            return None, timings, {
+                "status": "error",
+                "error_message": f"Element [{index}] is not the expected element: {mismatch}.",
+                "content": self._get_page_content()
             }
 
+        reason = "is hidden" if target and target.get("status") == "hidden" else "is no longer on the page"
+        return None, timings, {
+            "status": "error",
+            "error_message": f"Element [{index}] {reason}. Pick a target from the current page content.",
+            "content": self._get_page_content()
+        }
+
+    def click_element(self, index, settle_timeout=None, snapshot=True, expect=None):
+        """
+        Click the element with this highlight index from the latest page content.
+        Fails fast with fresh page content if the element is gone, or doesn't match
+        the expect descriptor when one is given.
+        """
+        if not self.driver:
+            return {
+                "status": "error",
+                "error_message": "Browser not started"
+            }
+
+        try:
+            target, timings, error = self._resolve_index(index, expect)
+            if error:
+                return error
+
+            result = self._act_and_snapshot(target["x"], target["y"], settle_timeout=settle_timeout,
+                                            snapshot=snapshot, timings=timings)
+            result["message"] = f"Clicked element [{index}]"
+            result["target"] = describe_target(target)
+            return result
+
         except Exception as e:
             return {
                 "status": "error",
-                "error_message": f"Text input failed at ({x}, {y}): {e}"
+                "error_message": f"Click failed on element [{index}]: {e}"
+            }
+
+    def input_text_element(self, index, text, settle_timeout=None, snapshot=True, expect=None):
+        """
+        Type text into the element with this highlight index from the latest page content.
+        Fails fast with fresh page content if the element is gone, or doesn't match
+        the expect descriptor when one is given.
+        """
+        if not self.driver:
+            return {
+                "status": "error",
+                "error_message": "Browser not started"
             }
 
-    def scroll_page(self, x=0, y=500):
+        try:
+            target, timings, error = self._resolve_index(index, expect)
+            if error:
+                return error
+
+            result = self._act_and_snapshot(target["x"], target["y"], text=text, settle_timeout=settle_timeout,
+                                            snapshot=snapshot, timings=timings)
+            result["message"] = f"Typed into element [{index}]"
+            result["target"] = describe_target(target)
+            return result
+
+        except Exception as e:
+            return {
+                "status": "error",
+                "error_message": f"Text input failed on element [{index}]: {e}"
+            }
+
+    def scroll_page(self, x=0, y=500, settle_timeout=None, snapshot=True):
         """
         Smoothly scroll the page by the specified amount.
         Positive y scrolls down, negative y scrolls up.
         Positive x scrolls right, negative x scrolls left.
         Default scrolls down 500 pixels.
+        With snapshot=False the scroll is instant and no content is extracted (batching).
         """
         if not self.driver:
             return {
@@ -253,21 +882,26 @@ class BrowserAPI:
             }
 
         try:
-            self.driver.execute_script("""
-                window.scrollBy({
-                    top: arguments[1],
-                    left: arguments[0],
-                    behavior: 'smooth'
-                });
-            """, x, y)
+            # Later actions in a batch need final coordinates right away
+            with span("browser.scroll", x=x, y=y):
+                self.driver.execute_script("""
+                    window.scrollBy({
+                        top: arguments[1],
+                        left: arguments[0],
+                        behavior: arguments[2]
+                    });
+                """, x, y, 'smooth' if snapshot else 'instant')
+
+            if not snapshot:
+                return {"status": "success", "message": f"Scrolled by ({x}, {y}) pixels"}
 
-            time.sleep(5)
-            content = self._get_page_content()
+            settle, content = self._settle_and_get_content(settle_timeout)
 
             return {
                 "status": "success",
                 "message": f"Scrolled smoothly by ({x}, {y}) pixels",
-                "content": content
+                "content": content,
+                "settle": settle
             }
 
         except Exception as e:
@@ -276,6 +910,72 @@ class BrowserAPI:
                 "error_message": f"Scroll failed: {e}"
             }
 
+    def perform_actions(self, actions, settle_timeout=None, expect=None):
+        """
+        Run a list of page actions back-to-back, then wait for the page to settle
+        and extract content once. Each action is a dict:
+            {"action": "click", "index": ...} or {"action": "click", "x": ..., "y": ...}
+            {"action": "input", "index": ..., "text": "..."} or {"action": "input", "x": ..., "y": ..., "text": "..."}
+            {"action": "scroll", "x": 0, "y": 500}
+        expect: optional list of target descriptors (or None) aligned with actions,
+        checked for actions by index.
+        Stops at the first failing action.
+        """
+        if not self.driver:
+            return {
+                "status": "error",
+                "error_message": "Browser not started"
+            }
+
+        results = []
+        for index, action in enumerate(actions):
+            kind = action.get("action")
+            expected = expect[index] if expect and index < len(expect) else None
+            if kind == "click" and action.get("index") is not None:
+                result = self.click_element(action["index"], snapshot=False, expect=expected)
+            elif kind == "click":
+                result = self.click_at_coordinates(action["x"], action["y"], snapshot=False)
+            elif kind == "input" and action.get("index") is not None:
+                result = self.input_text_element(action["index"], action.get("text", ""), snapshot=False,
+                                                 expect=expected)
+            elif kind == "input":
+                result = self.input_text_at_coordinates(action["x"], action["y"], action.get("text", ""), snapshot=False)
+            elif kind == "scroll":
+                result = self.scroll_page(action.get("x", 0), action.get("y", 500), snapshot=False)
+            else:
+                result = {"status": "error", "error_message": f"Unknown action: {kind}"}
+
+            results.append({"action": kind, **{key: value for key, value in result.items() if key != "content"}})
+            if result["status"] != "success":
+                break
+
+        try:
+            settle, content = self._settle_and_get_content(settle_timeout)
+        except Exception as e:
+            return {
+                "status": "error",
+                "error_message": f"Content extraction after actions failed: {e}",
+                "results": results
+            }
+
+        failed = results and results[-1]["status"] != "success"
+        if failed:
+            return {
+                "status": "error",
+                "error_message": f"Action {len(results)} of {len(actions)} failed: {results[-1]['error_message']}",
+                "results": results,
+                "content": content,
+                "settle": settle
+            }
+
+        return {
+            "status": "success",
+            "message": f"Performed {len(results)} actions",
+            "results": results,
+            "content": content,
+            "settle": settle
+        }
+
     def close_browser(self):
         """
         Close the browser if it's open.
@@ -287,8 +987,19 @@ class BrowserAPI:
             }
 
         try:
-            self.driver.quit()
+            if self._uses_pool():
+                # Hand the driver back for reuse; the pool resets or quits it
+                self.pool.release(self.driver, self._visited_origins)
+            else:
+                try:
+                    self.driver.quit()
+                finally:
+                    # Chrome has flushed the profile to disk once quit returns
+                    if self.profile_id:
+                        self.profile_store.release(self.profile_id)
             self.driver = None
+            self._baseline = None
+            self._visited_origins = set()
             return {
                 "status": "success",
                 "message": "Browser closed",
@@ -0,0 +1,188 @@
+from browserAPI import create_driver, navigated_origins
+import threading
+
+
+class BrowserPool:
+    """
+    Keep a set of pre-launched, clean Chrome drivers so sessions don't pay
+    the cold start inside their first request.
+
+    - acquire() hands out an idle driver (or None when the pool is empty,
+      in which case the caller launches one itself).
+    - release() takes a driver back; it is reset in the background (cookies
+      and storage of every origin its frames visited cleared, HTTP cache
+      emptied, extra windows closed, about:blank loaded) and kept
+      for reuse while fewer than max_size drivers are idle, otherwise quit.
+    - A background thread keeps at least min_size drivers idle.
+    """
+
+    def __init__(self, min_size=0, max_size=4, driver_path=None, refill_interval=5.0, headless=False):
+        if min_size < 0 or max_size < min_size:
+            raise ValueError("Pool sizes must satisfy 0 <= min_size <= max_size")
+
+        self.min_size = min_size
+        self.max_size = max_size
+        self.driver_path = driver_path
+        self.refill_interval = refill_interval
+        self.headless = headless
+
+        self._idle = []
+        self._to_recycle = []
+        self._launching = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self.stats_counters = {"hits": 0, "misses": 0, "launched": 0, "recycled": 0, "discarded": 0}
+
+    def start(self):
+        """Start the background refill/recycle thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="browser-pool", daemon=True)
+        self._thread.start()
+
+    def acquire(self):
+        """Return a warm driver, or None if none is idle right now."""
+        while True:
+            with self._lock:
+                if not self._idle:
+                    self.stats_counters["misses"] += 1
+                    self._wakeup.set()
+                    return None
+                driver = self._idle.pop()
+
+            if self._is_alive(driver):
+                with self._lock:
+                    self.stats_counters["hits"] += 1
+                self._wakeup.set()
+                return driver
+            self._quit(driver)
+
+    def release(self, driver, visited_origins=()):
+        """Give a driver back to the pool. It is reset before anyone reuses it."""
+        with self._lock:
+            if self._stopped:
+                recycle = False
+            else:
+                self._to_recycle.append((driver, set(visited_origins)))
+                recycle = True
+
+        if recycle:
+            self._wakeup.set()
+        else:
+            self._quit(driver)
+
+    def stats(self):
+        """Return pool sizes and hit/miss counters."""
+        with self._lock:
+            return {
+                "idle": len(self._idle),
+                "recycling": len(self._to_recycle),
+                "launching": self._launching,
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                **self.stats_counters
+            }
+
+    def shutdown(self):
+        """Stop the background thread and quit every pooled driver."""
+        with self._lock:
+            self._stopped = True
+            drivers = self._idle + [driver for driver, _ in self._to_recycle]
+            self._idle = []
+            self._to_recycle = []
+        self._wakeup.set()
+        for driver in drivers:
+            self._quit(driver)
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.refill_interval)
+            self._wakeup.clear()
+
+            self._recycle_released()
+            self._refill()
+
+    def _recycle_released(self):
+        while True:
+            with self._lock:
+                if not self._to_recycle or self._stopped:
+                    return
+                driver, origins = self._to_recycle.pop()
+                keep = len(self._idle) < self.max_size
+
+            if keep and self._reset_driver(driver, origins):
+                with self._lock:
+                    if not self._stopped and len(self._idle) < self.max_size:
+                        self._idle.append(driver)
+                        self.stats_counters["recycled"] += 1
+                        continue
+            self._quit(driver)
+
+    def _refill(self):
+        while True:
+            with self._lock:
+                if self._stopped or len(self._idle) + self._launching >= self.min_size:
+                    return
+                self._launching += 1
+
+            try:
+                driver = create_driver(self.driver_path, headless=self.headless, log_navigations=True)
+            except Exception as e:
+                print(f"Browser pool failed to launch a driver: {e}")
+                with self._lock:
+                    self._launching -= 1
+                return
+
+            with self._lock:
+                self._launching -= 1
+                if self._stopped:
+                    driver_to_quit = driver
+                else:
+                    self._idle.append(driver)
+                    self.stats_counters["launched"] += 1
+                    driver_to_quit = None
+            if driver_to_quit:
+                self._quit(driver_to_quit)
+
+    def _reset_driver(self, driver, origins):
+        """Wipe session state from a driver. Returns False if it can't be reused."""
+        try:
+            handles = driver.window_handles
+            for handle in handles[1:]:
+                driver.switch_to.window(handle)
+                driver.close()
+            driver.switch_to.window(handles[0])
+
+            # Every navigation of the session, in any frame or window
+            origins = origins | navigated_origins(driver)
+            for origin in origins:
+                driver.execute_cdp_cmd(
+                    "Storage.clearDataForOrigin",
+                    {"origin": origin, "storageTypes": "all"}
+                )
+            driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+            driver.execute_cdp_cmd("Network.clearBrowserCache", {})
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": []})
+            driver.get("about:blank")
+            return True
+        except Exception as e:
+            print(f"Browser pool failed to reset a driver: {e}")
+            return False
+
+    def _is_alive(self, driver):
+        try:
+            driver.current_url
+            return True
+        except Exception:
+            return False
+
+    def _quit(self, driver):
+        try:
+            driver.quit()
+        except Exception:
+            pass
+        with self._lock:
+            self.stats_counters["discarded"] += 1
@@ -0,0 +1,208 @@
+from collections import deque
+import json
+
+PAGE_CONTENT_START = "<page_content>"
+PAGE_CONTENT_END = "</page_content>"
+CLEARED_PAGE_CONTENT = "Cleared to reduce tokens"
+SUMMARY_PREFIX = "Summary of earlier commands in this session:"
+
+
+def estimate_tokens(message):
+    """Rough token estimate (~4 characters per token) for a message or tool call item."""
+    if isinstance(message, dict):
+        text = message.get("content") or message.get("output") or ""
+        if not isinstance(text, str):
+            text = json.dumps(text, default=str)
+    else:
+        # Tool call items from the Responses API
+        text = f"{getattr(message, 'name', '')}{getattr(message, 'arguments', '')}"
+    return len(text) // 4 + 4
+
+
+class ContextManager:
+    """
+    Own the message list sent to the LLM and keep it within a token budget.
+
+    Token estimates are tracked per message as they are appended, and page
+    content outputs are indexed on the way in, so keeping only the newest
+    page contents costs O(1) per turn instead of rescanning every message.
+    When the estimate exceeds the budget, the oldest commands (user message
+    up to the next user message) are replaced by a one-line summary each.
+    """
+
+    def __init__(self, token_budget=60000, keep_page_contents=2, max_summaries=20, on_append=None):
+        self.token_budget = token_budget
+        self.keep_page_contents = keep_page_contents
+        self.max_summaries = max_summaries
+        # Called with every appended message (e.g. to trace it)
+        self.on_append = on_append
+
+        self.messages = []
+        self._tokens = {}  # id(message) -> estimated tokens
+        self.total_tokens = 0
+        self._page_contents = deque()
+        self.pinned = None
+
+    def append(self, message, page_content=False):
+        """Add a message. page_content marks function outputs wrapping <page_content>."""
+        tokens = estimate_tokens(message)
+        self.messages.append(message)
+        self._tokens[id(message)] = tokens
+        self.total_tokens += tokens
+        if page_content:
+            self._page_contents.append(message)
+        if self.on_append is not None:
+            self.on_append(message)
+
+    def extend(self, messages):
+        """Add several messages that don't carry page content."""
+        for message in messages:
+            self.append(message)
+
+    def reset(self):
+        """Drop everything except the system message."""
+        system_message = None
+        if self.messages and isinstance(self.messages[0], dict) and self.messages[0].get("role") == "system":
+            system_message = self.messages[0]
+
+        self.messages = []
+        self._tokens = {}
+        self.total_tokens = 0
+        self._page_contents = deque()
+        self.pinned = None
+        if system_message:
+            self.append(system_message)
+
+    def pin(self, message):
+        """
+        Keep this page content message readable (the baseline diffs refer to).
+        Call right after appending it; the previously pinned message becomes
+        the oldest regular page content.
+        """
+        if self._page_contents and self._page_contents[-1] is message:
+            self._page_contents.pop()
+        if self.pinned is not None:
+            self._page_contents.appendleft(self.pinned)
+        self.pinned = message
+
+    def compact(self):
+        """
+        Enforce the page content limit and the token budget before an LLM call.
+        Returns a dict describing what was cleared or dropped; "pinned_dropped"
+        tells the caller the pinned message no longer exists.
+        """
+        # The pinned message counts towards the page contents kept
+        limit = self.keep_page_contents - (1 if self.pinned is not None else 0)
+        cleared = 0
+        while len(self._page_contents) > max(limit, 0):
+            self._clear_page_content(self._page_contents.popleft())
+            cleared += 1
+
+        if cleared:
+            print(f"INFO: Cleared content from {cleared} older page_content messages.")
+
+        dropped = 0
+        pinned_dropped = False
+        while self.total_tokens > self.token_budget:
+            result = self._summarize_oldest_command()
+            if not result:
+                break
+            dropped += result["dropped"]
+            pinned_dropped = pinned_dropped or result["pinned_dropped"]
+
+        if dropped:
+            print(f"INFO: Summarized {dropped} older messages to stay within {self.token_budget} tokens "
+                  f"(now ~{self.total_tokens}).")
+
+        return {
+            "cleared_page_contents": cleared,
+            "dropped_messages": dropped,
+            "pinned_dropped": pinned_dropped,
+            "total_tokens": self.total_tokens
+        }
+
+    def _clear_page_content(self, message):
+        output = message["output"]
+        start_tag_pos = output.find(PAGE_CONTENT_START)
+        end_tag_pos = output.find(PAGE_CONTENT_END)
+        if start_tag_pos == -1 or end_tag_pos == -1:
+            return
+
+        # Preserve the tags but replace content between them
+        message["output"] = (
+            output[:start_tag_pos + len(PAGE_CONTENT_START)] +
+            CLEARED_PAGE_CONTENT +
+            output[end_tag_pos:]
+        )
+        self._retokenize(message)
+
+    def _retokenize(self, message):
+        tokens = estimate_tokens(message)
+        self.total_tokens += tokens - self._tokens[id(message)]
+        self._tokens[id(message)] = tokens
+
+    def _first_command_bounds(self):
+        """Return (start, end) of the oldest command that isn't the current one, or None."""
+        start = None
+        for index, message in enumerate(self.messages):
+            if isinstance(message, dict) and message.get("role") == "user":
+                if start is None:
+                    start = index
+                else:
+                    return start, index
+        return None
+
+    def _summary_index(self):
+        for index in range(min(2, len(self.messages))):
+            message = self.messages[index]
+            if (isinstance(message, dict) and message.get("role") == "assistant" and
+                    message.get("content", "").startswith(SUMMARY_PREFIX)):
+                return index
+        return None
+
+    def _summarize_oldest_command(self):
+        bounds = self._first_command_bounds()
+        if not bounds:
+            return None
+        start, end = bounds
+        group = self.messages[start:end]
+
+        # One line per command: what was asked, which tools ran, how it ended
+        command = group[0].get("content", "")
+        actions = [
+            f"{getattr(item, 'name', '')}({getattr(item, 'arguments', '')})"
+            for item in group if not isinstance(item, dict) and getattr(item, "type", None) == "function_call"
+        ]
+        outcome = ""
+        for item in reversed(group):
+            if isinstance(item, dict) and item.get("role") == "assistant" and item.get("content"):
+                outcome = item["content"]
+                break
+        line = f"- User: {command[:200]} | Actions: {', '.join(actions)[:300] or 'none'} | Result: {outcome[:200]}"
+
+        pinned_dropped = any(item is self.pinned for item in group)
+        if pinned_dropped:
+            self.pinned = None
+        dropped_ids = {id(item) for item in group}
+        self._page_contents = deque(m for m in self._page_contents if id(m) not in dropped_ids)
+
+        for item in group:
+            self.total_tokens -= self._tokens.pop(id(item))
+        del self.messages[start:end]
+
+        summary_index = self._summary_index()
+        if summary_index is None:
+            summary = {"role": "assistant", "content": f"{SUMMARY_PREFIX}\n{line}"}
+            has_system = (self.messages and isinstance(self.messages[0], dict) and
+                          self.messages[0].get("role") == "system")
+            self.messages.insert(1 if has_system else 0, summary)
+            tokens = estimate_tokens(summary)
+            self._tokens[id(summary)] = tokens
+            self.total_tokens += tokens
+        else:
+            summary = self.messages[summary_index]
+            lines = summary["content"].split("\n")[1:] + [line]
+            summary["content"] = "\n".join([SUMMARY_PREFIX] + lines[-self.max_summaries:])
+            self._retokenize(summary)
+
+        return {"dropped": len(group), "pinned_dropped": pinned_dropped}
@@ -0,0 +1,225 @@
+from openai.types.responses import Response
+from contextManager import PAGE_CONTENT_START
+from llmBackends import create_async
+from collections import OrderedDict
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+
+def _field(item, name):
+    if isinstance(item, dict):
+        return item.get(name)
+    return getattr(item, name, None)
+
+
+async def _call(func, *args):
+    return func(*args)
+
+
+def fingerprint(request, scope=None):
+    """
+    Hash what an LLM decision depends on: the model and tools, the current command,
+    the latest page snapshot (and the full snapshot it is a diff against), the last
+    action and how many actions the command has taken so far. Older history, summaries
+    and cleared page contents are ignored, so repeated runs of a flow over the same
+    pages produce the same key. scope keeps tenants (e.g. API keys) apart.
+    """
+    messages = request.get("input", [])
+    command = None
+    steps = 0
+    last_action = None
+    snapshot = None
+    baseline = None
+    needs_baseline = False
+    for item in reversed(messages):
+        role = _field(item, "role")
+        kind = _field(item, "type")
+        if kind == "function_call":
+            if command is None:
+                steps += 1
+            if last_action is None:
+                last_action = [_field(item, "name"), _field(item, "arguments")]
+        elif kind == "function_call_output":
+            output = _field(item, "output") or ""
+            if PAGE_CONTENT_START not in output:
+                pass
+            elif snapshot is None:
+                snapshot = " ".join(output.split())
+                # A diff only describes the page together with its baseline
+                needs_baseline = '"mode": "diff"' in output
+            elif needs_baseline and baseline is None and '"mode": "full"' in output:
+                baseline = " ".join(output.split())
+        elif role == "user" and command is None:
+            command = " ".join(str(_field(item, "content")).split()).lower()
+        if (command is not None and snapshot is not None and last_action is not None and
+                (baseline is not None or not needs_baseline)):
+            break
+
+    key = {
+        "model": request.get("model"),
+        "temperature": request.get("temperature"),
+        "tools": sorted(_field(tool, "name") or "" for tool in request.get("tools") or []),
+        "command": command,
+        "steps": steps,
+        "last_action": last_action,
+        "snapshot": snapshot,
+        "baseline": baseline,
+        "scope": scope
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class DecisionCache:
+    """
+    LLM responses by fingerprint, with a TTL and LRU eviction in memory and an
+    optional on-disk tier (one JSON file per entry) shared across restarts.
+    """
+
+    def __init__(self, max_entries=1000, ttl=24 * 3600, disk_dir=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+
+        self._entries = OrderedDict()  # key -> (expires_at, entry)
+        self._lock = threading.Lock()
+        self.stats_counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0,
+                               "saved_ms": 0}
+
+    def get(self, key):
+        """Return the cached entry ({"response", "latency_ms"}) or None."""
+        now = time.time()
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached and cached[0] > now:
+                self._entries.move_to_end(key)
+                self.stats_counters["memory_hits"] += 1
+                self.stats_counters["saved_ms"] += cached[1]["latency_ms"]
+                return cached[1]
+            if cached:
+                del self._entries[key]
+
+        entry = self._read_disk(key, now)
+        with self._lock:
+            if entry is None:
+                self.stats_counters["misses"] += 1
+                return None
+            self.stats_counters["disk_hits"] += 1
+            self.stats_counters["saved_ms"] += entry["latency_ms"]
+            self._remember(key, entry, now)
+        return entry
+
+    def put(self, key, response_data, latency_ms):
+        """Store a response (as plain data) and the latency a later hit saves."""
+        entry = {"response": response_data, "latency_ms": latency_ms}
+        now = time.time()
+        with self._lock:
+            self._remember(key, entry, now)
+            self.stats_counters["stores"] += 1
+        self._write_disk(key, entry)
+
+    def stats(self):
+        with self._lock:
+            hits = self.stats_counters["memory_hits"] + self.stats_counters["disk_hits"]
+            lookups = hits + self.stats_counters["misses"]
+            return {
+                "entries": len(self._entries),
+                "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+                **self.stats_counters
+            }
+
+    def _remember(self, key, entry, now):
+        # Caller holds self._lock
+        self._entries[key] = (now + self.ttl, entry)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats_counters["evictions"] += 1
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _read_disk(self, key, now):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            if now - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, key, entry):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temporary = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(temporary, "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+            os.replace(temporary, path)
+        except OSError as e:
+            print(f"Error writing decision cache entry: {e}")
+
+
+class CachingBackend:
+    """
+    LLM backend wrapper that answers repeated decisions from a DecisionCache and
+    only calls the wrapped backend on a miss. Decisions are only shared between
+    backends with the same scope, e.g. a hash of the API key.
+    """
+
+    def __init__(self, inner, cache, scope=None):
+        self.inner = inner
+        self.cache = cache
+        self.scope = scope
+        self.name = f"cached-{getattr(inner, 'name', 'llm')}"
+
+    def create(self, **request):
+        key = fingerprint(request, self.scope)
+        entry = self.cache.get(key)
+        if entry is not None:
+            return self._fresh_copy(entry["response"])
+
+        started = time.monotonic()
+        response = self.inner.create(**request)
+        self._store(key, response, started)
+        return response
+
+    async def acreate(self, **request):
+        # The disk tier reads and writes files, keep that off the event loop
+        io = asyncio.to_thread if self.cache.disk_dir else _call
+        key = fingerprint(request, self.scope)
+        entry = await io(self.cache.get, key)
+        if entry is not None:
+            return self._fresh_copy(entry["response"])
+
+        started = time.monotonic()
+        response = await create_async(self.inner, **request)
+        await io(self._store, key, response, started)
+        return response
+
+    def _store(self, key, response, started):
+        if not getattr(response, "error", None):
+            self.cache.put(key, response.model_dump(), round((time.monotonic() - started) * 1000))
+
+    def _fresh_copy(self, data):
+        # Tool calls go back into the conversation, so each hit needs its own call ids;
+        # item ids refer to the original response and are left out. No tokens were
+        # spent on a hit, so usage is dropped and the copy is flagged as cached.
+        data = json.loads(json.dumps(data))
+        data["usage"] = None
+        data["cached"] = True
+        for item in data.get("output", []):
+            if item.get("type") == "function_call":
+                item["call_id"] = f"call_{uuid.uuid4().hex[:24]}"
+                item.pop("id", None)
+        return Response.model_validate(data)
@@ -0,0 +1,70 @@
+// Resolve the element at viewport point (x, y), descending into open shadow roots
+// and same-origin iframes, and return the centre of the element to act on in
+// top-level viewport coordinates. Optionally outlines it for debugging.
+const x = arguments[0];
+const y = arguments[1];
+const preferClickable = arguments[2];
+const highlight = arguments[3];
+
+let elem = document.elementFromPoint(x, y);
+let offsetX = 0;
+let offsetY = 0;
+let inFrame = false;
+
+while (elem) {
+    if (elem.shadowRoot) {
+        const inner = elem.shadowRoot.elementFromPoint(x - offsetX, y - offsetY);
+        if (inner && inner !== elem) {
+            elem = inner;
+            continue;
+        }
+    }
+
+    if (elem.tagName === 'IFRAME' || elem.tagName === 'FRAME') {
+        let frameDocument = null;
+        try {
+            frameDocument = elem.contentDocument;
+        } catch (e) {
+            frameDocument = null;
+        }
+        if (frameDocument) {
+            const rect = elem.getBoundingClientRect();
+            const frameX = offsetX + rect.left + elem.clientLeft;
+            const frameY = offsetY + rect.top + elem.clientTop;
+            const inner = frameDocument.elementFromPoint(x - frameX, y - frameY);
+            if (inner) {
+                offsetX = frameX;
+                offsetY = frameY;
+                inFrame = true;
+                elem = inner;
+                continue;
+            }
+        }
+    }
+    break;
+}
+
+if (!elem) {
+    return null;
+}
+
+if (preferClickable && !['a', 'button', 'input', 'label'].includes(elem.tagName.toLowerCase())) {
+    elem = elem.querySelector('a, button, input, label') || elem;
+}
+
+if (highlight) {
+    elem.style.outline = '2px solid red';
+    elem.setAttribute('data-click-target', 'true');
+}
+
+const rect = elem.getBoundingClientRect();
+if (rect.width === 0 || rect.height === 0) {
+    return null;
+}
+
+return {
+    inFrame: inFrame,
+    tagName: elem.tagName.toLowerCase(),
+    x: Math.round(offsetX + rect.left + rect.width / 2),
+    y: Math.round(offsetY + rect.top + rect.height / 2)
+};
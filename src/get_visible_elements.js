@@ -1,80 +1,300 @@
-function getVisibleElementsInViewport() {
-    const interactiveElements = [];
-    let highlightIndex = 1;
-    
-    const viewportWidth = window.innerWidth;
-    const viewportHeight = window.innerHeight;
+// Installed once per document (via CDP on every new document, or on first use)
+// as window.__interactExtract(options); each call returns the visible elements,
+// including those in open shadow roots and same-origin iframes.
+(function installExtractor() {
+    if (window.__interactExtract) {
+        return;
+    }
 
     // Potentially interactive elements
-    const elements = document.querySelectorAll(
-        'a, button, input, select, textarea, [role="button"], [tabindex="0"]'
-    );
-
-    function isInViewport(rect) {
-        return (
-            rect.width > 0 &&
-            rect.height > 0 &&
-            rect.bottom >= 0 &&
-            rect.right >= 0 &&
-            rect.top <= viewportHeight &&
-            rect.left <= viewportWidth
-        );
+    const INTERACTIVE_SELECTOR = 'a, button, input, select, textarea, [role="button"], [tabindex="0"]';
+
+    // Subtrees that never contain anything we report
+    const SKIPPED_TAGS = new Set(['SCRIPT', 'STYLE', 'NOSCRIPT', 'TEMPLATE', 'HEAD', 'svg', 'SVG']);
+
+    // Attributes copied to the result; everything else is dropped
+    const KEPT_ATTRIBUTES = ['id', 'name', 'class', 'type', 'placeholder', 'aria-label'];
+
+    function boundedText(element, maxText) {
+        // Collect text nodes until the limit instead of materializing textContent of large containers
+        const walker = element.ownerDocument.createTreeWalker(element, NodeFilter.SHOW_TEXT);
+        let text = '';
+        while (walker.nextNode()) {
+            text += walker.currentNode.nodeValue;
+            if (text.length > maxText * 2) {
+                break;
+            }
+        }
+        text = text.replace(/\s+/g, ' ').trim();
+        return text.length > maxText ? text.slice(0, maxText) : text;
     }
 
-    elements.forEach(element => {
-        const rect = element.getBoundingClientRect();
-        if (isInViewport(rect)) {
-            
-            // get element attributes
+    window.__interactExtract = function getVisibleElementsInViewport(options) {
+        const maxElements = options.maxElements || 500;
+        const maxText = options.maxText || 200;
+        const maxAttribute = options.maxAttribute || 100;
+        const maxNodes = options.maxNodes || 20000;
+        const maxMillis = options.maxMillis || 200;
+
+        const interactiveElements = [];
+        let truncated = false;
+        let budgetExceeded = false;
+        let visitedNodes = 0;
+        const started = performance.now();
+
+        // Stable identities: an element keeps its index for the lifetime of the document
+        if (!window.__interactDocId) {
+            window.__interactDocId = Date.now().toString(36) + Math.random().toString(36).slice(2);
+            window.__interactNextIndex = 1;
+            // highlightIndex -> {element, frames}, so actions can target reported elements by index
+            window.__interactRegistry = new Map();
+        }
+        const registry = window.__interactRegistry;
+        if (registry.size > 5000) {
+            for (const [index, entry] of registry) {
+                if (!entry.element.deref()) {
+                    registry.delete(index);
+                }
+            }
+        }
+
+        function describe(element, rect, frame, labelsByFor) {
+            const tagName = element.tagName.toLowerCase();
+
+            // get element attributes (bounded)
             const attributes = {};
-            for (const attr of element.attributes) {
-                attributes[attr.name] = attr.value;
+            for (const name of KEPT_ATTRIBUTES) {
+                const value = element.getAttribute(name);
+                if (value !== null) {
+                    attributes[name] = value.length > maxAttribute ? value.slice(0, maxAttribute) : value;
+                }
             }
 
             // Get element text content
-            let textContent = element.textContent.trim();
+            let textContent = boundedText(element, maxText);
 
             // If input has value (like a text field)
-            if (element.tagName.toLowerCase() === 'input' && element.value) {
-                textContent = element.value;
+            if (tagName === 'input' && element.value) {
+                textContent = element.value.slice(0, maxText);
             }
 
             // If input is radio/checkbox, try to get associated label text
-            if (element.tagName.toLowerCase() === 'input' && element.id) {
-                const label = document.querySelector(`label[for="${element.id}"]`);
+            if (tagName === 'input' && element.id) {
+                const label = labelsByFor().get(element.id);
                 if (label) {
-                    textContent = label.textContent.trim();
+                    textContent = boundedText(label, maxText);
                 }
             }
 
             // Determine element type
-            let elementType = element.tagName.toLowerCase();
+            let elementType = tagName;
             if (element.getAttribute('role')) {
                 elementType = element.getAttribute('role');
             }
 
-            interactiveElements.push({
-                highlightIndex: highlightIndex++,
-                tagName: element.tagName.toLowerCase(),
+            if (!element.__interactIndex) {
+                element.__interactIndex = window.__interactNextIndex++;
+                registry.set(element.__interactIndex, {
+                    element: new WeakRef(element),
+                    frames: frame.frames
+                });
+            }
+
+            // Coordinates are in top-level viewport space, also inside iframes
+            return {
+                highlightIndex: element.__interactIndex,
+                tagName: tagName,
                 type: elementType,
                 text: textContent,
                 attributes: attributes,
                 coordinates: {
-                    x: Math.round(rect.left),
-                    y: Math.round(rect.top),
+                    x: Math.round(rect.left + frame.offsetX),
+                    y: Math.round(rect.top + frame.offsetY),
                     width: Math.round(rect.width),
                     height: Math.round(rect.height)
                 },
                 isVisible: true
+            };
+        }
+
+        function inClip(rect, clip) {
+            return rect.width > 0 && rect.height > 0 &&
+                rect.bottom >= clip.top && rect.right >= clip.left &&
+                rect.top <= clip.bottom && rect.left <= clip.right;
+        }
+
+        // Whether an element or one of its ancestors in this root is fixed or sticky
+        function inOverlay(element, getStyle) {
+            for (let current = element; current; current = current.parentElement) {
+                const position = getStyle(current).position;
+                if (position === 'fixed' || position === 'sticky') {
+                    return true;
+                }
+            }
+            return false;
+        }
+
+        // Reported elements, so the overlay pass doesn't repeat them
+        const reported = new Set();
+
+        // Walk a document or shadow root, skipping whole subtrees that are display: none
+        // or off-screen (unless fixed or sticky). display: contents boxes are not
+        // candidates but their children are visited. Fixed popovers and portals inside
+        // a skipped off-screen wrapper are found afterwards by a pass over the root's
+        // interactive elements only.
+        // frame: offset of this document in the top viewport and the visible area
+        // (clip) in this document's own coordinates.
+        function walk(root, frame) {
+            const start = root.body || root.documentElement || root;
+            if (!start) {
+                return;
+            }
+
+            // Label texts by target id, built once per root instead of one query per input
+            let labels = null;
+            const labelsByFor = () => {
+                if (!labels) {
+                    labels = new Map();
+                    for (const label of root.querySelectorAll('label[for]')) {
+                        if (!labels.has(label.htmlFor)) {
+                            labels.set(label.htmlFor, label);
+                        }
+                    }
+                }
+                return labels;
+            };
+
+            const clip = frame.clip;
+            const getStyle = frame.win.getComputedStyle.bind(frame.win);
+
+            // acceptNode runs last for the node nextNode() returns, so this is that node's rect
+            let acceptedRect = null;
+            const walker = (root.ownerDocument || root).createTreeWalker(start, NodeFilter.SHOW_ELEMENT, {
+                acceptNode(node) {
+                    visitedNodes++;
+                    if (SKIPPED_TAGS.has(node.tagName)) {
+                        return NodeFilter.FILTER_REJECT;
+                    }
+                    const rect = node.getBoundingClientRect();
+                    let candidate = true;
+                    if (rect.width === 0 && rect.height === 0 && node.getClientRects().length === 0) {
+                        if (getStyle(node).display === 'none') {
+                            return NodeFilter.FILTER_REJECT;
+                        }
+                        // display: contents (no box of its own) and similar wrappers
+                        candidate = false;
+                    } else if (rect.bottom < clip.top || rect.right < clip.left ||
+                            rect.top > clip.bottom || rect.left > clip.right) {
+                        const position = getStyle(node).position;
+                        if (position !== 'fixed' && position !== 'sticky') {
+                            return NodeFilter.FILTER_REJECT;
+                        }
+                    }
+                    if (candidate) {
+                        acceptedRect = rect;
+                        return NodeFilter.FILTER_ACCEPT;
+                    }
+                    // Shadow roots are walked from the loop, so hosts are returned without a rect
+                    if (node.shadowRoot) {
+                        acceptedRect = null;
+                        return NodeFilter.FILTER_ACCEPT;
+                    }
+                    return NodeFilter.FILTER_SKIP;
+                }
             });
+
+            let node;
+            while ((node = walker.nextNode())) {
+                if (visitedNodes > maxNodes || performance.now() - started > maxMillis) {
+                    budgetExceeded = true;
+                    return;
+                }
+                if (interactiveElements.length >= maxElements) {
+                    truncated = true;
+                    return;
+                }
+
+                const rect = acceptedRect;
+                if (rect && node.matches(INTERACTIVE_SELECTOR) && inClip(rect, clip)) {
+                    reported.add(node);
+                    interactiveElements.push(describe(node, rect, frame, labelsByFor));
+                }
+
+                // Open shadow roots are not part of the light DOM walk
+                if (node.shadowRoot) {
+                    walk(node.shadowRoot, frame);
+                }
+
+                // Same-origin iframes on screen; cross-origin ones throw or have no contentDocument
+                if (rect && (node.tagName === 'IFRAME' || node.tagName === 'FRAME')) {
+                    let frameDocument = null;
+                    try {
+                        frameDocument = node.contentDocument;
+                    } catch (e) {
+                        frameDocument = null;
+                    }
+                    if (frameDocument && frameDocument.defaultView) {
+                        const left = rect.left + node.clientLeft;
+                        const top = rect.top + node.clientTop;
+                        walk(frameDocument, {
+                            offsetX: frame.offsetX + left,
+                            offsetY: frame.offsetY + top,
+                            // Visible part of the frame, in the frame's own coordinates
+                            clip: {
+                                left: Math.max(0, clip.left - left),
+                                top: Math.max(0, clip.top - top),
+                                right: Math.min(node.clientWidth, clip.right - left),
+                                bottom: Math.min(node.clientHeight, clip.bottom - top)
+                            },
+                            win: frameDocument.defaultView,
+                            frames: frame.frames.concat([new WeakRef(node)])
+                        });
+                    }
+                }
+
+                if (budgetExceeded || truncated) {
+                    return;
+                }
+            }
+
+            // Overlays in rejected subtrees: on-screen interactive elements the walk didn't reach
+            for (const element of root.querySelectorAll(INTERACTIVE_SELECTOR)) {
+                if (performance.now() - started > maxMillis) {
+                    budgetExceeded = true;
+                    return;
+                }
+                if (interactiveElements.length >= maxElements) {
+                    truncated = true;
+                    return;
+                }
+                if (reported.has(element) || element.closest('svg')) {
+                    continue;
+                }
+                const rect = element.getBoundingClientRect();
+                if (inClip(rect, clip) && inOverlay(element, getStyle)) {
+                    reported.add(element);
+                    interactiveElements.push(describe(element, rect, frame, labelsByFor));
+                }
+            }
         }
-    });
 
-    return {
-        url: window.location.href,
-        title: document.title,
-        interactiveElements: interactiveElements
-    };
-}
+        walk(document, {
+            offsetX: 0,
+            offsetY: 0,
+            clip: { left: 0, top: 0, right: window.innerWidth, bottom: window.innerHeight },
+            win: window,
+            frames: []
+        });
 
-return getVisibleElementsInViewport();
+        return {
+            url: window.location.href,
+            title: document.title,
+            documentId: window.__interactDocId,
+            interactiveElements: interactiveElements,
+            truncated: truncated,
+            budgetExceeded: budgetExceeded,
+            visitedNodes: visitedNodes,
+            elapsedMs: Math.round(performance.now() - started)
+        };
+    };
+})();
@@ -0,0 +1,227 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import asyncio
+import threading
+import time
+import uuid
+
+
+class Job:
+    """A command submitted for a session, run in the background."""
+
+    def __init__(self, session_id, func, on_finish=None):
+        self.job_id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.func = func
+        self.on_finish = on_finish
+        self.status = "queued"  # queued | running | completed | failed | cancelled
+        self.result = None
+        self.error_message = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self.done = threading.Event()
+        self._done_callbacks = []
+        self._notified = False
+        self._callbacks_lock = threading.Lock()
+
+    def add_done_callback(self, callback):
+        """
+        Call callback(job) once the job has ended and released its resources, right
+        away if it already has. Lets async waiters avoid blocking a thread on job.done.
+        """
+        with self._callbacks_lock:
+            if not self._notified:
+                self._done_callbacks.append(callback)
+                return
+        callback(self)
+
+    def to_dict(self):
+        """Return a JSON-serializable view of the job."""
+        return {
+            "job_id": self.job_id,
+            "session_id": self.session_id,
+            "status": self.status,
+            "result": self.result,
+            "error_message": self.error_message,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+
+
+class JobManager:
+    """
+    Run jobs on a bounded thread pool. Jobs of the same session run one at a
+    time in submission order; different sessions run concurrently.
+    With an AsyncEngine, sessions are drained as coroutines on its event loop
+    instead: coroutine functions are awaited there and plain functions are
+    offloaded to its browser thread pool, so max_workers doesn't apply.
+    """
+
+    def __init__(self, max_workers=4, result_ttl=3600, engine=None):
+        self.result_ttl = result_ttl
+        self.engine = engine
+        self._executor = None if engine else ThreadPoolExecutor(max_workers=max_workers,
+                                                                thread_name_prefix="browser-job")
+        self._jobs = {}
+        self._queues = {}
+        self._active_sessions = set()
+        self._running = {}
+        self._lock = threading.Lock()
+
+    def submit(self, session_id, func, on_finish=None):
+        """
+        Queue func(job) for a session and return the Job immediately.
+        func receives the job so it can watch job.cancel_event; with an engine it
+        may be a coroutine function.
+        on_finish(job) runs once the job ends in any state, also when cancelled while queued.
+        """
+        job = Job(session_id, func, on_finish)
+        with self._lock:
+            self._prune_finished()
+            self._jobs[job.job_id] = job
+            self._queues.setdefault(session_id, deque()).append(job)
+            if session_id not in self._active_sessions:
+                self._active_sessions.add(session_id)
+                if self.engine:
+                    self.engine.submit(self._drain_async(session_id))
+                else:
+                    self._executor.submit(self._drain, session_id)
+        return job
+
+    def get(self, job_id):
+        """Return the job with this id, or None."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def position(self, job):
+        """Number of jobs ahead of this one in its session queue (0 if running or done)."""
+        with self._lock:
+            queue = self._queues.get(job.session_id)
+            if job.status != "queued" or not queue:
+                return 0
+            return list(queue).index(job) + (1 if job.session_id in self._running else 0)
+
+    def cancel(self, job_id):
+        """
+        Cancel a job. Queued jobs are dropped; running jobs are asked to stop
+        at their next checkpoint. Returns the job, or None if unknown.
+        """
+        finished = False
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job:
+                return None
+            if job.status == "queued":
+                self._queues[job.session_id].remove(job)
+                self._finish(job, "cancelled")
+                finished = True
+            elif job.status == "running":
+                job.cancel_event.set()
+        if finished:
+            self._notify(job)
+        return job
+
+    def cancel_session(self, session_id):
+        """Cancel every queued or running job of a session."""
+        with self._lock:
+            job_ids = [job.job_id for job in self._jobs.values()
+                       if job.session_id == session_id and job.status in ("queued", "running")]
+        for job_id in job_ids:
+            self.cancel(job_id)
+
+    def is_active(self, session_id):
+        """True while the session has queued or running jobs."""
+        with self._lock:
+            return session_id in self._active_sessions
+
+    def stats(self):
+        """Return job counts by status."""
+        counts = {}
+        with self._lock:
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            counts["active_sessions"] = len(self._active_sessions)
+        return counts
+
+    def _drain(self, session_id):
+        """Run a session's jobs one after another until its queue is empty."""
+        while True:
+            job = self._next_job(session_id)
+            if job is None:
+                return
+            try:
+                self._complete(job, job.func(job))
+            except Exception as e:
+                self._fail(job, e)
+            self._notify(job)
+
+    async def _drain_async(self, session_id):
+        """_drain on the engine's event loop."""
+        while True:
+            job = self._next_job(session_id)
+            if job is None:
+                return
+            try:
+                if asyncio.iscoroutinefunction(job.func):
+                    result = await job.func(job)
+                else:
+                    result = await self.engine.offload(job.func, job)
+                self._complete(job, result)
+            except Exception as e:
+                self._fail(job, e)
+            self._notify(job)
+
+    def _next_job(self, session_id):
+        """Mark the session's next job running, or retire the session when none is left."""
+        with self._lock:
+            queue = self._queues.get(session_id)
+            if not queue:
+                self._queues.pop(session_id, None)
+                self._active_sessions.discard(session_id)
+                return None
+            job = queue.popleft()
+            job.status = "running"
+            job.started_at = time.time()
+            self._running[session_id] = job
+            return job
+
+    def _complete(self, job, result):
+        status = "cancelled" if job.cancel_event.is_set() else "completed"
+        with self._lock:
+            job.result = result
+            self._finish(job, status)
+
+    def _fail(self, job, error):
+        print(f"Job {job.job_id} for session {job.session_id} failed: {error}")
+        with self._lock:
+            job.error_message = str(error)
+            self._finish(job, "failed")
+
+    def _finish(self, job, status):
+        # Caller holds self._lock
+        if self._running.get(job.session_id) is job:
+            del self._running[job.session_id]
+        job.status = status
+        job.finished_at = time.time()
+        job.done.set()
+
+    def _notify(self, job):
+        with job._callbacks_lock:
+            callbacks = ([job.on_finish] if job.on_finish else []) + job._done_callbacks
+            job._done_callbacks = []
+            job._notified = True
+        for callback in callbacks:
+            try:
+                callback(job)
+            except Exception as e:
+                print(f"Finish callback of job {job.job_id} failed: {e}")
+
+    def _prune_finished(self):
+        # Caller holds self._lock
+        cutoff = time.time() - self.result_ttl
+        for job_id, job in list(self._jobs.items()):
+            if job.finished_at is not None and job.finished_at < cutoff:
+                del self._jobs[job_id]
@@ -0,0 +1,250 @@
+from openai import AsyncOpenAI, OpenAI
+from openai.types.responses import Response
+from traceWriter import serialize_message, safe_file_name
+from functools import lru_cache
+import asyncio
+import hashlib
+import httpx
+import json
+import os
+import random
+import threading
+import time
+
+LLM_BACKENDS = ("openai", "record", "replay")
+
+# Recorders of all sessions may share one file
+_record_lock = threading.Lock()
+
+try:
+    import h2  # noqa: F401  (httpx needs it for HTTP/2)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class OpenAIClientRegistry:
+    """
+    OpenAI clients shared by all sessions, one per API key and base URL, each with a
+    keep-alive connection pool, so new sessions reuse warm connections instead of
+    opening their own. http2=None uses HTTP/2 when the h2 package is installed.
+    """
+
+    def __init__(self, max_connections=100, max_keepalive=20, keepalive_expiry=60, timeout=60,
+                 connect_timeout=5, http2=None, max_retries=2):
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive,
+                                   keepalive_expiry=keepalive_expiry)
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        if http2 and not HTTP2_AVAILABLE:
+            print("HTTP/2 requested for OpenAI clients but the h2 package is not installed, using HTTP/1.1")
+        self.http2 = HTTP2_AVAILABLE if http2 is None else (http2 and HTTP2_AVAILABLE)
+        self.max_retries = max_retries
+        self._clients = {}
+        self._async_clients = {}
+        self._lock = threading.Lock()
+        self.stats_counters = {"created": 0, "reused": 0}
+
+    def get(self, api_key, base_url=None):
+        """The shared client for an API key and base URL, created on first use."""
+        return self._get(self._clients, api_key, base_url, OpenAI, httpx.Client)
+
+    def get_async(self, api_key, base_url=None):
+        """
+        The shared AsyncOpenAI client for an API key and base URL. Its connections
+        belong to the event loop that first uses it, so only use it on one loop.
+        """
+        return self._get(self._async_clients, api_key, base_url, AsyncOpenAI, httpx.AsyncClient)
+
+    def close(self):
+        # Async clients are left to the event loop they belong to
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            try:
+                client.close()
+            except Exception as e:
+                print(f"Error closing OpenAI client: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {"clients": len(self._clients) + len(self._async_clients), "http2": self.http2,
+                    **self.stats_counters}
+
+    def _get(self, clients, api_key, base_url, client_class, http_client_class):
+        # Keyed by a hash so the registry doesn't hold keys in its index
+        key = (hashlib.sha256(api_key.encode("utf-8")).hexdigest(), base_url)
+        with self._lock:
+            client = clients.get(key)
+            if client is not None:
+                self.stats_counters["reused"] += 1
+                return client
+            http_client = http_client_class(limits=self.limits, timeout=self.timeout, http2=self.http2)
+            client = client_class(api_key=api_key, base_url=base_url, http_client=http_client,
+                                  timeout=self.timeout, max_retries=self.max_retries)
+            clients[key] = client
+            self.stats_counters["created"] += 1
+            return client
+
+
+class OpenAIBackend:
+    """The live OpenAI Responses API, on a shared client when given a registry."""
+
+    name = "openai"
+
+    def __init__(self, api_key, base_url=None, client_registry=None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.client_registry = client_registry
+        if client_registry is not None:
+            self.client = client_registry.get(api_key, base_url)
+        else:
+            self.client = OpenAI(api_key=api_key, base_url=base_url)
+        self._async_client = None
+
+    def create(self, **request):
+        return self.client.responses.create(**request)
+
+    async def acreate(self, **request):
+        if self._async_client is None:
+            if self.client_registry is not None:
+                self._async_client = self.client_registry.get_async(self.api_key, self.base_url)
+            else:
+                self._async_client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url)
+        return await self._async_client.responses.create(**request)
+
+
+class RecordingBackend:
+    """
+    Forward requests to another backend and append each request/response pair to
+    a JSONL file. "{session_id}" in the path is replaced (made safe as a file name),
+    giving one file per session.
+    """
+
+    name = "record"
+
+    def __init__(self, inner, path, session_id=None):
+        self.inner = inner
+        self.session_id = session_id
+        self.path = path.replace("{session_id}", safe_file_name(session_id or "default"))
+
+    def create(self, **request):
+        started = time.monotonic()
+        response = self.inner.create(**request)
+        self._record(request, response, started)
+        return response
+
+    async def acreate(self, **request):
+        started = time.monotonic()
+        response = await create_async(self.inner, **request)
+        await asyncio.to_thread(self._record, request, response, started)
+        return response
+
+    def _record(self, request, response, started):
+        record = {
+            "session_id": self.session_id,
+            "latency_ms": round((time.monotonic() - started) * 1000),
+            "request": {
+                **{key: value for key, value in request.items() if key != "input"},
+                "input": [serialize_message(message) for message in request.get("input", [])]
+            },
+            "response": response.model_dump()
+        }
+        line = json.dumps(record, default=str)
+        with _record_lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+@lru_cache(maxsize=16)
+def _load_recording(path, session_id):
+    responses = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if session_id is None or record.get("session_id") == session_id:
+                responses.append((record["response"], record.get("latency_ms", 0)))
+    if not responses:
+        raise ValueError(f"No recorded responses in {path}" + (f" for session {session_id}" if session_id else ""))
+    return tuple(responses)
+
+
+class ReplayBackend:
+    """
+    Serve recorded responses in order, ignoring the request, so a recorded run can be
+    repeated offline without an API key. Each instance (one per session) starts at the
+    first response. latency_ms is added per call (None replays the recorded latency),
+    plus up to jitter_ms of random extra delay; loop restarts the recording when it
+    runs out instead of failing.
+    """
+
+    name = "replay"
+
+    def __init__(self, path, session_id=None, latency_ms=0, jitter_ms=0, loop=False):
+        self.responses = _load_recording(os.path.abspath(path), session_id)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.loop = loop
+        self._position = 0
+
+    def create(self, **request):
+        data, delay_ms = self._next()
+        if delay_ms:
+            time.sleep(delay_ms / 1000)
+        return Response.model_validate(data)
+
+    async def acreate(self, **request):
+        data, delay_ms = self._next()
+        if delay_ms:
+            await asyncio.sleep(delay_ms / 1000)
+        return Response.model_validate(data)
+
+    def _next(self):
+        if self._position >= len(self.responses):
+            if not self.loop:
+                raise RuntimeError(f"Replay exhausted after {len(self.responses)} recorded responses")
+            self._position = 0
+        data, recorded_latency_ms = self.responses[self._position]
+        self._position += 1
+
+        delay_ms = recorded_latency_ms if self.latency_ms is None else self.latency_ms
+        if self.jitter_ms:
+            delay_ms += random.uniform(0, self.jitter_ms)
+        return data, delay_ms
+
+
+async def create_async(backend, **request):
+    """Await backend.acreate when the backend has one, else run its create in a worker thread."""
+    acreate = getattr(backend, "acreate", None)
+    if acreate is not None:
+        return await acreate(**request)
+    return await asyncio.to_thread(backend.create, **request)
+
+
+def create_backend(kind="openai", api_key=None, session_id=None, record_path=None, replay_path=None,
+                   replay_session=None, replay_latency_ms=0, replay_jitter_ms=0, replay_loop=False,
+                   base_url=None, client_registry=None):
+    """
+    Build the LLM backend for one session. Raises ValueError on missing settings.
+    client_registry, if given, supplies shared OpenAI clients instead of one per session.
+    """
+    if kind not in LLM_BACKENDS:
+        raise ValueError(f"LLM backend must be one of {', '.join(LLM_BACKENDS)}")
+
+    if kind == "replay":
+        if not replay_path:
+            raise ValueError("The replay LLM backend needs a recording path")
+        return ReplayBackend(replay_path, session_id=replay_session, latency_ms=replay_latency_ms,
+                             jitter_ms=replay_jitter_ms, loop=replay_loop)
+
+    if not api_key:
+        raise ValueError("OpenAI API key must be provided or set as OPENAI_API_KEY environment variable")
+    backend = OpenAIBackend(api_key, base_url=base_url, client_registry=client_registry)
+    if kind == "record":
+        if not record_path:
+            raise ValueError("The record LLM backend needs a recording path")
+        backend = RecordingBackend(backend, record_path, session_id=session_id)
+    return backend
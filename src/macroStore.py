@@ -0,0 +1,209 @@
+from urllib.parse import urlsplit, unquote_plus
+import json
+import os
+import re
+import threading
+import time
+
+SLOT_PATTERN = re.compile(r"\{([A-Za-z_][A-Za-z0-9_]*)\}")
+MACRO_NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$")
+
+
+def page_key(url):
+    """Origin and path of a URL, unquoted; the part of the page a macro step checks."""
+    parts = urlsplit(url or "")
+    return unquote_plus(f"{parts.scheme}://{parts.netloc}{parts.path}").rstrip("/")
+
+
+def _replace_texts(value, replace):
+    """
+    Apply replace() to every typed "text" argument, including the actions of
+    perform_actions. URLs, indexes and other arguments are left alone.
+    """
+    if isinstance(value, list):
+        return [_replace_texts(item, replace) for item in value]
+    if isinstance(value, dict):
+        return {key: replace(item) if key == "text" and isinstance(item, str) else _replace_texts(item, replace)
+                for key, item in value.items()}
+    return value
+
+
+def template_regex(template):
+    """
+    Compile a command template ("search for {term}") into a case-insensitive regex.
+    A slot repeated in templates saved before repeats were rejected must match the same text.
+    """
+    def literal(text):
+        return r"\s+".join(re.escape(word) for word in re.split(r"\s+", text))
+
+    template = template.strip()
+    pattern = ""
+    position = 0
+    seen = set()
+    for match in SLOT_PATTERN.finditer(template):
+        slot = match.group(1)
+        pattern += literal(template[position:match.start()])
+        pattern += f"(?P={slot})" if slot in seen else f"(?P<{slot}>.+?)"
+        seen.add(slot)
+        position = match.end()
+    pattern += literal(template[position:])
+    return re.compile("^" + pattern + "$", re.IGNORECASE)
+
+
+def build_macro(name, trajectory, command, params=None, template=None):
+    """
+    Turn a successful trajectory into a macro, keeping the page each step reached and
+    the element it acted on. Typed texts that equal a parameter
+    value become {slot} markers; the template defaults to the command with whole-word
+    occurrences of the values replaced the same way. URLs and expected pages are
+    kept as recorded.
+    Raises ValueError when the inputs don't fit together.
+    """
+    if not MACRO_NAME_PATTERN.match(name or ""):
+        raise ValueError("Macro name must be 1-64 letters, digits, '.', '_' or '-', starting with a letter or digit")
+    if not trajectory:
+        raise ValueError("There is no successful command to save in this session")
+    params = {str(key): str(value) for key, value in (params or {}).items() if str(value)}
+
+    slot_by_value = {value.lower(): slot for slot, value in params.items()}
+    used_slots = set()
+
+    def parameterize(text):
+        slot = slot_by_value.get(text.strip().lower())
+        if slot is None:
+            return text
+        used_slots.add(slot)
+        return "{" + slot + "}"
+
+    if not template and params:
+        # One pass over whole words, longest values first, so slots are never rewritten again
+        values = sorted(params.values(), key=len, reverse=True)
+        pattern = re.compile(r"(?<!\w)(" + "|".join(re.escape(value) for value in values) + r")(?!\w)",
+                             re.IGNORECASE)
+        templated = set()
+
+        def to_slot(match):
+            # Only the first occurrence of a value becomes its slot
+            slot = slot_by_value[match.group(0).lower()]
+            if slot in templated:
+                return match.group(0)
+            templated.add(slot)
+            return "{" + slot + "}"
+
+        template = pattern.sub(to_slot, command)
+    template = template or command
+    slot_list = SLOT_PATTERN.findall(template)
+    slots = set(slot_list)
+    if len(slots) != len(slot_list):
+        repeated = sorted({slot for slot in slot_list if slot_list.count(slot) > 1})
+        raise ValueError(f"Template repeats slot {', '.join(repeated)}; each slot may appear once")
+    if slots != set(params):
+        raise ValueError(f"Template slots {sorted(slots)} must match params {sorted(params)}")
+
+    steps = []
+    domain = None
+    for step in trajectory:
+        expected = page_key(step["url"]) if step.get("url") else None
+        if expected and domain is None:
+            domain = urlsplit(step["url"]).netloc
+        steps.append({
+            "function": step["function"],
+            "arguments": _replace_texts(step["arguments"], parameterize),
+            "expected_page": expected,
+            # Descriptor of the element acted on (one per action for perform_actions)
+            "target": step.get("target")
+        })
+    unused = sorted(set(params) - used_slots)
+    if unused:
+        raise ValueError(f"No typed text equals the value of {', '.join(unused)}, so replays couldn't change it")
+
+    return {
+        "name": name,
+        "domain": domain,
+        "template": template,
+        "steps": steps,
+        "created_at": time.time(),
+        "runs": 0,
+        "diverged": 0
+    }
+
+
+def instantiate(step, params):
+    """Fill a macro step's slots with parameter values. Returns (arguments, expected_page)."""
+    def fill(text):
+        match = SLOT_PATTERN.fullmatch(text)
+        return params.get(match.group(1), text) if match else text
+    return _replace_texts(step["arguments"], fill), step.get("expected_page")
+
+
+class MacroStore:
+    """Named macros persisted as one JSON file, matched against commands by template."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._macros = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self._macros = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Error loading macros from {path}: {e}")
+
+    def save(self, macro):
+        with self._lock:
+            self._macros[macro["name"]] = macro
+            self._persist()
+
+    def get(self, name):
+        with self._lock:
+            return self._macros.get(name)
+
+    def delete(self, name):
+        with self._lock:
+            if self._macros.pop(name, None) is None:
+                return False
+            self._persist()
+            return True
+
+    def list(self):
+        with self._lock:
+            return [
+                {key: macro[key] for key in ("name", "domain", "template", "runs", "diverged", "created_at")}
+                | {"steps": len(macro["steps"])}
+                for macro in self._macros.values()
+            ]
+
+    def match(self, command, domain=None):
+        """
+        Find the macro whose template matches the command, preferring one for the
+        given domain. Returns (macro, params) or (None, None).
+        """
+        normalized = " ".join(command.split())
+        with self._lock:
+            candidates = []
+            for macro in self._macros.values():
+                found = template_regex(macro["template"]).match(normalized)
+                if found:
+                    candidates.append((macro.get("domain") == domain, macro, found.groupdict()))
+        if not candidates:
+            return None, None
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+        return candidates[0][1], candidates[0][2]
+
+    def record_run(self, name, diverged):
+        with self._lock:
+            macro = self._macros.get(name)
+            if macro:
+                macro["runs"] += 1
+                macro["diverged"] += 1 if diverged else 0
+                self._persist()
+
+    def _persist(self):
+        # Caller holds self._lock
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(self._macros, f, indent=2)
+        os.replace(temporary, self.path)
@@ -0,0 +1,152 @@
+import os
+import re
+import shutil
+import threading
+import time
+
+# Profile ids become directory names
+PROFILE_ID_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$")
+
+# Regenerable caches, removed first when a profile exceeds its quota (cookies and
+# localStorage live elsewhere in the profile and are kept)
+CACHE_DIRS = (
+    os.path.join("Default", "Cache"),
+    os.path.join("Default", "Code Cache"),
+    os.path.join("Default", "Service Worker", "CacheStorage"),
+    os.path.join("Default", "GPUCache"),
+    "GrShaderCache",
+    "ShaderCache",
+    "GraphiteDawnCache"
+)
+
+# Left behind by a Chrome that didn't exit cleanly; they would block the next launch
+SINGLETON_FILES = ("SingletonLock", "SingletonCookie", "SingletonSocket")
+
+
+def _dir_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, filename)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class ProfileStore:
+    """
+    Persistent Chrome user-data directories, one per profile id (a tenant or
+    a session), so the HTTP cache, cookies and localStorage survive browser
+    restarts and logins don't have to be repeated.
+
+    - acquire() returns the directory for a profile and marks it in use; a
+      profile can only be used by one browser at a time.
+    - release() marks it free again and enforces the quotas: caches are trimmed
+      when a profile exceeds max_profile_mb, least recently used profiles are
+      deleted when all of them exceed max_total_mb, and profiles unused for
+      ttl seconds are deleted.
+    """
+
+    def __init__(self, root_dir, max_profile_mb=500, max_total_mb=5000, ttl=30 * 24 * 3600):
+        self.root_dir = os.path.abspath(root_dir)
+        self.max_profile_bytes = max_profile_mb * 1024 * 1024
+        self.max_total_bytes = max_total_mb * 1024 * 1024
+        self.ttl = ttl
+
+        self._in_use = set()
+        self._lock = threading.Lock()
+        self.stats_counters = {"reattached": 0, "created": 0, "trimmed": 0, "evicted": 0, "expired": 0}
+
+    def path_for(self, profile_id):
+        """Return the directory of a profile. Raises ValueError for unsafe ids."""
+        if not isinstance(profile_id, str) or not PROFILE_ID_PATTERN.match(profile_id):
+            raise ValueError("profile_id must be 1-64 letters, digits, '.', '_' or '-', starting with a letter or digit")
+        return os.path.join(self.root_dir, profile_id)
+
+    def acquire(self, profile_id):
+        """
+        Mark a profile in use and return its directory (created if new).
+        Raises RuntimeError if another browser is using it.
+        """
+        path = self.path_for(profile_id)
+        with self._lock:
+            if profile_id in self._in_use:
+                raise RuntimeError(f"Profile {profile_id} is already in use by another browser")
+            self._in_use.add(profile_id)
+            existed = os.path.isdir(path)
+            self.stats_counters["reattached" if existed else "created"] += 1
+
+        os.makedirs(path, exist_ok=True)
+        for filename in SINGLETON_FILES:
+            try:
+                os.remove(os.path.join(path, filename))
+            except OSError:
+                pass
+        os.utime(path)
+        return path
+
+    def release(self, profile_id):
+        """Mark a profile free (call after the browser has quit) and enforce quotas."""
+        path = self.path_for(profile_id)
+        with self._lock:
+            self._in_use.discard(profile_id)
+        if os.path.isdir(path):
+            os.utime(path)
+            self._trim(profile_id, path)
+        self.cleanup()
+
+    def delete(self, profile_id):
+        """Delete a profile. Returns False if it is in use or doesn't exist."""
+        path = self.path_for(profile_id)
+        with self._lock:
+            if profile_id in self._in_use or not os.path.isdir(path):
+                return False
+            shutil.rmtree(path, ignore_errors=True)
+        return True
+
+    def cleanup(self):
+        """Delete expired profiles, then the least recently used ones while over the total quota."""
+        profiles = []
+        now = time.time()
+        with self._lock:
+            if not os.path.isdir(self.root_dir):
+                return
+            for profile_id in os.listdir(self.root_dir):
+                path = os.path.join(self.root_dir, profile_id)
+                if profile_id in self._in_use or not os.path.isdir(path):
+                    continue
+                last_used = os.path.getmtime(path)
+                if now - last_used > self.ttl:
+                    shutil.rmtree(path, ignore_errors=True)
+                    self.stats_counters["expired"] += 1
+                    continue
+                profiles.append((last_used, profile_id, path))
+
+        sizes = {path: _dir_size(path) for _, _, path in profiles}
+        total = sum(sizes.values())
+        for _, profile_id, path in sorted(profiles):
+            if total <= self.max_total_bytes:
+                break
+            with self._lock:
+                if profile_id in self._in_use:
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+                self.stats_counters["evicted"] += 1
+            print(f"Evicted browser profile {profile_id} to stay within the profile storage quota")
+            total -= sizes[path]
+
+    def stats(self):
+        """Return the number of profiles, those in use and the counters."""
+        with self._lock:
+            count = len(os.listdir(self.root_dir)) if os.path.isdir(self.root_dir) else 0
+            return {"profiles": count, "in_use": len(self._in_use), **self.stats_counters}
+
+    def _trim(self, profile_id, path):
+        if _dir_size(path) <= self.max_profile_bytes:
+            return
+        for cache_dir in CACHE_DIRS:
+            shutil.rmtree(os.path.join(path, cache_dir), ignore_errors=True)
+        with self._lock:
+            self.stats_counters["trimmed"] += 1
+        print(f"Trimmed caches of browser profile {profile_id} to stay within its quota")
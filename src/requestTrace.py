@@ -0,0 +1,127 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+import cProfile
+import os
+import pstats
+import threading
+import time
+
+# A context variable rather than a thread-local: asyncio commands share the event loop
+# thread, and browser calls offloaded to worker threads carry a copy of the context
+_active_trace = ContextVar("request_trace", default=None)
+
+# cProfile can't profile two requests at once in one process
+_profile_lock = threading.Lock()
+
+
+class RequestTrace:
+    """
+    Span timeline of one request. Spans nest by call order in the context that
+    activated the trace; times are milliseconds since the trace started.
+    """
+
+    def __init__(self):
+        self._started = time.perf_counter()
+        self._stack = []
+        self.spans = []
+
+    @contextmanager
+    def span(self, name, **attributes):
+        record = {
+            "name": name,
+            "start_ms": self._elapsed_ms(),
+            "duration_ms": None,
+            "depth": len(self._stack),
+            "parent": self._stack[-1] if self._stack else None,
+            **attributes
+        }
+        self.spans.append(record)
+        self._stack.append(len(self.spans) - 1)
+        try:
+            yield record
+        finally:
+            self._stack.pop()
+            record["duration_ms"] = round(self._elapsed_ms() - record["start_ms"], 2)
+
+    def to_dict(self):
+        return {"total_ms": round(self._elapsed_ms(), 2), "spans": self.spans}
+
+    def _elapsed_ms(self):
+        return round((time.perf_counter() - self._started) * 1000, 2)
+
+
+@contextmanager
+def activate(trace):
+    """Make trace the target of span() in this context for the duration of the block."""
+    token = _active_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _active_trace.reset(token)
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Record a span in the active trace of this context. Yields the span dict (to add
+    attributes to) or None; costs one lookup when no trace is active.
+    """
+    trace = _active_trace.get()
+    if trace is None:
+        yield None
+        return
+    with trace.span(name, **attributes) as record:
+        yield record
+
+
+def profile_call(func, output_path=None, top=25, max_files=None):
+    """
+    Run func() under cProfile. Returns (result, profile) where profile has the
+    top functions by cumulative time and, with output_path, the pstats dump path.
+    max_files: keep at most this many .pstats dumps in output_path's directory,
+    deleting the oldest. If another request is being profiled, func runs unprofiled.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return func(), {"error": "Another request is being profiled; this one ran without the profiler"}
+
+    try:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            result = func()
+        finally:
+            profiler.disable()
+    finally:
+        _profile_lock.release()
+
+    profile = {}
+    if output_path:
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        profiler.dump_stats(output_path)
+        profile["path"] = output_path
+        if max_files:
+            _prune_dumps(os.path.dirname(output_path) or ".", max_files)
+
+    stats = pstats.Stats(profiler)
+    profile["top"] = []
+    for (filename, line, function), (_, calls, total, cumulative, _) in stats.stats.items():
+        profile["top"].append({
+            "function": f"{os.path.basename(filename)}:{line}({function})",
+            "calls": calls,
+            "total_ms": round(total * 1000, 2),
+            "cumulative_ms": round(cumulative * 1000, 2)
+        })
+    profile["top"].sort(key=lambda entry: entry["cumulative_ms"], reverse=True)
+    profile["top"] = profile["top"][:top]
+    return result, profile
+
+
+def _prune_dumps(directory, max_files):
+    """Delete the oldest .pstats files in directory beyond max_files."""
+    try:
+        paths = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".pstats")]
+        paths.sort(key=os.path.getmtime)
+        for path in paths[:-max_files]:
+            os.remove(path)
+    except OSError as e:
+        print(f"Error pruning profile dumps: {e}")
@@ -0,0 +1,60 @@
+// Look up an element reported by the extractor by its highlight index and return
+// its centre in top-level viewport coordinates, the point to act on, plus a short
+// descriptor (tag, id, name, text) to recognise it by. Fails fast with status
+// "stale" when it is gone from the page. Optionally outlines it.
+const index = arguments[0];
+const highlight = arguments[1];
+const registry = window.__interactRegistry;
+const entry = registry && registry.get(index);
+const elem = entry && entry.element.deref();
+
+if (!elem || !elem.isConnected) {
+    return { status: 'stale' };
+}
+
+const frames = entry.frames.map(ref => ref.deref());
+if (frames.some(frame => !frame || !frame.isConnected)) {
+    return { status: 'stale' };
+}
+
+// Bring it into view if layout moved it off-screen since the snapshot
+let rect = elem.getBoundingClientRect();
+const view = elem.ownerDocument.defaultView;
+if (rect.bottom < 0 || rect.top > view.innerHeight || rect.right < 0 || rect.left > view.innerWidth) {
+    elem.scrollIntoView({ block: 'center', inline: 'center', behavior: 'instant' });
+    rect = elem.getBoundingClientRect();
+}
+if (rect.width === 0 || rect.height === 0) {
+    return { status: 'hidden', tagName: elem.tagName.toLowerCase() };
+}
+
+if (highlight) {
+    elem.style.outline = '2px solid red';
+    elem.setAttribute('data-click-target', 'true');
+}
+
+let offsetX = 0;
+let offsetY = 0;
+for (const frame of frames) {
+    const frameRect = frame.getBoundingClientRect();
+    offsetX += frameRect.left + frame.clientLeft;
+    offsetY += frameRect.top + frame.clientTop;
+}
+
+// Form controls are described by their label, not by the value typed into them
+const tagName = elem.tagName.toLowerCase();
+const isField = tagName === 'input' || tagName === 'textarea' || tagName === 'select';
+const text = isField
+    ? (elem.getAttribute('aria-label') || elem.getAttribute('placeholder') || '')
+    : (elem.innerText || elem.getAttribute('aria-label') || '');
+
+return {
+    status: 'ok',
+    inFrame: frames.length > 0,
+    tagName: tagName,
+    id: elem.id || '',
+    name: elem.getAttribute('name') || '',
+    text: text.replace(/\s+/g, ' ').trim().slice(0, 80),
+    x: Math.round(offsetX + rect.left + rect.width / 2),
+    y: Math.round(offsetY + rect.top + rect.height / 2)
+};
@@ -0,0 +1,182 @@
+import os
+import threading
+import time
+
+
+def _children_by_parent():
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                # The command name may contain spaces; fields after it are fixed
+                parent = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(parent, []).append(int(entry))
+    return children
+
+
+def process_tree_rss_mb(pids):
+    """
+    Resident memory (MB) of these processes and all their descendants, read from
+    /proc. Returns None where /proc isn't available.
+    """
+    if not os.path.isdir("/proc"):
+        return None
+    children = _children_by_parent()
+    total_kb = 0
+    pending = list(pids)
+    seen = set()
+    while pending:
+        pid = pending.pop()
+        if pid in seen:
+            continue
+        seen.add(pid)
+        pending.extend(children.get(pid, ()))
+        try:
+            with open(f"/proc/{pid}/status", "r") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total_kb += int(line.split()[1])
+                        break
+        except (OSError, ValueError):
+            continue
+    return total_kb / 1024
+
+
+def _driver_pid(browser_llm):
+    driver = browser_llm.browser.driver
+    try:
+        return driver.service.process.pid
+    except AttributeError:
+        return None
+
+
+class SessionReaper:
+    """
+    Free resources of abandoned sessions in the background.
+
+    - Browsers of sessions idle for browser_idle_ttl seconds are closed (the
+      conversation is kept, the next command starts a new browser).
+    - Sessions idle for session_ttl seconds are dropped entirely.
+    - While more than max_browsers browsers are live, or they use more than
+      memory_budget_mb, the least recently active sessions' browsers are closed.
+
+    Sessions with queued or running commands are never touched, and browsers are
+    closed through the session's job queue so a close never overlaps a command.
+    """
+
+    def __init__(self, instances, instances_lock, job_manager, browser_idle_ttl=600, session_ttl=3600,
+                 max_browsers=0, memory_budget_mb=0, interval=30.0):
+        self.instances = instances
+        self.instances_lock = instances_lock
+        self.job_manager = job_manager
+        self.browser_idle_ttl = browser_idle_ttl
+        self.session_ttl = session_ttl
+        self.max_browsers = max_browsers
+        self.memory_budget_mb = memory_budget_mb
+        self.interval = interval
+
+        self._stopped = threading.Event()
+        self._thread = None
+        self.last_memory_mb = None
+        self.stats_counters = {"browsers_closed": 0, "sessions_dropped": 0, "browsers_evicted": 0}
+
+    def start(self):
+        """Start the background reaper thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="session-reaper", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def stats(self):
+        """Return the limits, the last measured browser memory and the counters."""
+        return {
+            "browser_idle_ttl": self.browser_idle_ttl,
+            "session_ttl": self.session_ttl,
+            "max_browsers": self.max_browsers,
+            "memory_budget_mb": self.memory_budget_mb,
+            "browser_memory_mb": None if self.last_memory_mb is None else round(self.last_memory_mb),
+            **self.stats_counters
+        }
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.reap()
+            except Exception as e:
+                print(f"Session reaper failed: {e}")
+
+    def reap(self):
+        """Apply the idle TTLs and the browser limits once."""
+        now = time.time()
+        to_close = []
+        live = []
+        with self.instances_lock:
+            # Browsers with running commands count towards the limits, they just can't be evicted
+            started = [browser_llm for browser_llm in self.instances.values() if browser_llm.browser_started]
+            pids = [_driver_pid(browser_llm) for browser_llm in started] if self.memory_budget_mb else []
+            live_count = len(started)
+            for session_id, browser_llm in list(self.instances.items()):
+                if self.job_manager.is_active(session_id):
+                    continue
+                idle = now - browser_llm.last_active
+                if self.session_ttl and idle > self.session_ttl:
+                    del self.instances[session_id]
+                    self.stats_counters["sessions_dropped"] += 1
+                    print(f"Dropped session {session_id} after {round(idle)}s idle")
+                    if browser_llm.browser_started:
+                        to_close.append((session_id, browser_llm))
+                elif browser_llm.browser_started:
+                    if self.browser_idle_ttl and idle > self.browser_idle_ttl:
+                        self.stats_counters["browsers_closed"] += 1
+                        print(f"Closing browser of session {session_id} after {round(idle)}s idle")
+                        to_close.append((session_id, browser_llm))
+                    else:
+                        live.append((browser_llm.last_active, session_id, browser_llm))
+        live_count -= len(to_close)
+
+        memory_mb = None
+        per_browser_mb = 0
+        if self.memory_budget_mb:
+            measured = [pid for pid in pids if pid]
+            memory_mb = process_tree_rss_mb(measured)
+            self.last_memory_mb = memory_mb
+            # The measurement covers every live browser, busy ones included, not just the evictable
+            if memory_mb and measured:
+                per_browser_mb = memory_mb / len(measured)
+                # Browsers already being closed for idleness free their share too
+                memory_mb -= per_browser_mb * len(to_close)
+
+        # Least recently active first
+        live.sort(key=lambda entry: entry[0])
+        for _, session_id, browser_llm in live:
+            over_count = self.max_browsers and live_count > self.max_browsers
+            over_memory = self.memory_budget_mb and memory_mb is not None and memory_mb > self.memory_budget_mb
+            if not over_count and not over_memory:
+                break
+            print(f"Evicting browser of least recently active session {session_id}")
+            to_close.append((session_id, browser_llm))
+            self.stats_counters["browsers_evicted"] += 1
+            live_count -= 1
+            if memory_mb is not None:
+                memory_mb -= per_browser_mb
+
+        for session_id, browser_llm in to_close:
+            last_active = browser_llm.last_active
+            self.job_manager.submit(
+                session_id, lambda job, browser_llm=browser_llm, last_active=last_active:
+                    self._close(browser_llm, last_active)
+            )
+
+    def _close(self, browser_llm, last_active):
+        # Runs on the session's job queue; skip it if a command used the session meanwhile
+        if browser_llm.browser_started and browser_llm.last_active == last_active:
+            return browser_llm.call_function("close_browser", {})
+        return None
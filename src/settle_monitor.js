@@ -0,0 +1,53 @@
+(function installSettleMonitor() {
+    if (window.__settleMonitor) {
+        return;
+    }
+
+    const monitor = {
+        pending: 0,
+        lastMutation: performance.now(),
+        lastScroll: -Infinity
+    };
+    window.__settleMonitor = monitor;
+
+    // Count in-flight fetch requests
+    const originalFetch = window.fetch;
+    if (originalFetch) {
+        window.fetch = function () {
+            monitor.pending++;
+            try {
+                return originalFetch.apply(this, arguments).finally(() => {
+                    monitor.pending--;
+                });
+            } catch (e) {
+                monitor.pending--;
+                throw e;
+            }
+        };
+    }
+
+    // Count in-flight XHR requests
+    const originalSend = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function () {
+        monitor.pending++;
+        this.addEventListener('loadend', () => {
+            monitor.pending--;
+        }, { once: true });
+        return originalSend.apply(this, arguments);
+    };
+
+    // Track the last DOM mutation (observing the document works before <html> exists)
+    new MutationObserver(() => {
+        monitor.lastMutation = performance.now();
+    }).observe(document, {
+        childList: true,
+        subtree: true,
+        attributes: true,
+        characterData: true
+    });
+
+    // Track the last scroll event of the page or any scrollable container
+    window.addEventListener('scroll', () => {
+        monitor.lastScroll = performance.now();
+    }, { capture: true, passive: true });
+})();
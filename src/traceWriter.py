@@ -0,0 +1,148 @@
+import gzip
+import hashlib
+import json
+import os
+import queue
+import random
+import re
+import shutil
+import threading
+import time
+
+
+def serialize_message(message):
+    """Turn a context message (dict or Responses API item) into JSON-serializable data."""
+    if isinstance(message, dict):
+        return message
+    if hasattr(message, "model_dump"):
+        return message.model_dump()
+    if hasattr(message, "__dict__"):
+        return {key: value for key, value in vars(message).items() if not key.startswith("_")}
+    return str(message)
+
+
+def safe_file_name(value):
+    """
+    A single path component for a client-supplied id: unsafe characters are replaced
+    and, when anything changed (or the id is empty, "." or ".."), disambiguated by a hash.
+    """
+    name = re.sub(r"[^A-Za-z0-9_.-]", "_", str(value))[:80]
+    if name != str(value) or name in ("", ".", ".."):
+        name = f"{name}-{hashlib.sha1(str(value).encode('utf-8')).hexdigest()[:8]}"
+    return name
+
+
+class TraceWriter:
+    """
+    Append-only JSONL traces, one file per session, written by a background thread.
+
+    write() only enqueues a record, so tracing adds no file I/O or serialization
+    to the request path. The buffer is bounded: records are dropped (and counted)
+    when it is full rather than blocking a command. Files are rotated once they
+    exceed max_bytes, keeping `backups` older files, optionally gzip-compressed.
+    sample_rate is the fraction of commands traced (see sample()).
+    """
+
+    def __init__(self, directory, max_queue=10000, max_bytes=10 * 1024 * 1024, backups=3,
+                 compress=False, sample_rate=1.0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.compress = compress
+        self.sample_rate = sample_rate
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.stats_counters = {"written": 0, "dropped": 0, "rotated": 0, "errors": 0}
+
+    def start(self):
+        """Start the background writer thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="trace-writer", daemon=True)
+        self._thread.start()
+
+    def sample(self):
+        """Decide whether to trace the next command."""
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def write(self, session_id, record):
+        """Queue a record for a session's trace. Never blocks; drops it if the buffer is full."""
+        try:
+            self._queue.put_nowait((session_id, time.time(), record))
+        except queue.Full:
+            with self._lock:
+                self.stats_counters["dropped"] += 1
+
+    def flush(self, timeout=5.0):
+        """Wait until queued records are written (used at shutdown and in tools)."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def stats(self):
+        with self._lock:
+            return {"queued": self._queue.qsize(), **self.stats_counters}
+
+    def path_for(self, session_id):
+        """Trace file of a session, see safe_file_name."""
+        return os.path.join(self.directory, f"{safe_file_name(session_id)}.jsonl")
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            # Group whatever else is queued so each file is opened once per batch
+            while len(batch) < 1000:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            by_session = {}
+            for session_id, timestamp, record in batch:
+                by_session.setdefault(session_id, []).append((timestamp, record))
+            for session_id, records in by_session.items():
+                self._write_records(session_id, records)
+
+            for _ in batch:
+                self._queue.task_done()
+
+    def _write_records(self, session_id, records):
+        path = self.path_for(session_id)
+        try:
+            lines = []
+            for timestamp, record in records:
+                if "message" in record:
+                    record = {**record, "message": serialize_message(record["message"])}
+                lines.append(json.dumps({"ts": timestamp, "session_id": session_id, **record}, default=str))
+            with open(path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+                size = f.tell()
+            with self._lock:
+                self.stats_counters["written"] += len(lines)
+            if size > self.max_bytes:
+                self._rotate(path)
+        except Exception as e:
+            print(f"Error writing trace for session {session_id}: {e}")
+            with self._lock:
+                self.stats_counters["errors"] += 1
+
+    def _rotate(self, path):
+        suffix = ".gz" if self.compress else ""
+        # trace.jsonl.1 is the newest rotated file
+        for index in range(self.backups - 1, 0, -1):
+            older = f"{path}.{index}{suffix}"
+            if os.path.exists(older):
+                os.replace(older, f"{path}.{index + 1}{suffix}")
+        if self.backups < 1:
+            os.remove(path)
+        elif self.compress:
+            with open(path, "rb") as source, gzip.open(f"{path}.1.gz", "wb") as target:
+                shutil.copyfileobj(source, target)
+            os.remove(path)
+        else:
+            os.replace(path, f"{path}.1")
+        with self._lock:
+            self.stats_counters["rotated"] += 1
@@ -0,0 +1,50 @@
+const maxWait = arguments[0];
+const quietWindow = arguments[1];
+// Optional extractor options: extract page content in the same call once settled
+const extractOptions = arguments[2];
+// Cooperative waits: time already waited in earlier calls, and whether to return
+// after a single check instead of polling until settled or maxWait
+const waitedBefore = arguments[3];
+const checkOnce = arguments[4];
+const done = arguments[arguments.length - 1];
+const start = performance.now() - waitedBefore;
+
+function checkSettled() {
+    const monitor = window.__settleMonitor;
+    const now = performance.now();
+    const waited = now - start;
+
+    // Require a full quiet window after the action, not just before it
+    const settled = (
+        document.readyState === 'complete' &&
+        monitor.pending <= 0 &&
+        waited >= quietWindow &&
+        now - monitor.lastMutation >= quietWindow &&
+        now - monitor.lastScroll >= quietWindow
+    );
+
+    if (settled || waited >= maxWait) {
+        const result = {
+            settled: settled,
+            waitedMs: Math.round(waited),
+            readyState: document.readyState,
+            pendingRequests: monitor.pending
+        };
+        if (extractOptions && window.__interactExtract) {
+            try {
+                result.page = window.__interactExtract(extractOptions);
+            } catch (e) {
+                // Leave it to a separate extraction call
+            }
+        }
+        done(result);
+        return;
+    }
+    if (checkOnce) {
+        done({ settled: false, pending: true, waitedMs: Math.round(waited) });
+        return;
+    }
+    setTimeout(checkSettled, 50);
+}
+
+checkSettled();